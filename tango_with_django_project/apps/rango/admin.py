@@ -1,6 +1,14 @@
+from django.conf.urls import url
 from django.contrib import admin
+from django.core.urlresolvers import reverse
+from django.http import HttpResponse
+from django.shortcuts import get_object_or_404
+from django.utils import timezone
+from django.utils.html import format_html
 
-from apps.rango.models import Category, Page, UserProfile
+from apps.rango.models import (
+    Category, DailyVisits, Page, QueuedTask, RequestProfile, UserProfile
+)
 
 
 class PageAdmin(admin.ModelAdmin):
@@ -11,6 +19,69 @@ class CategoryAdmin(admin.ModelAdmin):
     prepopulated_fields = {'slug': ('name',)}
 
 
+class DailyVisitsAdmin(admin.ModelAdmin):
+    list_display = ('date', 'visits')
+
+
+class QueuedTaskAdmin(admin.ModelAdmin):
+    list_display = ('name', 'status', 'attempts', 'created', 'run_at')
+    list_filter = ('status', 'name')
+    readonly_fields = ('name', 'arguments', 'attempts', 'created', 'started',
+                       'last_error')
+    actions = ['retry']
+
+    def retry(self, request, queryset):
+        queryset.update(status=QueuedTask.PENDING, run_at=timezone.now())
+    retry.short_description = 'Run the selected tasks again'
+
+
+class RequestProfileAdmin(admin.ModelAdmin):
+    list_display = ('created', 'view_name', 'method', 'path', 'duration_ms',
+                    'user', 'sampled', 'download_link')
+    list_filter = ('view_name', 'sampled')
+    search_fields = ('path',)
+    fields = ('created', 'view_name', 'method', 'path', 'duration_ms', 'user',
+              'sampled', 'download_link', 'summary')
+    readonly_fields = fields
+
+    def duration_ms(self, obj):
+        return '{0:.1f}'.format(obj.duration * 1000)
+    duration_ms.short_description = 'Duration (ms)'
+    duration_ms.admin_order_field = 'duration'
+
+    def download_link(self, obj):
+        return format_html('<a href="{0}">Download</a>', reverse(
+            'admin:rango_requestprofile_download', args=[obj.pk]))
+    download_link.short_description = 'Profile'
+
+    def has_add_permission(self, request):
+        return False
+
+    def get_urls(self):
+        return [
+            url(r'^(\d+)/download/$',
+                self.admin_site.admin_view(self.download),
+                name='rango_requestprofile_download'),
+        ] + super(RequestProfileAdmin, self).get_urls()
+
+    def download(self, request, pk):
+        """
+        Serves the profile as a .prof file, for pstats, snakeviz and the like.
+        """
+        if not self.has_change_permission(request):
+            return HttpResponse(status=403)
+        profile = get_object_or_404(RequestProfile, pk=pk)
+        response = HttpResponse(bytes(profile.stats),
+                                content_type='application/octet-stream')
+        response['Content-Disposition'] = (
+            'attachment; filename="{0}-{1}.prof"'.format(
+                profile.view_name.replace(':', '-'), profile.pk))
+        return response
+
+
 admin.site.register(Category, CategoryAdmin)
+admin.site.register(DailyVisits, DailyVisitsAdmin)
 admin.site.register(Page, PageAdmin)
+admin.site.register(QueuedTask, QueuedTaskAdmin)
+admin.site.register(RequestProfile, RequestProfileAdmin)
 admin.site.register(UserProfile)
@@ -3,3 +3,7 @@ from django.apps import AppConfig
 
 class RangoConfig(AppConfig):
     name = 'apps.rango'
+
+    def ready(self):
+        # Connect the signal handlers.
+        from . import signals  # noqa
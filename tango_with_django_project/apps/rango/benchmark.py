@@ -0,0 +1,581 @@
+"""
+Synthetic datasets and an end-to-end benchmark for the rango views.
+
+seed_dataset() fills the database with categories and pages whose likes,
+views and page counts follow a power law, so a few categories are far more
+popular than the rest. run_benchmark() then drives the views through the
+Django test client or a local WSGI server, picking categories and pages
+with the same skew, and reports latency percentiles, queries per request
+and throughput. Results are stored as JSON lines tagged with the current
+git commit, so that runs can be compared between commits.
+
+See "manage.py seed_rango" and "manage.py benchmark_rango".
+"""
+import bisect
+import datetime
+import json
+import os
+import random
+import subprocess
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from wsgiref.simple_server import WSGIRequestHandler, WSGIServer, make_server
+
+import requests
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.urlresolvers import reverse
+from django.core.wsgi import get_wsgi_application
+from django.db import connection, transaction
+from django.db.models import Max
+from django.template.defaultfilters import slugify
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.utils.crypto import get_random_string
+
+from . import webhose_search
+from .category_stats import recount_page_stats
+from .generations import bump_generation
+from .models import (
+    Category, CategoryDailyStats, CategoryLikeShard, CategoryTrend,
+    HourlyClicks, Page, PageClick, PageDailyStats, PageTrend
+)
+from .webhose_search import WebhoseClient
+
+
+WORDS = (
+    'Python', 'Django', 'Flask', 'Bottle', 'Pyramid', 'Tornado', 'Twisted',
+    'Celery', 'Redis', 'Postgres', 'SQLite', 'MySQL', 'Nginx', 'Docker',
+    'Linux', 'Testing', 'Security', 'Templates', 'Forms', 'Models', 'Views',
+    'Caching', 'Search', 'Deployment', 'JavaScript', 'CSS', 'HTML', 'REST',
+    'Async', 'Packaging',
+)
+
+BENCHMARK_USER = 'rango-benchmark'
+
+
+# Datasets
+# --------------------------------------------------------------
+
+def zipf_weights(n, skew):
+    return [1.0 / (rank ** skew) for rank in range(1, n + 1)]
+
+
+def allocate(total, weights):
+    """
+    Splits total into whole numbers in proportion to weights.
+    """
+    scale = float(total) / sum(weights)
+    counts = [int(w * scale) for w in weights]
+    for i in range(total - sum(counts)):
+        counts[i % len(counts)] += 1
+    return counts
+
+
+def clear_dataset():
+    """
+    Deletes every category and page with one statement per table, without
+    loading the rows or sending signals. Only meant for benchmark databases.
+    """
+    with transaction.atomic(), connection.cursor() as cursor:
+        for model in (PageClick, HourlyClicks, PageTrend, CategoryTrend,
+                      PageDailyStats, CategoryDailyStats, Page,
+                      CategoryLikeShard, Category):
+            cursor.execute('DELETE FROM {0}'.format(
+                connection.ops.quote_name(model._meta.db_table)))
+    bump_generation('categories')
+
+
+def seed_dataset(categories=1000, pages=100000, skew=1.1, seed=0,
+                 batch_size=5000, max_likes=100000, log=None):
+    """
+    Adds categories and pages with power-law popularity: the category of
+    popularity rank r gets likes, views and pages in proportion to 1/r**skew,
+    and page views within each category follow a Pareto distribution.
+    Returns (categories, pages) created.
+
+    Rows are written with bulk_create() in batches of batch_size, without
+    updating the search index; run "manage.py rebuild_search_index"
+    afterwards if the benchmark should search them.
+    """
+    rng = random.Random(seed)
+    weights = zipf_weights(categories, skew)
+    page_counts = allocate(pages, weights)
+
+    ranks = list(range(categories))
+    rng.shuffle(ranks)
+
+    last_id = Category.objects.aggregate(m=Max('pk'))['m'] or 0
+    objs = []
+    for i, rank in enumerate(ranks):
+        name = '{0} {1}'.format(WORDS[i % len(WORDS)], last_id + i + 1)
+        likes = int(max_likes * weights[rank])
+        objs.append(Category(name=name, slug=slugify(name),
+                             likes=likes, views=likes * 2))
+    for batch in _batched(objs, batch_size):
+        with transaction.atomic():
+            Category.objects.bulk_create(batch)
+
+    category_ids = list(Category.objects.filter(pk__gt=last_id)
+                        .order_by('pk').values_list('pk', flat=True))
+    if log:
+        log('Created {0} categories.'.format(len(category_ids)))
+
+    created = 0
+    batch = []
+    for category_id, rank in zip(category_ids, ranks):
+        for n in range(page_counts[rank]):
+            batch.append(Page(
+                category_id=category_id,
+                title='Page {0} of {1}'.format(n + 1, category_id),
+                url='http://example.com/{0}/{1}/'.format(category_id, n + 1),
+                views=int(rng.paretovariate(skew)) - 1,
+            ))
+            if len(batch) == batch_size:
+                created += _create_pages(batch)
+                batch = []
+                if log and created % (batch_size * 20) == 0:
+                    log('Created {0} pages.'.format(created))
+    if batch:
+        created += _create_pages(batch)
+
+    recount_page_stats(category_ids)
+    bump_generation('categories')
+    return len(category_ids), created
+
+
+def _create_pages(batch):
+    with transaction.atomic():
+        Page.objects.bulk_create(batch)
+    return len(batch)
+
+
+def _batched(items, size):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+class Sampler(object):
+    """
+    Picks categories, pages and search terms for requests, favouring the
+    most popular ones with the same power law the dataset was made with.
+    Only the top max_items of each are considered, so setting up a sampler
+    stays cheap on large tables.
+    """
+
+    def __init__(self, skew=1.1, seed=0, max_items=10000):
+        self.rng = random.Random(seed)
+        self.categories = list(Category.objects.order_by('-likes')
+                               .values_list('id', 'slug', 'name')[:max_items])
+        self.page_ids = list(Page.objects.order_by('-views')
+                             .values_list('id', flat=True)[:max_items])
+        self._category_cdf = self._cdf(len(self.categories), skew)
+        self._page_cdf = self._cdf(len(self.page_ids), skew)
+
+    @staticmethod
+    def _cdf(n, skew):
+        total, cdf = 0.0, []
+        for w in zipf_weights(n, skew):
+            total += w
+            cdf.append(total)
+        return cdf
+
+    def _pick(self, items, cdf):
+        if not items:
+            return None
+        i = bisect.bisect_left(cdf, self.rng.random() * cdf[-1])
+        return items[min(i, len(items) - 1)]
+
+    def category(self):
+        return self._pick(self.categories, self._category_cdf) or (0, 'none', 'none')
+
+    def page_id(self):
+        return self._pick(self.page_ids, self._page_cdf) or 0
+
+    def prefix(self):
+        name = self.category()[2]
+        return name[:self.rng.randint(1, min(4, len(name)))]
+
+    def query(self):
+        return self.category()[2].split()[0]
+
+
+# Scenarios
+# --------------------------------------------------------------
+
+# Each scenario returns (method, path, data) for one request. Requests are
+# sent as a logged-in user, as like_category needs one.
+SCENARIOS = OrderedDict([
+    ('index', lambda s: ('get', reverse('rango:index'), None)),
+    ('show_category', lambda s: (
+        'get', reverse('rango:show_category', args=[s.category()[1]]), None)),
+    ('suggest_category', lambda s: (
+        'get', reverse('rango:suggest_category'),
+        {'suggestion': s.prefix()})),
+    ('track_url', lambda s: (
+        'get', reverse('rango:goto'), {'page_id': s.page_id()})),
+    ('like_category', lambda s: (
+        'get', reverse('rango:like_category'),
+        {'category_id': s.category()[0]})),
+    ('search', lambda s: (
+        'post', reverse('rango:search'), {'query': s.query()})),
+    ('api_categories', lambda s: (
+        'get', reverse('rango:category-list'), None)),
+    ('api_category_detail', lambda s: (
+        'get', reverse('rango:category-detail', args=[s.category()[0]]), None)),
+    ('api_pages', lambda s: ('get', reverse('rango:page-list'), None)),
+])
+
+
+def get_benchmark_user():
+    user, created = User.objects.get_or_create(username=BENCHMARK_USER)
+    if created:
+        user.set_unusable_password()
+        user.save()
+    return user
+
+
+class ClientTransport(object):
+    """
+    Sends requests through the Django test client, in this thread, counting
+    the queries each one makes.
+    """
+    name = 'client'
+
+    def __init__(self):
+        self.user = get_benchmark_user()
+        self._local = threading.local()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+    def _client(self):
+        client = getattr(self._local, 'client', None)
+        if client is None:
+            client = self._local.client = Client()
+            client.force_login(self.user)
+        return client
+
+    def request(self, method, path, data):
+        with CaptureQueriesContext(connection) as queries:
+            response = getattr(self._client(), method)(path, data or {})
+        return response.status_code, len(queries)
+
+
+class _ThreadingWSGIServer(ThreadingMixIn, WSGIServer):
+    daemon_threads = True
+
+
+class _QuietWSGIRequestHandler(WSGIRequestHandler):
+
+    def log_message(self, *args):
+        pass
+
+
+class QueryCountingApp(object):
+    """
+    Wraps a WSGI application to add the number of queries each request made
+    as an X-Rango-Queries response header.
+    """
+
+    def __init__(self, application):
+        self.application = application
+
+    def __call__(self, environ, start_response):
+        with CaptureQueriesContext(connection) as queries:
+            body = []
+
+            def counting_start_response(status, headers, exc_info=None):
+                body.append((status, headers, exc_info))
+
+            content = b''.join(self.application(environ, counting_start_response))
+        status, headers, exc_info = body[0]
+        headers = list(headers) + [('X-Rango-Queries', str(len(queries)))]
+        start_response(status, headers, exc_info)
+        return [content]
+
+
+class WSGITransport(object):
+    """
+    Serves the project from a threaded wsgiref server on a local port and
+    sends real HTTP requests to it, with keep-alive sessions per thread.
+    """
+    name = 'wsgi'
+
+    def __init__(self):
+        self.user = get_benchmark_user()
+        self._local = threading.local()
+        self.server = None
+
+    def __enter__(self):
+        self.server = make_server(
+            '127.0.0.1', 0, QueryCountingApp(get_wsgi_application()),
+            server_class=_ThreadingWSGIServer,
+            handler_class=_QuietWSGIRequestHandler)
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+        # Log in by handing the server a session made here.
+        client = Client()
+        client.force_login(self.user)
+        self.cookies = {
+            settings.SESSION_COOKIE_NAME: client.cookies[settings.SESSION_COOKIE_NAME].value,
+            settings.CSRF_COOKIE_NAME: get_random_string(32),
+        }
+        return self
+
+    def __exit__(self, *exc_info):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _session(self):
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = self._local.session = requests.Session()
+            session.cookies.update(self.cookies)
+            session.headers['X-CSRFToken'] = self.cookies[settings.CSRF_COOKIE_NAME]
+        return session
+
+    def request(self, method, path, data):
+        url = 'http://127.0.0.1:{0}{1}'.format(self.server.server_port, path)
+        if method == 'get':
+            response = self._session().get(url, params=data, allow_redirects=False)
+        else:
+            response = self._session().post(url, data=data, allow_redirects=False,
+                                            headers={'Referer': url})
+        return response.status_code, int(response.headers.get('X-Rango-Queries', 0))
+
+
+TRANSPORTS = {
+    'client': ClientTransport,
+    'wsgi': WSGITransport,
+}
+
+
+# Webhose stub
+# --------------------------------------------------------------
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class _StubWebhoseHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        body = json.dumps({'posts': [
+            {'title': 'Result {0}'.format(i), 'url': 'http://example.com/',
+             'text': 'x' * 200}
+            for i in range(10)
+        ]}).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class StubWebhose(object):
+    """
+    Serves canned Webhose search results from a local port and points the
+    Webhose client at it while in use, so that searches don't leave the
+    machine.
+    """
+
+    def __enter__(self):
+        self.server = _ThreadingHTTPServer(('127.0.0.1', 0), _StubWebhoseHandler)
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+        fd, self.key_path = tempfile.mkstemp()
+        with os.fdopen(fd, 'w') as f:
+            f.write('benchmark\n')
+
+        self.saved_client = webhose_search._client
+        webhose_search._client = WebhoseClient(
+            root_url='http://127.0.0.1:{0}/search'.format(self.server.server_port),
+            key_path=self.key_path)
+        return self
+
+    def __exit__(self, *exc_info):
+        webhose_search._client.close()
+        webhose_search._client = self.saved_client
+        self.server.shutdown()
+        self.server.server_close()
+        os.remove(self.key_path)
+
+
+# Running
+# --------------------------------------------------------------
+
+def percentile(values, p):
+    """
+    The nearest-rank percentile of a sorted list.
+    """
+    if not values:
+        return None
+    rank = max(1, int(round(p / 100.0 * len(values) + 0.5)))
+    return values[min(rank, len(values)) - 1]
+
+
+def run_scenario(transport, scenario, sampler, requests=200, warmup=20,
+                 concurrency=1):
+    """
+    Sends warmup requests, then requests more, from concurrency threads.
+    Returns a dictionary of statistics, with latencies in milliseconds.
+    """
+    make_request = SCENARIOS[scenario]
+    lock = threading.Lock()
+    latencies, query_counts = [], []
+    errors = [0]
+
+    def send(count, record):
+        for i in range(count):
+            with lock:
+                method, path, data = make_request(sampler)
+            started = time.perf_counter()
+            try:
+                status, queries = transport.request(method, path, data)
+            except Exception:
+                status, queries = 599, 0
+            elapsed = (time.perf_counter() - started) * 1000
+            if record:
+                with lock:
+                    latencies.append(elapsed)
+                    query_counts.append(queries)
+                    if status >= 400:
+                        errors[0] += 1
+
+    def send_in_thread(count):
+        try:
+            send(count, True)
+        finally:
+            connection.close()
+
+    send(warmup, False)
+
+    started = time.perf_counter()
+    if concurrency == 1:
+        # Stay in this thread, and so on this thread's database connection.
+        send(requests, True)
+    else:
+        threads = [
+            threading.Thread(target=send_in_thread, args=(
+                requests // concurrency + (i < requests % concurrency),))
+            for i in range(concurrency)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    wall = time.perf_counter() - started
+
+    latencies.sort()
+    return OrderedDict([
+        ('scenario', scenario),
+        ('requests', len(latencies)),
+        ('errors', errors[0]),
+        ('p50_ms', round(percentile(latencies, 50), 3)),
+        ('p90_ms', round(percentile(latencies, 90), 3)),
+        ('p99_ms', round(percentile(latencies, 99), 3)),
+        ('max_ms', round(latencies[-1], 3)),
+        ('mean_ms', round(sum(latencies) / len(latencies), 3)),
+        ('queries', round(float(sum(query_counts)) / len(query_counts), 2)),
+        ('throughput', round(len(latencies) / wall, 1)),
+    ])
+
+
+def run_benchmark(scenarios=None, transport='client', requests=200, warmup=20,
+                  concurrency=1, skew=1.1, seed=0, log=None):
+    """
+    Runs each scenario in turn and returns a run: a dictionary describing
+    the dataset and environment, with the statistics for each scenario
+    under 'results'.
+    """
+    scenarios = scenarios or list(SCENARIOS)
+    sampler = Sampler(skew=skew, seed=seed)
+    results = []
+
+    with StubWebhose(), TRANSPORTS[transport]() as t:
+        for scenario in scenarios:
+            result = run_scenario(t, scenario, sampler, requests=requests,
+                                  warmup=warmup, concurrency=concurrency)
+            if log:
+                log(result)
+            results.append(result)
+
+    return OrderedDict([
+        ('commit', git_revision()),
+        ('time', datetime.datetime.utcnow().isoformat() + 'Z'),
+        ('transport', transport),
+        ('concurrency', concurrency),
+        ('database', connection.vendor),
+        ('categories', Category.objects.count()),
+        ('pages', Page.objects.count()),
+        ('results', results),
+    ])
+
+
+# Storing and comparing results
+# --------------------------------------------------------------
+
+def git_revision():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=settings.BASE_DIR, stderr=subprocess.DEVNULL,
+        ).decode('ascii').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def save_run(path, run):
+    with open(path, 'a') as f:
+        f.write(json.dumps(run) + '\n')
+
+
+def load_runs(path):
+    if not os.path.exists(path):
+        return []
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def previous_run(runs, run):
+    """
+    Returns the latest stored run comparable with run: same transport,
+    concurrency and database, from a different commit. Runs without a
+    commit are compared with the latest comparable run.
+    """
+    for other in reversed(runs):
+        if (other['transport'], other['concurrency'], other.get('database')) != \
+                (run['transport'], run['concurrency'], run['database']):
+            continue
+        if run['commit'] is None or other['commit'] != run['commit']:
+            return other
+    return None
+
+
+def compare_runs(previous, run, field='p50_ms'):
+    """
+    Returns {scenario: relative change in field}, e.g. 0.25 for 25% slower.
+    """
+    before = {r['scenario']: r for r in previous['results']}
+    changes = OrderedDict()
+    for result in run['results']:
+        old = before.get(result['scenario'])
+        if old and old[field]:
+            changes[result['scenario']] = (result[field] - old[field]) / old[field]
+    return changes
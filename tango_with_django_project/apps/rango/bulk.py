@@ -0,0 +1,307 @@
+import json
+from collections import namedtuple
+
+from django.core.urlresolvers import Resolver404, resolve
+from django.db import transaction
+from django.db.models import Case, Max, Value, When
+from django.dispatch import Signal
+from django.template.defaultfilters import slugify
+from django.utils import timezone
+from django.utils.six.moves.urllib.parse import urlparse
+
+from .likes import create_shards
+from .models import Category, Page
+
+
+# Sent after rows have been written with bulk_create() or update(), which
+# don't send post_save. The sender is the model class, and pks is a list of
+# the primary keys of every row that was created or updated.
+bulk_saved = Signal(providing_args=['pks'])
+
+MODES = ('create', 'upsert', 'skip')
+
+BulkResult = namedtuple('BulkResult', ['created', 'updated', 'skipped', 'errors'])
+
+
+def iter_ndjson(lines):
+    """
+    Yields one item per non-blank line of newline-delimited JSON. Lines that
+    aren't valid JSON are yielded as a ValueError, so they can be reported
+    alongside the other per-item errors instead of failing the whole stream.
+    """
+    for line in lines:
+        if isinstance(line, bytes):
+            line = line.decode('utf-8')
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError as e:
+            yield e
+
+
+def batches(iterable, size):
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def category_pk_from_ref(ref):
+    """
+    Turns a category reference - a primary key, or an API hyperlink to the
+    category such as PageSerializer produces - into a primary key.
+    Returns None if it is neither.
+    """
+    if isinstance(ref, int):
+        return ref
+    if not isinstance(ref, str):
+        return None
+    if ref.isdigit():
+        return int(ref)
+    try:
+        match = resolve(urlparse(ref).path)
+    except Resolver404:
+        return None
+    if match.view_name != 'rango:category-detail':
+        return None
+    try:
+        return int(match.kwargs['pk'])
+    except (KeyError, ValueError):
+        return None
+
+
+def _case(values, output_field=None):
+    """
+    Builds CASE WHEN pk = ... THEN ... END from a {pk: value} dictionary, so
+    that a batch of rows can be given different values in one UPDATE.
+    """
+    whens = [When(pk=pk, then=Value(value)) for pk, value in values.items()]
+    return Case(*whens, output_field=output_field)
+
+
+class BulkWriter(object):
+    """
+    Writes validated items in batches with bulk_create(). Rows that already
+    exist (matched on the model's natural key) are either updated in a
+    single UPDATE per field ('upsert'), left alone ('skip'), or - if the key
+    isn't unique in the database - created again ('create').
+
+    Subclasses define model, key(obj), existing(objs) and update_fields,
+    and may override created_rows(objs) to follow up on the new rows.
+    """
+    model = None
+    update_fields = ()
+    # Whether the database enforces the natural key as unique.
+    unique = False
+
+    def __init__(self, mode='create'):
+        if mode not in MODES:
+            raise ValueError('mode must be one of {0}'.format(', '.join(MODES)))
+        self.mode = mode
+        self.created = 0
+        self.updated = 0
+        self.skipped = 0
+
+    def key(self, obj):
+        raise NotImplementedError
+
+    def existing(self, objs):
+        """
+        Returns a {key: pk} dictionary of rows that already exist for objs.
+        """
+        raise NotImplementedError
+
+    def created_rows(self, objs):
+        """
+        Called with the instances that were just created with bulk_create(),
+        which doesn't send post_save for them.
+        """
+        pass
+
+    def write(self, objs):
+        """
+        Writes one batch of unsaved model instances. Returns a dictionary of
+        {position in objs: errors} for the instances that were rejected.
+        """
+        rejected = {}
+        if not objs:
+            return rejected
+
+        keyed = self.mode != 'create' or self.unique
+        existing = self.existing(objs) if keyed else {}
+
+        new, changed, seen = [], {}, {}
+        for position, obj in enumerate(objs):
+            key = self.key(obj) if keyed else None
+            pk = existing.get(key)
+
+            if pk is None and key in seen:
+                # The same row appears twice in this batch; the later one wins.
+                new[seen[key]] = obj
+                self.skipped += 1
+            elif pk is None:
+                if keyed:
+                    seen[key] = len(new)
+                new.append(obj)
+            elif self.mode == 'upsert':
+                changed[pk] = obj
+            elif self.mode == 'skip':
+                self.skipped += 1
+            else:
+                rejected[position] = {'non_field_errors': ['Already exists.']}
+
+        pks = []
+        if new:
+            # bulk_create() doesn't give us the new primary keys on every
+            # database, but they are always above the current maximum.
+            # (Rows inserted concurrently may be included too, which is
+            # harmless for the receivers of bulk_saved.)
+            last_pk = self.model.objects.aggregate(m=Max('pk'))['m'] or 0
+            self.model.objects.bulk_create(new)
+            pks.extend(self.model.objects.filter(pk__gt=last_pk)
+                       .values_list('pk', flat=True))
+            self.created += len(new)
+            self.created_rows(new)
+
+        if changed:
+            updates = {}
+            for field in self.update_fields:
+                output_field = self.model._meta.get_field(field)
+                updates[field] = _case(
+                    {pk: getattr(obj, field) for pk, obj in changed.items()},
+                    output_field=output_field)
+            # update() doesn't set auto_now fields.
+            updates['updated_at'] = timezone.now()
+            self.model.objects.filter(pk__in=list(changed)).update(**updates)
+            pks.extend(changed)
+            self.updated += len(changed)
+
+        if pks:
+            bulk_saved.send(sender=self.model, pks=pks)
+        return rejected
+
+    def result(self, errors):
+        return BulkResult(self.created, self.updated, self.skipped, errors)
+
+
+class CategoryWriter(BulkWriter):
+    """
+    Categories are matched on their name. Their slugs are unique too, and
+    different names can have the same slug ('C++' and 'C', say), so an item
+    whose slug is already taken by another name, in the database or earlier
+    in the batch, is rejected.
+    """
+    model = Category
+    update_fields = ('views', 'likes')
+    unique = True
+
+    def key(self, obj):
+        return obj.name
+
+    def existing(self, objs):
+        names = [obj.name for obj in objs]
+        return dict(Category.objects.filter(name__in=names)
+                    .values_list('name', 'pk'))
+
+    def created_rows(self, objs):
+        # Normally done by the post_save signal.
+        create_shards(*self.existing(objs).values())
+
+    def write(self, objs):
+        # bulk_create() doesn't call Category.save(), which sets the slug.
+        for obj in objs:
+            obj.slug = slugify(obj.name)
+
+        taken = dict(Category.objects.filter(slug__in=set(obj.slug for obj in objs))
+                     .values_list('slug', 'name'))
+        rejected, kept, positions = {}, [], []
+        for position, obj in enumerate(objs):
+            name = taken.setdefault(obj.slug, obj.name)
+            if name == obj.name:
+                kept.append(obj)
+                positions.append(position)
+            else:
+                rejected[position] = {'name': [
+                    'The category {0!r} has the same slug.'.format(name)]}
+
+        written = super(CategoryWriter, self).write(kept)
+        for position, errors in written.items():
+            rejected[positions[position]] = errors
+        return rejected
+
+
+class PageWriter(BulkWriter):
+    """
+    Pages are matched on (category, title), as in populate_rango.
+    """
+    model = Page
+    update_fields = ('url', 'views')
+
+    def key(self, obj):
+        return obj.category_id, obj.title
+
+    def existing(self, objs):
+        category_ids = set(obj.category_id for obj in objs)
+        titles = set(obj.title for obj in objs)
+        rows = (Page.objects.filter(category_id__in=category_ids, title__in=titles)
+                .values_list('category_id', 'title', 'pk'))
+        return {(category_id, title): pk for category_id, title, pk in rows}
+
+
+def bulk_write(items, serializer_class, writer, to_instance, batch_size=500,
+               resolve_batch=None):
+    """
+    Validates and writes a stream of items in batches, all in one
+    transaction. Returns a BulkResult, whose errors are a list of
+    {'index': n, 'errors': ...} dictionaries for the items left out.
+
+    Each item is validated with serializer_class. resolve_batch, if given,
+    is called with each batch's validated data and returns a dictionary of
+    {position in batch: errors} for items it rejects; it can look up related
+    rows for the whole batch at once. to_instance then turns validated data
+    into an unsaved model instance.
+    """
+    errors = []
+    with transaction.atomic():
+        for start, batch in _numbered_batches(items, batch_size):
+            valid = []
+            for i, item in enumerate(batch):
+                if isinstance(item, ValueError):
+                    errors.append({'index': start + i,
+                                   'errors': {'non_field_errors': [str(item)]}})
+                    continue
+                serializer = serializer_class(data=item)
+                if serializer.is_valid():
+                    valid.append((start + i, serializer.validated_data))
+                else:
+                    errors.append({'index': start + i, 'errors': serializer.errors})
+
+            rejected = {}
+            if resolve_batch is not None:
+                rejected = resolve_batch([data for index, data in valid])
+
+            objs, indexes = [], []
+            for position, (index, data) in enumerate(valid):
+                if position in rejected:
+                    errors.append({'index': index, 'errors': rejected[position]})
+                else:
+                    objs.append(to_instance(data))
+                    indexes.append(index)
+
+            rejected = writer.write(objs)
+            for position, item_errors in sorted(rejected.items()):
+                errors.append({'index': indexes[position], 'errors': item_errors})
+    return writer.result(errors)
+
+
+def _numbered_batches(items, size):
+    start = 0
+    for batch in batches(items, size):
+        yield start, batch
+        start += len(batch)
@@ -0,0 +1,162 @@
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Q
+
+from .generations import bump_generation, get_generation
+from .metrics import record_cache_lookup
+from .models import Category, Page
+
+
+CATEGORY_FIELDS = ('id', 'name', 'slug', 'likes', 'views', 'updated_at',
+                   'page_count', 'total_page_views')
+PAGE_FIELDS = ('id', 'title', 'url', 'views')
+
+
+def get_page_size():
+    return getattr(settings, 'RANGO_CATEGORY_PAGE_SIZE', 20)
+
+
+def parse_cursor(cursor):
+    """
+    Parses a '<views>_<id>' cursor, as made by make_cursor().
+    Returns None for a missing or malformed cursor.
+    """
+    try:
+        views, pk = cursor.split('_')
+        return int(views), int(pk)
+    except (AttributeError, ValueError):
+        return None
+
+
+def make_cursor(page):
+    return '{0}_{1}'.format(page['views'], page['id'])
+
+
+def _cache_key(slug):
+    # Changing any category bumps 'categories', which also takes care of
+    # renamed categories; adding pages or flushing view counts only bumps
+    # the category's own generation.
+    return 'rango:category:{0}:{1}:{2}'.format(
+        get_generation('categories'),
+        get_generation('category:' + slug),
+        slug)
+
+
+def fetch_category_page(slug, after=None, size=None):
+    """
+    Fetches a category and a page of its pages, ordered by (-views, -id).
+    The category comes along with its pages in the same query; it is only
+    looked up on its own when it has no pages (left) to show.
+
+    after is a (views, id) pair from a cursor: only pages after it in that
+    order are returned, which keeps deep pages as cheap as the first one.
+
+    Returns (category, pages, next_cursor) with the category and pages as
+    dictionaries, or (None, None, None) if there is no such category.
+    """
+    size = size or get_page_size()
+
+    pages = Page.objects.filter(category__slug=slug)
+    if after is not None:
+        views, pk = after
+        pages = pages.filter(Q(views__lt=views) | Q(views=views, id__lt=pk))
+
+    fields = PAGE_FIELDS + tuple('category__' + f for f in CATEGORY_FIELDS)
+    rows = list(pages.order_by('-views', '-id').values(*fields)[:size + 1])
+
+    if rows:
+        category = {f: rows[0]['category__' + f] for f in CATEGORY_FIELDS}
+    else:
+        category = Category.objects.filter(slug=slug).values(*CATEGORY_FIELDS).first()
+        if category is None:
+            return None, None, None
+
+    pages = [{f: row[f] for f in PAGE_FIELDS} for row in rows[:size]]
+    next_cursor = make_cursor(pages[-1]) if len(rows) > size else None
+    return category, pages, next_cursor
+
+
+def get_category_page(slug, after=None):
+    """
+    Like fetch_category_page, but the first page of each category is cached
+    until the category or its pages change, or view counts change which
+    pages it shows or their order (see invalidate_reordered_category_pages).
+    """
+    if after is not None:
+        return fetch_category_page(slug, after)
+
+    key = _cache_key(slug)
+    cached = cache.get(key)
+    record_cache_lookup('category_page', cached is not None)
+    if cached is None:
+        cached = fetch_category_page(slug)
+        cache.set(key, cached,
+                  getattr(settings, 'RANGO_CATEGORY_CACHE_TIMEOUT', 300))
+    return cached
+
+
+def invalidate_category_page(slug):
+    bump_generation('category:' + slug)
+
+
+def invalidate_category_pages_for(page_ids):
+    """
+    Invalidates the cached category pages showing any of the given pages.
+    """
+    slugs = (Category.objects.filter(page__id__in=list(page_ids))
+             .values_list('slug', flat=True).distinct())
+    for slug in slugs:
+        invalidate_category_page(slug)
+
+
+def _reordered(pages, next_cursor, views, incremented):
+    """
+    Whether the cached pages, with the current view counts in views, are no
+    longer the first ones in (-views, -id) order: because they are out of
+    order, or because one of the incremented pages not shown now belongs
+    among them.
+    """
+    order = [(views.get(page['id'], page['views']), page['id']) for page in pages]
+    if order != sorted(order, reverse=True):
+        return True
+    if next_cursor is None:
+        # Every page of the category is shown already.
+        return False
+    shown = set(page['id'] for page in pages)
+    return any((views[pk], pk) > order[-1] for pk in incremented if pk not in shown)
+
+
+def invalidate_reordered_category_pages(page_ids):
+    """
+    Called once new view counts of the given pages have been written.
+    Invalidates the cached first pages of their categories that should now
+    show other pages, or the same ones in another order. The others are
+    left to expire after RANGO_CATEGORY_CACHE_TIMEOUT, and until then show
+    view counts that may be that many seconds old.
+    """
+    incremented = defaultdict(list)
+    views = {}
+    for pk, page_views, slug in (Page.objects.filter(pk__in=list(page_ids))
+                                 .values_list('pk', 'views', 'category__slug')):
+        incremented[slug].append(pk)
+        views[pk] = page_views
+
+    cached = {}
+    for slug in incremented:
+        entry = cache.get(_cache_key(slug))
+        if entry is None or entry[0] is None:
+            # Nothing to compare with, but the page cache and ETags use
+            # the same generation, and may still have the old order.
+            invalidate_category_page(slug)
+        else:
+            cached[slug] = entry
+
+    shown = set(page['id'] for _, pages, _ in cached.values() for page in pages)
+    views.update(Page.objects.filter(pk__in=list(shown - set(views)))
+                 .values_list('pk', 'views'))
+
+    for slug, (category, pages, next_cursor) in cached.items():
+        if _reordered(pages, next_cursor, views, incremented[slug]):
+            invalidate_category_page(slug)
@@ -0,0 +1,101 @@
+from collections import defaultdict
+
+from django.db.models import Count, F, Sum
+
+from .models import Category, Page
+
+
+def add_page_stats(deltas, touched=None):
+    """
+    Adds to Category.page_count and Category.total_page_views, given a
+    {category_id: (pages, views)} dictionary of changes. If touched is given,
+    updated_at is set to it in the same UPDATE, so the totals never change
+    without the category's Last-Modified time.
+
+    The deltas for a page save come from the page as it was read before the
+    save, so concurrent writes to one page can leave the totals off; they
+    are set right by "manage.py recount_categories".
+    """
+    for category_id, (pages, views) in deltas.items():
+        changes = {}
+        if pages or views:
+            changes['page_count'] = F('page_count') + pages
+            changes['total_page_views'] = F('total_page_views') + views
+        if touched is not None:
+            changes['updated_at'] = touched
+        if changes:
+            Category.objects.filter(pk=category_id).update(**changes)
+
+
+def page_change_deltas(previous, current):
+    """
+    Returns the deltas for add_page_stats() when a page goes from previous
+    to current, each a (category_id, views) pair or None if the page didn't
+    (or no longer does) exist.
+    """
+    deltas = defaultdict(lambda: (0, 0))
+    for state, sign in ((previous, -1), (current, 1)):
+        if state is not None:
+            category_id, views = state
+            pages, total = deltas[category_id]
+            deltas[category_id] = (pages + sign, total + sign * views)
+    return dict(deltas)
+
+
+def page_categories(page_ids):
+    """
+    Returns a {page pk: category pk} dictionary for the given pages.
+    """
+    return dict(Page.objects.filter(pk__in=list(page_ids))
+                .values_list('pk', 'category_id'))
+
+
+def view_deltas(increments, categories):
+    """
+    Groups a {page pk: views} dictionary of view count increments by
+    category, as deltas for add_page_stats(). categories is a dictionary
+    from page_categories().
+    """
+    deltas = defaultdict(lambda: (0, 0))
+    for pk, n in increments.items():
+        if pk in categories:
+            category_id = categories[pk]
+            deltas[category_id] = (0, deltas[category_id][1] + n)
+    return dict(deltas)
+
+
+def recount_page_stats(category_ids=None, touched=None):
+    """
+    Sets page_count and total_page_views from the pages themselves, for the
+    given categories or for all of them. Used after bulk writes, whose
+    changes to view counts aren't known, and by "manage.py
+    recount_categories" to repair the totals. If touched is given, every
+    category's updated_at is set to it along with the totals.
+    Returns the number of categories recounted.
+    """
+    categories = Category.objects.all()
+    pages = Page.objects.all()
+    if category_ids is not None:
+        category_ids = list(category_ids)
+        categories = categories.filter(pk__in=category_ids)
+        pages = pages.filter(category_id__in=category_ids)
+
+    totals = {
+        row['category_id']: (row['pages'], row['views'] or 0)
+        for row in pages.order_by().values('category_id')
+        .annotate(pages=Count('id'), views=Sum('views'))
+    }
+
+    recounted = 0
+    for pk, page_count, total_page_views in categories.values_list(
+            'pk', 'page_count', 'total_page_views'):
+        counted = totals.get(pk, (0, 0))
+        changes = {}
+        if counted != (page_count, total_page_views):
+            changes = {'page_count': counted[0], 'total_page_views': counted[1]}
+        if touched is not None:
+            changes['updated_at'] = touched
+        if changes:
+            Category.objects.filter(pk=pk).update(**changes)
+        recounted += 1
+    return recounted
@@ -0,0 +1,115 @@
+import logging
+import threading
+import time
+
+
+logger = logging.getLogger(__name__)
+
+
+class CircuitBreaker(object):
+    """
+    A circuit breaker for calls to a remote service.
+
+    While CLOSED, calls go through and failures are counted; a call that
+    takes longer than slow_call_threshold seconds counts as a failure too.
+    After failure_threshold consecutive failures the breaker trips OPEN, and
+    allow_request() returns False until reset_timeout seconds have passed.
+    The breaker then goes HALF_OPEN and lets a single probe call through:
+    if it succeeds the breaker closes again, otherwise it re-opens.
+    """
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, name, failure_threshold=5, slow_call_threshold=2.0,
+                 reset_timeout=30):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.slow_call_threshold = slow_call_threshold
+        self.reset_timeout = reset_timeout
+
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = None
+        self._probing = False
+        self.trips = 0
+        self.rejected = 0
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._current_state()
+
+    def _current_state(self):
+        if (self._state == self.OPEN
+                and time.time() - self._opened_at >= self.reset_timeout):
+            self._state = self.HALF_OPEN
+            self._probing = False
+        return self._state
+
+    def allow_request(self):
+        """
+        Returns True if a call may be made now. In the HALF_OPEN state only
+        the first caller gets to make the probe call.
+        """
+        with self._lock:
+            state = self._current_state()
+            if state == self.CLOSED:
+                return True
+            if state == self.HALF_OPEN and not self._probing:
+                self._probing = True
+                return True
+            self.rejected += 1
+            return False
+
+    def record(self, duration, success=True):
+        """
+        Records the outcome of a call that allow_request() let through.
+        """
+        if success and duration > self.slow_call_threshold:
+            logger.warning('%s call took %.2fs (slow call threshold %.2fs)',
+                           self.name, duration, self.slow_call_threshold)
+            success = False
+
+        with self._lock:
+            state = self._current_state()
+            if success:
+                self._failures = 0
+                if state == self.HALF_OPEN:
+                    logger.info('%s circuit closed', self.name)
+                    self._state = self.CLOSED
+                    self._probing = False
+                return
+
+            if state == self.OPEN:
+                # A call that started before the circuit opened; it must
+                # not hold the circuit open for longer.
+                return
+            self._failures += 1
+            if state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                self._trip()
+
+    def _trip(self):
+        logger.error('%s circuit opened after %d failures',
+                     self.name, self._failures)
+        self._state = self.OPEN
+        self._opened_at = time.time()
+        self._probing = False
+        self.trips += 1
+
+    def reset(self):
+        with self._lock:
+            self._state = self.CLOSED
+            self._failures = 0
+            self._opened_at = None
+            self._probing = False
+
+    def stats(self):
+        with self._lock:
+            return {
+                'state': self._current_state(),
+                'failures': self._failures,
+                'trips': self.trips,
+                'rejected': self.rejected,
+            }
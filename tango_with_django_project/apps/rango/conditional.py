@@ -0,0 +1,62 @@
+import hashlib
+from functools import wraps
+
+from django.utils.cache import get_conditional_response
+from django.utils.http import quote_etag
+
+from .generations import get_generation
+
+
+def make_etag(request, generations):
+    """
+    Returns an ETag for a GET request to a page built from the cached data
+    in the given generations (see apps.rango.generations), without looking
+    at the data itself: bumping any of them changes the ETag.
+
+    The URL, the Accept header (for the API's content negotiation) and the
+    user are part of it, as pages show who is logged in.
+    """
+    user = request.user
+    parts = [
+        request.get_full_path(),
+        request.META.get('HTTP_ACCEPT', ''),
+        str(user.pk if user.is_authenticated else 0),
+    ]
+    parts.extend('{0}={1}'.format(name, get_generation(name))
+                 for name in generations)
+    return hashlib.md5('\n'.join(parts).encode('utf-8')).hexdigest()
+
+
+def generation_etag(generations):
+    """
+    Returns an etag_func for django.views.decorators.http.condition(), where
+    generations(*args, **kwargs) names the generations the page is built
+    from. Only GET and HEAD responses get an ETag.
+    """
+    def etag_func(request, *args, **kwargs):
+        if request.method not in ('GET', 'HEAD'):
+            return None
+        return make_etag(request, generations(*args, **kwargs))
+    return etag_func
+
+
+def etag_api(*generations):
+    """
+    Answers conditional GETs to a viewset's list or retrieve action with
+    an ETag from the given generations, so that an unchanged response is
+    a 304 without any queries or serialization.
+    """
+    def decorator(method):
+        @wraps(method)
+        def wrapper(self, request, *args, **kwargs):
+            etag = make_etag(request, generations)
+            not_modified = get_conditional_response(request, etag=etag)
+            if not_modified is not None:
+                return not_modified
+
+            response = method(self, request, *args, **kwargs)
+            if response.status_code == 200:
+                response['ETag'] = quote_etag(etag)
+            return response
+        return wrapper
+    return decorator
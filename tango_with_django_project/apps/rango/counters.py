@@ -0,0 +1,293 @@
+import atexit
+import logging
+import threading
+import time
+from collections import defaultdict
+
+from django.apps import apps
+from django.conf import settings
+from django.core.cache import caches
+from django.db import close_old_connections, transaction
+from django.db.models import F
+from django.dispatch import Signal
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+
+logger = logging.getLogger(__name__)
+
+# Sent when a counter buffer has written its increments to the database,
+# with the model class as the sender and increments as a {pk: n} dictionary.
+# It is sent inside the flush's transaction: if a receiver raises, the
+# increments are rolled back and kept for the next flush, along with anything
+# the receivers before it wrote.
+counters_flushed = Signal(providing_args=['field', 'increments'])
+
+# Cache backends whose incr() is atomic across every process sharing them
+# (or, for LocMemCache, across the threads of the one process using it).
+ATOMIC_INCR_CACHES = (
+    'django.core.cache.backends.locmem.',
+    'django.core.cache.backends.memcached.',
+    'django_redis.',
+    'redis_cache.',
+)
+
+DEFAULT_VIEW_COUNTER = {
+    'BACKEND': 'apps.rango.counters.LocMemCounterBuffer',
+    'OPTIONS': {},
+}
+
+
+class BaseCounterBuffer(object):
+    """
+    A write-behind buffer for an integer counter column, e.g. Page.views.
+
+    incr() only records the increment in the buffer. A background thread
+    flushes the buffer every flush_interval seconds, applying all pending
+    increments with UPDATE ... SET field = field + n statements (one per
+    distinct n, covering every row with that many pending increments).
+    A flush is also triggered early once max_pending increments are waiting,
+    which bounds how far the database can lag behind.
+
+    Subclasses implement _add(pk, n) and _drain(), which removes and returns
+    the pending increments as a {pk: n} dictionary, and may override apply()
+    to change how the increments are written. If touch names a timestamp
+    field, it is set to the current time on every row that is updated.
+    """
+
+    def __init__(self, model, field, flush_interval=5, max_pending=1000,
+                 touch=None):
+        self.model = model
+        self.field = field
+        self.touch = touch
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.flushes = 0
+        self._pending_total = 0
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+
+    def get_model(self):
+        if isinstance(self.model, str):
+            self.model = apps.get_model(self.model)
+        return self.model
+
+    def incr(self, pk, n=1):
+        self._add(int(pk), n)
+
+        with self._lock:
+            self._pending_total += n
+            over_limit = self._pending_total >= self.max_pending
+
+        self._ensure_flusher()
+        if over_limit:
+            self._wakeup.set()
+
+    def flush(self):
+        """
+        Writes all pending increments to the database and returns the number
+        of rows updated.
+        """
+        with self._lock:
+            self._pending_total = 0
+        increments = self._drain()
+        if not increments:
+            return 0
+
+        model = self.get_model()
+        try:
+            with transaction.atomic():
+                self.apply(model, increments)
+                counters_flushed.send(sender=model, field=self.field,
+                                      increments=increments)
+        except Exception:
+            # Put the increments back so they are retried on the next flush.
+            logger.exception('Could not flush %s.%s counters',
+                             model.__name__, self.field)
+            for pk, n in increments.items():
+                self._add(pk, n)
+            raise
+
+        self.flushes += 1
+        return len(increments)
+
+    def apply(self, model, increments):
+        """
+        Writes a {pk: n} dictionary of increments to the database.
+        """
+        # Group the rows by the size of their increment, so we issue one
+        # UPDATE per distinct increment rather than one per row.
+        by_amount = defaultdict(list)
+        for pk, n in increments.items():
+            by_amount[n].append(pk)
+
+        updates = {}
+        if self.touch:
+            updates[self.touch] = timezone.now()
+        for n, pks in by_amount.items():
+            updates[self.field] = F(self.field) + n
+            model.objects.filter(pk__in=pks).update(**updates)
+
+    def _ensure_flusher(self):
+        if self._thread is not None or not self.flush_interval:
+            return
+
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name='rango-counter-flusher')
+                self._thread.daemon = True
+                self._thread.start()
+                atexit.register(self.flush)
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception:
+                time.sleep(self.flush_interval)
+            finally:
+                close_old_connections()
+
+    def _add(self, pk, n):
+        raise NotImplementedError
+
+    def _drain(self):
+        raise NotImplementedError
+
+
+class LocMemCounterBuffer(BaseCounterBuffer):
+    """
+    Keeps pending increments in a dictionary in this process. Increments that
+    haven't been flushed are lost if the process dies.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(LocMemCounterBuffer, self).__init__(*args, **kwargs)
+        self._counts = defaultdict(int)
+        self._counts_lock = threading.Lock()
+
+    def _add(self, pk, n):
+        with self._counts_lock:
+            self._counts[pk] += n
+
+    def _drain(self):
+        with self._counts_lock:
+            counts, self._counts = self._counts, defaultdict(int)
+        return dict(counts)
+
+    def pending(self, pk):
+        with self._counts_lock:
+            return self._counts.get(int(pk), 0)
+
+
+class CacheCounterBuffer(BaseCounterBuffer):
+    """
+    Keeps pending increments in one of the caches in settings.CACHES, using
+    its incr/decr, so processes that share the cache add to the same counts.
+    This needs a cache whose incr/decr are atomic, such as memcached or
+    Redis; see has_atomic_incr(). Others, like the file and database caches,
+    read and write the value separately and lose concurrent increments.
+
+    Which rows have pending increments is only remembered in the process
+    that made them, and each process flushes just those rows. Increments
+    left behind by a process that exits without flushing (or that dies) stay
+    in the cache until some process increments the same row again and
+    flushes them along with its own.
+    """
+
+    def __init__(self, *args, **kwargs):
+        self.cache_alias = kwargs.pop('cache_alias', 'default')
+        super(CacheCounterBuffer, self).__init__(*args, **kwargs)
+        self._dirty = set()
+        self._dirty_lock = threading.Lock()
+
+    @property
+    def cache(self):
+        return caches[self.cache_alias]
+
+    def _key(self, pk):
+        return 'rango:counter:{0}:{1}:{2}'.format(
+            self.get_model()._meta.model_name, self.field, pk)
+
+    def _add(self, pk, n):
+        key = self._key(pk)
+        # add() is a no-op if the key already exists, so incr() is safe.
+        self.cache.add(key, 0, None)
+        try:
+            self.cache.incr(key, n)
+        except ValueError:
+            # The key was evicted between add() and incr().
+            self.cache.set(key, n, None)
+
+        with self._dirty_lock:
+            self._dirty.add(pk)
+
+    def _drain(self):
+        with self._dirty_lock:
+            dirty, self._dirty = self._dirty, set()
+
+        increments = {}
+        for pk in dirty:
+            key = self._key(pk)
+            n = self.cache.get(key)
+            if n:
+                # Subtract what we are about to write rather than deleting
+                # the key, so increments made meanwhile aren't lost.
+                self.cache.decr(key, n)
+                increments[pk] = n
+        return increments
+
+    def pending(self, pk):
+        return self.cache.get(self._key(pk)) or 0
+
+
+def has_atomic_incr(cache):
+    path = '{0}.{1}'.format(type(cache).__module__, type(cache).__name__)
+    return path.startswith(ATOMIC_INCR_CACHES)
+
+
+def make_counter_buffer(config, fallback, *args, **kwargs):
+    """
+    Creates the buffer named by config['BACKEND'] with the given arguments
+    and config['OPTIONS']. A CacheCounterBuffer on a cache without an
+    atomic incr() would lose increments, so fallback is created instead,
+    with a warning.
+    """
+    backend = import_string(config['BACKEND'])
+    options = dict(config.get('OPTIONS', {}))
+    if issubclass(backend, CacheCounterBuffer):
+        alias = options.get('cache_alias', 'default')
+        if not has_atomic_incr(caches[alias]):
+            logger.warning('The %r cache has no atomic incr(), so %s is '
+                           'used instead of %s', alias, fallback.__name__,
+                           backend.__name__)
+            backend = fallback
+            options.pop('cache_alias', None)
+    kwargs.update(options)
+    return backend(*args, **kwargs)
+
+
+_view_counter = None
+_view_counter_lock = threading.Lock()
+
+
+def get_view_counter():
+    """
+    Returns the buffer for Page.views configured by settings.RANGO_VIEW_COUNTER,
+    creating it on first use.
+    """
+    global _view_counter
+
+    if _view_counter is None:
+        with _view_counter_lock:
+            if _view_counter is None:
+                config = getattr(settings, 'RANGO_VIEW_COUNTER',
+                                 DEFAULT_VIEW_COUNTER)
+                _view_counter = make_counter_buffer(
+                    config, LocMemCounterBuffer, 'rango.Page', 'views',
+                    touch='updated_at')
+    return _view_counter
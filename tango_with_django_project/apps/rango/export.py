@@ -0,0 +1,159 @@
+import csv
+import json
+import zlib
+
+from django.conf import settings
+
+from .models import Category, Page
+
+
+# The columns exported for each kind of row. The primary key always comes
+# first, so an interrupted export can be resumed from the last one written.
+EXPORTS = {
+    'categories': (Category, ('id', 'name', 'slug', 'views', 'likes')),
+    'pages': (Page, ('id', 'category_id', 'title', 'url', 'views')),
+}
+
+FORMATS = ('ndjson', 'csv')
+
+
+def get_chunk_size():
+    return getattr(settings, 'RANGO_EXPORT_CHUNK_SIZE', 2000)
+
+
+def iter_chunks(model, fields, after=0, chunk_size=None):
+    """
+    Yields the rows of a table as lists of value tuples, chunk_size rows at a
+    time, in primary key order starting after the primary key after.
+
+    Each chunk is its own query (WHERE id > last id ORDER BY id LIMIT n), so
+    only one chunk is ever held in memory and no query stays open between
+    chunks, however large the table is.
+    """
+    chunk_size = chunk_size or get_chunk_size()
+    after = after or 0
+
+    while True:
+        rows = list(model.objects.filter(pk__gt=after).order_by('pk')
+                    .values_list(*fields)[:chunk_size])
+        if not rows:
+            return
+        yield rows
+        if len(rows) < chunk_size:
+            return
+        after = rows[-1][0]
+
+
+class _Echo(object):
+    """
+    A file-like object for csv.writer that hands back what is written.
+    """
+
+    def write(self, value):
+        return value
+
+
+def encode_ndjson(fields, chunks, header=True):
+    for rows in chunks:
+        yield ''.join(
+            json.dumps(dict(zip(fields, row))) + '\n' for row in rows)
+
+
+def encode_csv(fields, chunks, header=True):
+    writer = csv.writer(_Echo())
+    if header:
+        yield writer.writerow(fields)
+    for rows in chunks:
+        yield ''.join(writer.writerow(row) for row in rows)
+
+
+ENCODERS = {
+    'ndjson': encode_ndjson,
+    'csv': encode_csv,
+}
+
+
+def iter_export(kind, fmt, after=0, chunk_size=None, header=True):
+    """
+    Yields an export of all categories or pages as NDJSON or CSV text, one
+    string per chunk of rows. Pass header=False to leave out the CSV header
+    row when the output is appended to a file that already has one.
+    """
+    model, fields = EXPORTS[kind]
+    chunks = iter_chunks(model, fields, after, chunk_size)
+    return ENCODERS[fmt](fields, chunks, header=header)
+
+
+def gzip_stream(chunks, level=6):
+    """
+    Compresses a stream of text chunks into a gzip stream as it goes.
+    """
+    # wbits of 16 + MAX_WBITS writes a gzip header and trailer.
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode('utf-8'))
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def scan_export(lines, fmt):
+    """
+    Reads an export, given its lines, and returns the primary key of its
+    last row (0 if it has none) and the length in bytes of its complete
+    rows, which is where an interrupted export should be cut back to.
+    A partly written last row is left out: a last line without a newline,
+    or a CSV row that ends inside a quoted field.
+    """
+    scanned = [0]
+
+    def complete_lines():
+        for line in lines:
+            if isinstance(line, bytes):
+                line = line.decode('utf-8')
+            if not line.endswith('\n'):
+                return
+            scanned[0] += len(line.encode('utf-8'))
+            yield line
+
+    if fmt == 'ndjson':
+        rows = (_ndjson_id(line) for line in complete_lines())
+    else:
+        # CSV values can have newlines in them, so a row can take up more
+        # than one line. strict makes a row cut off in a value an error.
+        rows = (row[0] if row else None
+                for row in _csv_rows(csv.reader(complete_lines(), strict=True)))
+
+    last, end = 0, 0
+    for pk in rows:
+        # Every line read so far belongs to a complete row.
+        end = scanned[0]
+        try:
+            last = int(pk)
+        except (TypeError, ValueError):
+            # The CSV header, or a blank line.
+            continue
+    return last, end
+
+
+def _ndjson_id(line):
+    try:
+        return json.loads(line)['id']
+    except (ValueError, KeyError, TypeError):
+        return None
+
+
+def _csv_rows(reader):
+    try:
+        for row in reader:
+            yield row
+    except csv.Error:
+        return
+
+
+def last_exported_pk(lines, fmt):
+    """
+    Returns the primary key of the last row in an export, given its lines,
+    or 0 if it has none. See scan_export().
+    """
+    return scan_export(lines, fmt)[0]
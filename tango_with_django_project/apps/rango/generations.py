@@ -0,0 +1,44 @@
+"""
+Generation numbers for groups of cached data, kept in the default cache.
+
+Caches put the generations of the data they hold into their keys (or ETags),
+and changes bump them (see apps.rango.signals). For a change made in one
+process to invalidate what the others have cached, the default cache must
+be shared between them, which settings.CACHES sees to outside development.
+"""
+import time
+
+from django.core.cache import cache
+
+
+def _key(name):
+    return 'rango:generation:{0}'.format(name)
+
+
+def get_generation(name):
+    """
+    Returns the current generation number for a group of cached data.
+    Cache keys that include it are invalidated all at once by bumping it.
+
+    A missing generation starts from the current time rather than from zero,
+    so if the counter is evicted we never go back to an older generation.
+    """
+    key = _key(name)
+    generation = cache.get(key)
+    if generation is None:
+        cache.add(key, int(time.time() * 1000), None)
+        generation = cache.get(key)
+    return generation
+
+
+def bump_generation(name):
+    """
+    Moves a group of cached data on to a new generation, so that anything
+    cached under the old one is no longer used.
+    """
+    key = _key(name)
+    try:
+        return cache.incr(key)
+    except ValueError:
+        # Nothing has read the generation yet, so there's nothing to bump.
+        return get_generation(name)
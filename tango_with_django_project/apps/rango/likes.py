@@ -0,0 +1,103 @@
+import random
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Sum
+from django.utils import timezone
+
+from .generations import bump_generation
+from .models import Category, CategoryLikeShard
+from .rollups import add_daily_likes
+
+
+def get_shard_count():
+    return getattr(settings, 'RANGO_LIKE_SHARDS', 8)
+
+
+def create_shards(*category_ids):
+    """
+    Creates the shard rows for categories. Called when a category is created;
+    shards that are missing (for categories from before sharding, or since
+    RANGO_LIKE_SHARDS was raised) are created by the first like they get.
+    """
+    CategoryLikeShard.objects.bulk_create([
+        CategoryLikeShard(category_id=category_id, shard=i)
+        for category_id in category_ids
+        for i in range(get_shard_count())
+    ])
+
+
+def get_like_total(category_id):
+    """
+    Returns the accurate number of likes for a category: the rolled-up total
+    on Category.likes plus whatever is still waiting in its shards.
+    Returns None if there is no such category.
+    """
+    row = (Category.objects.filter(id=category_id)
+           .annotate(pending=Sum('like_shards__count'))
+           .values_list('likes', 'pending')
+           .first())
+    if row is None:
+        return None
+    likes, pending = row
+    return likes + (pending or 0)
+
+
+def add_like(category_id):
+    """
+    Adds a like to a random shard of the category and returns the new total,
+    or None if there is no such category.
+    """
+    shard = random.randrange(get_shard_count())
+    updated = CategoryLikeShard.objects.filter(
+        category_id=category_id, shard=shard
+    ).update(count=F('count') + 1)
+
+    if not updated:
+        if not Category.objects.filter(id=category_id).exists():
+            return None
+        # Only this shard, as the others may exist already. get_or_create()
+        # copes with another request creating it at the same time.
+        CategoryLikeShard.objects.get_or_create(category_id=category_id,
+                                                shard=shard)
+        CategoryLikeShard.objects.filter(
+            category_id=category_id, shard=shard
+        ).update(count=F('count') + 1)
+
+    return get_like_total(category_id)
+
+
+def rollup_likes(category_id=None):
+    """
+    Moves the likes waiting in the shards onto Category.likes, for one
+    category or for all of them. Returns the number of likes moved.
+
+    Each shard is decremented by the amount that was read from it, rather
+    than reset to zero, so likes added during the rollup are kept for the
+    next one. Category.likes plus the shards always adds up to the total.
+    """
+    shards = CategoryLikeShard.objects.exclude(count=0)
+    if category_id is not None:
+        shards = shards.filter(category_id=category_id)
+
+    moved = 0
+    with transaction.atomic():
+        totals = {}
+        rows = list(shards.values_list('id', 'category_id', 'count'))
+        for pk, cat_id, count in rows:
+            CategoryLikeShard.objects.filter(pk=pk).update(
+                count=F('count') - count)
+            totals[cat_id] = totals.get(cat_id, 0) + count
+
+        now = timezone.now()
+        for cat_id, count in totals.items():
+            Category.objects.filter(id=cat_id).update(
+                likes=F('likes') + count, updated_at=now)
+            moved += count
+        add_daily_likes(totals)
+
+    if moved:
+        # The rolled-up likes show on cached pages and suggestions.
+        bump_generation('categories')
+        bump_generation('stats')
+    return moved
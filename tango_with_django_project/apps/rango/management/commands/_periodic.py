@@ -0,0 +1,39 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+
+class PeriodicCommand(BaseCommand):
+    """
+    A command that does one pass of a job, or with --interval keeps doing
+    one every INTERVAL seconds until it is interrupted.
+
+    Subclasses implement run_once(), which returns a message saying what
+    the pass did. Messages are written after every pass if the command is
+    run once or with --verbosity 2 or more.
+    """
+    interval_help = 'Keep running, every INTERVAL seconds.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--interval', type=float, default=0, help=self.interval_help
+        )
+
+    def run_once(self):
+        raise NotImplementedError
+
+    def handle(self, *args, **options):
+        interval = options['interval']
+
+        try:
+            while True:
+                message = self.run_once()
+                if options['verbosity'] > 1 or not interval:
+                    self.stdout.write(message)
+                if not interval:
+                    break
+                close_old_connections()
+                time.sleep(interval)
+        except KeyboardInterrupt:
+            pass
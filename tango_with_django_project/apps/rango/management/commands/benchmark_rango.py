@@ -0,0 +1,97 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.rango.benchmark import (
+    SCENARIOS, TRANSPORTS, compare_runs, load_runs, previous_run,
+    run_benchmark, save_run
+)
+
+
+COLUMNS = ('requests', 'errors', 'p50_ms', 'p90_ms', 'p99_ms', 'queries',
+           'throughput')
+
+
+class Command(BaseCommand):
+    help = ('Benchmarks the rango views against the current database and '
+            'compares the results with the last run from another commit.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'scenarios', nargs='*', metavar='scenario',
+            help='Scenarios to run: {0}. Default: all.'.format(', '.join(SCENARIOS))
+        )
+        parser.add_argument(
+            '--transport', choices=sorted(TRANSPORTS), default='client',
+            help='Send requests through the test client or a local WSGI server.'
+        )
+        parser.add_argument(
+            '--requests', type=int, default=200,
+            help='Number of measured requests per scenario.'
+        )
+        parser.add_argument(
+            '--warmup', type=int, default=20,
+            help='Number of unmeasured requests per scenario, sent first.'
+        )
+        parser.add_argument(
+            '--concurrency', type=int, default=1,
+            help='Number of threads sending requests at once.'
+        )
+        parser.add_argument(
+            '--skew', type=float, default=1.1,
+            help='Power-law exponent used to pick categories and pages.'
+        )
+        parser.add_argument(
+            '--results',
+            default=getattr(settings, 'RANGO_BENCHMARK_RESULTS', None),
+            help='JSON lines file the results are appended to.'
+        )
+        parser.add_argument(
+            '--no-save', action='store_true',
+            help="Don't store the results."
+        )
+        parser.add_argument(
+            '--max-regression', type=float, default=None,
+            help='Fail if any scenario\'s median latency grew by more than '
+                 'this many percent since the previous run.'
+        )
+
+    def handle(self, *args, **options):
+        unknown = set(options['scenarios']) - set(SCENARIOS)
+        if unknown:
+            raise CommandError('Unknown scenarios: {0}'.format(', '.join(sorted(unknown))))
+        if options['concurrency'] < 1 or options['requests'] < 1:
+            raise CommandError('--requests and --concurrency must be at least 1.')
+
+        self.stdout.write('{0:<22}'.format('scenario') +
+                          ''.join('{0:>11}'.format(c) for c in COLUMNS))
+        run = run_benchmark(
+            scenarios=options['scenarios'], transport=options['transport'],
+            requests=options['requests'], warmup=options['warmup'],
+            concurrency=options['concurrency'], skew=options['skew'],
+            log=self.write_result,
+        )
+
+        path = options['results']
+        previous = previous_run(load_runs(path), run) if path else None
+        if path and not options['no_save']:
+            save_run(path, run)
+
+        if previous is None:
+            return
+
+        self.stdout.write('\nMedian latency against {0} ({1}):'.format(
+            previous['commit'], previous['time']))
+        regressions = []
+        for scenario, change in compare_runs(previous, run).items():
+            self.stdout.write('{0:<22}{1:>+10.1f}%'.format(scenario, change * 100))
+            if (options['max_regression'] is not None
+                    and change * 100 > options['max_regression']):
+                regressions.append(scenario)
+
+        if regressions:
+            raise CommandError('Slower than {0}: {1}'.format(
+                previous['commit'], ', '.join(regressions)))
+
+    def write_result(self, result):
+        self.stdout.write('{0:<22}'.format(result['scenario']) +
+                          ''.join('{0:>11}'.format(result[c]) for c in COLUMNS))
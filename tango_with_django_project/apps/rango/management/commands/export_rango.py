@@ -0,0 +1,108 @@
+import gzip
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.rango.export import (
+    EXPORTS, FORMATS, gzip_stream, iter_export, scan_export
+)
+
+
+class Command(BaseCommand):
+    help = 'Streams all categories or pages to a file (or stdout) as NDJSON or CSV.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=sorted(EXPORTS))
+        parser.add_argument(
+            '--format', choices=FORMATS, default='ndjson',
+            help='Output format (default: ndjson).'
+        )
+        parser.add_argument(
+            '--output', '-o',
+            help='File to write to; by default the export goes to stdout.'
+        )
+        parser.add_argument(
+            '--gzip', action='store_true',
+            help='Compress the output with gzip.'
+        )
+        parser.add_argument(
+            '--after', type=int, default=0,
+            help='Only export rows with a primary key above AFTER.'
+        )
+        parser.add_argument(
+            '--resume', action='store_true',
+            help='Append to --output, starting after the last row it holds.'
+        )
+        parser.add_argument(
+            '--chunk-size', type=int, default=None,
+            help='Number of rows to fetch per query.'
+        )
+
+    def handle(self, *args, **options):
+        fmt = options['format']
+        output = options['output']
+        after = options['after']
+        mode = 'wb'
+        header = True
+
+        if options['resume']:
+            if not output:
+                raise CommandError('--resume needs an --output file.')
+            if os.path.exists(output):
+                after, written = self.resume_point(output, fmt, options['gzip'])
+                mode = 'ab'
+                # Only a file with nothing in it yet needs the CSV header.
+                header = not written
+
+        content = iter_export(options['kind'], fmt, after, options['chunk_size'],
+                              header=header)
+
+        if not output:
+            if options['gzip']:
+                raise CommandError('--gzip needs an --output file.')
+            for chunk in content:
+                self.stdout.write(chunk, ending='')
+            return
+
+        if options['gzip']:
+            # Appending to a gzip file adds a new gzip member, which gzip
+            # readers treat as a continuation of the same file.
+            content = gzip_stream(content)
+        else:
+            content = (chunk.encode('utf-8') for chunk in content)
+
+        with open(output, mode) as f:
+            for chunk in content:
+                f.write(chunk)
+        if options['verbosity'] > 1:
+            self.stdout.write('Exported {0} after id {1} to {2}.'.format(
+                options['kind'], after, output))
+
+    def resume_point(self, path, fmt, compressed):
+        """
+        Returns the primary key to resume after, and the length of the
+        complete rows in the file. An uncompressed file is cut back to its
+        last complete row so the export continues cleanly.
+        """
+        if compressed:
+            truncated = []
+
+            def lines():
+                try:
+                    with gzip.open(path, 'rb') as f:
+                        for line in f:
+                            yield line
+                except (EOFError, OSError):
+                    truncated.append(path)
+
+            after, end = scan_export(lines(), fmt)
+            if truncated:
+                raise CommandError(
+                    '{0} is truncated and cannot be appended to. Start a new '
+                    'file with --after {1} instead.'.format(path, after))
+            return after, end
+
+        with open(path, 'rb+') as f:
+            after, end = scan_export(f, fmt)
+            f.truncate(end)
+        return after, end
@@ -0,0 +1,224 @@
+import csv
+import gzip
+import io
+import sys
+import time
+
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DatabaseError, transaction
+
+from apps.rango.bulk import (
+    MODES, CategoryWriter, PageWriter, batches, iter_ndjson
+)
+from apps.rango.models import Category, Page
+
+
+FORMATS = ('jsonl', 'csv')
+
+
+def open_input(path):
+    """
+    Opens an input file as text; '-' is stdin and *.gz files are
+    decompressed as they are read.
+    """
+    if path == '-':
+        return io.TextIOWrapper(sys.stdin.buffer, encoding='utf-8')
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rt', encoding='utf-8', newline='')
+    return open(path, encoding='utf-8', newline='')
+
+
+def guess_format(path):
+    name = path[:-3] if path.endswith('.gz') else path
+    return 'csv' if name.endswith('.csv') else 'jsonl'
+
+
+def read_rows(f, fmt):
+    """
+    Yields (line number, row) for each row of a file, where row is a
+    dictionary, or a ValueError for a line that couldn't be parsed.
+    """
+    if fmt == 'csv':
+        reader = csv.DictReader(f)
+        for row in reader:
+            yield reader.line_num, row
+    else:
+        for number, row in enumerate(iter_ndjson(f), 1):
+            yield number, row
+
+
+def _text(row, field, max_length, required=True):
+    value = row.get(field)
+    value = '' if value is None else str(value).strip()
+    if required and not value:
+        raise ValueError('{0} is required.'.format(field))
+    if len(value) > max_length:
+        raise ValueError('{0} is longer than {1} characters.'.format(
+            field, max_length))
+    return value
+
+
+def _int(row, field):
+    value = row.get(field)
+    if value in (None, ''):
+        return 0
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise ValueError('{0} must be a whole number.'.format(field))
+
+
+def _url(row, field):
+    model_field = Page._meta.get_field(field)
+    value = _text(row, field, model_field.max_length)
+    try:
+        model_field.run_validators(value)
+    except ValidationError as e:
+        raise ValueError('{0}: {1}'.format(field, ' '.join(e.messages)))
+    return value
+
+
+def category_from_row(row, categories):
+    return Category(name=_text(row, 'name', 128),
+                    views=_int(row, 'views'),
+                    likes=_int(row, 'likes'))
+
+
+def page_from_row(row, categories):
+    """
+    The category is given by its slug in 'category', or by its primary key
+    in 'category_id' (as "manage.py export_rango pages" writes it).
+    """
+    slug = row.get('category')
+    if slug:
+        category_id = categories.by_slug.get(slug)
+        if category_id is None:
+            raise ValueError('Unknown category {0!r}.'.format(slug))
+    else:
+        category_id = _int(row, 'category_id')
+        if category_id not in categories.ids:
+            raise ValueError('Unknown category id {0}.'.format(category_id))
+
+    return Page(category_id=category_id,
+                title=_text(row, 'title', 128),
+                url=_url(row, 'url'),
+                views=_int(row, 'views'))
+
+
+LOADERS = {
+    'categories': (CategoryWriter, category_from_row),
+    'pages': (PageWriter, page_from_row),
+}
+
+
+class CategoryMap(object):
+    """
+    Category slugs mapped to primary keys, loaded with a single query so
+    that pages can be resolved to their category without a lookup each.
+    """
+
+    def __init__(self):
+        self.by_slug = dict(Category.objects.values_list('slug', 'pk'))
+        self.ids = set(self.by_slug.values())
+
+
+class Command(BaseCommand):
+    help = ('Loads categories or pages from JSONL or CSV files, writing them '
+            'in batches with bulk_create().')
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=sorted(LOADERS))
+        parser.add_argument(
+            'paths', nargs='+', metavar='path',
+            help='JSONL or CSV files, optionally gzipped; - reads stdin.'
+        )
+        parser.add_argument(
+            '--format', choices=FORMATS, default=None,
+            help='Input format; guessed from each file name by default.'
+        )
+        parser.add_argument(
+            '--mode', choices=MODES, default='create',
+            help='What to do with rows that already exist: create them again '
+                 '(pages only), upsert them, or skip them. Default: create.'
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Number of rows to write per transaction.'
+        )
+
+    def handle(self, *args, **options):
+        writer_class, from_row = LOADERS[options['kind']]
+        writer = writer_class(options['mode'])
+        batch_size = options['batch_size']
+        if batch_size < 1:
+            raise CommandError('--batch-size must be at least 1.')
+
+        categories = CategoryMap() if options['kind'] == 'pages' else None
+        errors = 0
+        started = time.time()
+
+        for path in options['paths']:
+            fmt = options['format'] or guess_format(path)
+            try:
+                f = open_input(path)
+            except IOError as e:
+                raise CommandError(e)
+
+            with f:
+                for batch in batches(read_rows(f, fmt), batch_size):
+                    objs, lines = [], []
+                    for line, row in batch:
+                        try:
+                            if isinstance(row, ValueError):
+                                raise row
+                            if not isinstance(row, dict):
+                                raise ValueError('Expected an object.')
+                            objs.append(from_row(row, categories))
+                            lines.append(line)
+                        except ValueError as e:
+                            errors += 1
+                            self.error(path, line, e)
+
+                    rejected = self.write(writer, objs, lines)
+                    for line, item_errors in sorted(rejected.items()):
+                        errors += 1
+                        self.error(path, line, item_errors)
+
+            if options['verbosity'] > 1:
+                self.stdout.write('Loaded {0}.'.format(path))
+
+        elapsed = time.time() - started
+        result = writer.result(errors)
+        self.stdout.write(
+            'Created {0}, updated {1}, skipped {2} {3} in {4:.1f}s '
+            '({5} errors).'.format(result.created, result.updated,
+                                   result.skipped, options['kind'], elapsed,
+                                   result.errors))
+
+    def write(self, writer, objs, lines):
+        """
+        Writes a batch in one transaction, and returns a {line: errors}
+        dictionary for the rows that weren't written. If the database
+        refuses the batch, it is split in two and each half is written on
+        its own, until the rows at fault are found.
+        """
+        counts = writer.created, writer.updated, writer.skipped
+        try:
+            with transaction.atomic():
+                rejected = writer.write(objs)
+        except DatabaseError as e:
+            # Nothing in the batch was written after all.
+            writer.created, writer.updated, writer.skipped = counts
+            if len(objs) == 1:
+                return {lines[0]: str(e)}
+            for obj in objs:
+                obj.pk = None
+            middle = len(objs) // 2
+            rejected = self.write(writer, objs[:middle], lines[:middle])
+            rejected.update(self.write(writer, objs[middle:], lines[middle:]))
+            return rejected
+        return {lines[position]: errors for position, errors in rejected.items()}
+
+    def error(self, path, line, message):
+        self.stderr.write('{0}:{1}: {2}'.format(path, line, message))
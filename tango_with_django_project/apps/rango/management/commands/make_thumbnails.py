@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from apps.rango.models import UserProfile
+from apps.rango.thumbnails import generate_thumbnails, thumbnails_missing
+
+
+class Command(BaseCommand):
+    help = 'Makes the thumbnails of profile pictures that have none yet.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--all', action='store_true',
+            help='Make them again for every picture.'
+        )
+
+    def handle(self, *args, **options):
+        names = (UserProfile.objects.exclude(picture='')
+                 .values_list('picture', flat=True).distinct())
+        made = 0
+        for name in names.iterator():
+            if options['all'] or thumbnails_missing(name):
+                generate_thumbnails(name)
+                made += 1
+                if options['verbosity'] > 1:
+                    self.stdout.write('Made thumbnails of {0}.'.format(name))
+        self.stdout.write('Made thumbnails of {0} pictures.'.format(made))
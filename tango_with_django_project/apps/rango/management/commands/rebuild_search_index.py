@@ -0,0 +1,25 @@
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.rango.search_backends import get_search_backend
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the local search index from all categories and pages.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Number of rows to index per batch.'
+        )
+
+    def handle(self, *args, **options):
+        backend = get_search_backend()
+        try:
+            count = backend.rebuild(batch_size=options['batch_size'])
+        except ImproperlyConfigured as e:
+            raise CommandError(str(e))
+        self.stdout.write(
+            'Indexed {0} documents with {1}.'.format(
+                count, backend.__class__.__name__)
+        )
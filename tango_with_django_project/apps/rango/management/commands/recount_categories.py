@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from apps.rango.category_stats import recount_page_stats
+from apps.rango.generations import bump_generation
+
+
+class Command(BaseCommand):
+    help = ('Recounts Category.page_count and Category.total_page_views '
+            'from the pages, should they have drifted.')
+
+    def handle(self, *args, **options):
+        recounted = recount_page_stats()
+        bump_generation('categories')
+        self.stdout.write('Recounted {0} categories.'.format(recounted))
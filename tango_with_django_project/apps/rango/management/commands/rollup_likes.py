@@ -0,0 +1,11 @@
+from apps.rango.likes import rollup_likes
+
+from ._periodic import PeriodicCommand
+
+
+class Command(PeriodicCommand):
+    help = 'Moves likes from the category like shards onto Category.likes.'
+    interval_help = 'Keep running, rolling up every INTERVAL seconds.'
+
+    def run_once(self):
+        return 'Rolled up {0} likes.'.format(rollup_likes())
@@ -0,0 +1,12 @@
+from apps.rango.rollups import rollup_daily_stats
+
+from ._periodic import PeriodicCommand
+
+
+class Command(PeriodicCommand):
+    help = ('Adds the logged page clicks to the daily page and category '
+            'stats served by /rango/api/stats/.')
+    interval_help = 'Keep running, rolling up every INTERVAL seconds.'
+
+    def run_once(self):
+        return 'Processed {0} click rows.'.format(rollup_daily_stats())
@@ -0,0 +1,43 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections
+
+from apps.rango.tasks import DatabaseBackend, get_task_backend
+
+
+class Command(BaseCommand):
+    help = ('Runs background tasks from the database queue. Needs '
+            'RANGO_TASKS to use apps.rango.tasks.DatabaseBackend.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--poll-interval', type=float, default=1,
+            help='Seconds to wait before looking again when the queue is empty.'
+        )
+        parser.add_argument(
+            '--once', action='store_true',
+            help='Run the tasks that are due, then exit.'
+        )
+
+    def handle(self, *args, **options):
+        backend = get_task_backend()
+        if not isinstance(backend, DatabaseBackend):
+            raise CommandError('RANGO_TASKS is not using the database backend.')
+
+        ran = 0
+        while True:
+            requeued = backend.requeue_stale()
+            if requeued:
+                self.stderr.write('Requeued {0} stale tasks.'.format(requeued))
+
+            while backend.run_next():
+                ran += 1
+                close_old_connections()
+            if options['once']:
+                break
+            close_old_connections()
+            time.sleep(options['poll_interval'])
+
+        if options['verbosity'] > 1 or options['once']:
+            self.stdout.write('Ran {0} tasks.'.format(ran))
@@ -0,0 +1,52 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from apps.rango.benchmark import clear_dataset, seed_dataset
+
+
+class Command(BaseCommand):
+    help = ('Fills the database with a synthetic dataset of categories and '
+            'pages with skewed popularity, for benchmarks and load tests.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--categories', type=int, default=1000,
+            help='Number of categories to create.'
+        )
+        parser.add_argument(
+            '--pages', type=int, default=100000,
+            help='Number of pages to create, spread over the categories.'
+        )
+        parser.add_argument(
+            '--skew', type=float, default=1.1,
+            help='Power-law exponent for popularity; higher is more skewed.'
+        )
+        parser.add_argument(
+            '--seed', type=int, default=0,
+            help='Random seed, so that datasets can be recreated exactly.'
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=5000,
+            help='Number of rows to insert per transaction.'
+        )
+        parser.add_argument(
+            '--clear', action='store_true',
+            help='Delete ALL categories and pages first.'
+        )
+
+    def handle(self, *args, **options):
+        started = time.time()
+        if options['clear']:
+            clear_dataset()
+
+        log = self.stdout.write if options['verbosity'] > 1 else None
+        categories, pages = seed_dataset(
+            categories=options['categories'], pages=options['pages'],
+            skew=options['skew'], seed=options['seed'],
+            batch_size=options['batch_size'], log=log,
+        )
+        self.stdout.write(
+            'Created {0} categories and {1} pages in {2:.1f}s. Run '
+            '"manage.py rebuild_search_index" to search them locally.'.format(
+                categories, pages, time.time() - started))
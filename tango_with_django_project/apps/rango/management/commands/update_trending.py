@@ -0,0 +1,12 @@
+from apps.rango.trending import update_trending
+
+from ._periodic import PeriodicCommand
+
+
+class Command(PeriodicCommand):
+    help = ('Folds the logged page clicks into the hourly click counts and '
+            'the trending scores, and refreshes the trending pages.')
+    interval_help = 'Keep running, updating every INTERVAL seconds.'
+
+    def run_once(self):
+        return 'Processed {0} click rows.'.format(update_trending())
@@ -0,0 +1,397 @@
+import bisect
+import threading
+import time
+from collections import defaultdict
+
+from django.db import connection
+from django.db.backends.utils import CursorWrapper
+from django.template.backends.django import DjangoTemplates, Template
+
+
+# Latency buckets, in seconds, as used by the Prometheus client libraries.
+DEFAULT_BUCKETS = (.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 200, 500)
+
+
+def _escape(value):
+    return (str(value).replace('\\', '\\\\').replace('"', '\\"')
+            .replace('\n', '\\n'))
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(
+        '{0}="{1}"'.format(name, _escape(value)) for name, value in pairs) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter(object):
+    """
+    A count that only goes up. Each set of label values is either added to
+    with inc(), or tracked with a function that returns a count kept
+    elsewhere, called whenever the metrics are rendered.
+    """
+
+    type = 'counter'
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, **kwargs):
+        amount = kwargs.get('amount', 1)
+        with self._lock:
+            self._values[label_values] += amount
+
+    def track(self, func, *label_values):
+        with self._lock:
+            self._values[label_values] = func
+
+    def value(self, *label_values):
+        value = self._values.get(label_values, 0)
+        return value() if callable(value) else value
+
+    def samples(self):
+        with self._lock:
+            label_values = sorted(self._values)
+        for values in label_values:
+            yield self.name, _format_labels(self.labels, values), self.value(*values)
+
+
+class Histogram(object):
+    """
+    Counts observations into cumulative buckets, as Prometheus histograms
+    do, keeping only the bucket counts, sum and count for each set of
+    label values.
+    """
+
+    type = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * len(self.buckets), 0.0, 0]
+            series[0][i] += 1
+            series[1] += value
+            series[2] += 1
+
+    def count(self, *label_values):
+        series = self._series.get(label_values)
+        return series[2] if series else 0
+
+    def samples(self):
+        with self._lock:
+            series = sorted((k, (list(v[0]), v[1], v[2]))
+                            for k, v in self._series.items())
+        for label_values, (counts, total, count) in series:
+            cumulative = 0
+            for bound, n in zip(self.buckets, counts):
+                cumulative += n
+                yield (self.name + '_bucket',
+                       _format_labels(self.labels, label_values,
+                                      [('le', _format_value(bound))]),
+                       cumulative)
+            yield self.name + '_sum', _format_labels(self.labels, label_values), total
+            yield self.name + '_count', _format_labels(self.labels, label_values), count
+
+
+class Gauge(object):
+    """
+    A value that goes up and down. Each set of label values is either set
+    directly, or tracked with a function that is called for its value
+    whenever the metrics are rendered.
+    """
+
+    type = 'gauge'
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def set(self, value, *label_values):
+        with self._lock:
+            self._values[label_values] = value
+
+    def track(self, func, *label_values):
+        with self._lock:
+            self._values[label_values] = func
+
+    def value(self, *label_values):
+        value = self._values.get(label_values, 0)
+        return value() if callable(value) else value
+
+    def samples(self):
+        with self._lock:
+            label_values = sorted(self._values)
+        for values in label_values:
+            yield self.name, _format_labels(self.labels, values), self.value(*values)
+
+
+class Registry(object):
+
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        """
+        Returns all metrics in the Prometheus text exposition format.
+        """
+        lines = []
+        for metric in self.metrics:
+            lines.append('# HELP {0} {1}'.format(metric.name, metric.help))
+            lines.append('# TYPE {0} {1}'.format(metric.name, metric.type))
+            for name, labels, value in metric.samples():
+                lines.append('{0}{1} {2}'.format(name, labels, _format_value(value)))
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+REQUESTS = registry.register(Counter(
+    'rango_requests_total', 'Requests handled, by URL name and status.',
+    ['view', 'method', 'status']))
+REQUEST_SECONDS = registry.register(Histogram(
+    'rango_request_duration_seconds', 'Wall time spent on each request.',
+    ['view', 'method']))
+DB_QUERIES = registry.register(Histogram(
+    'rango_request_db_queries', 'Database queries made per request.',
+    ['view'], buckets=QUERY_COUNT_BUCKETS))
+DB_SECONDS = registry.register(Histogram(
+    'rango_request_db_seconds', 'Time spent in database queries per request.',
+    ['view']))
+TEMPLATE_SECONDS = registry.register(Histogram(
+    'rango_request_template_seconds', 'Time spent rendering templates per request.',
+    ['view']))
+WEBHOSE_SECONDS = registry.register(Histogram(
+    'rango_request_webhose_seconds',
+    'Time spent waiting on Webhose per request that searched it.',
+    ['view']))
+CACHE_LOOKUPS = registry.register(Counter(
+    'rango_cache_lookups_total', 'Cache lookups, by cache and result.',
+    ['view', 'cache', 'result']))
+WEBHOSE_CALLS = registry.register(Histogram(
+    'rango_webhose_call_duration_seconds', 'Latency of calls to the Webhose API.',
+    ['outcome']))
+WEBHOSE_CIRCUIT_STATE = registry.register(Gauge(
+    'rango_webhose_circuit_state',
+    'Whether the Webhose circuit breaker is in each state (1) or not (0).',
+    ['state']))
+WEBHOSE_CIRCUIT_TRIPS = registry.register(Counter(
+    'rango_webhose_circuit_trips_total',
+    'Times the Webhose circuit breaker has opened.'))
+WEBHOSE_CIRCUIT_REJECTED = registry.register(Counter(
+    'rango_webhose_circuit_rejected_total',
+    'Webhose calls refused while the circuit breaker was open.'))
+TASKS = registry.register(Counter(
+    'rango_tasks_total', 'Background task attempts, by task and outcome.',
+    ['task', 'outcome']))
+TASK_SECONDS = registry.register(Histogram(
+    'rango_task_duration_seconds', 'Time spent running each background task.',
+    ['task']))
+TASK_WAIT_SECONDS = registry.register(Histogram(
+    'rango_task_wait_seconds',
+    'Time background tasks spent queued before they started running.',
+    ['task']))
+TASK_QUEUE_DEPTH = registry.register(Gauge(
+    'rango_task_queue_depth', 'Background tasks waiting to run.',
+    ['backend']))
+
+
+class RequestStats(object):
+    """
+    What the request being handled on this thread has spent its time on.
+    """
+
+    def __init__(self):
+        self.template_seconds = 0.0
+        self.template_depth = 0
+        self.queries = 0
+        self.query_seconds = 0.0
+        self.webhose_seconds = None
+        self.cache_lookups = []
+
+
+_local = threading.local()
+
+
+def current_stats():
+    """
+    Returns the RequestStats for the request on this thread, or None
+    outside of a request (or when MetricsMiddleware isn't installed).
+    """
+    return getattr(_local, 'stats', None)
+
+
+def record_cache_lookup(cache_name, hit):
+    """
+    Counts a lookup in one of our caches. Called where the caches are used,
+    so the lookups are labelled by what was cached.
+    """
+    stats = current_stats()
+    if stats is not None:
+        stats.cache_lookups.append((cache_name, 'hit' if hit else 'miss'))
+    else:
+        CACHE_LOOKUPS.inc('', cache_name, 'hit' if hit else 'miss')
+
+
+class QueryCountingCursor(CursorWrapper):
+    """
+    Counts the queries run through a cursor, and the time they take,
+    towards the RequestStats of the request on this thread.
+    """
+
+    def _count(self, start):
+        stats = current_stats()
+        if stats is not None:
+            stats.queries += 1
+            stats.query_seconds += time.time() - start
+
+    def execute(self, sql, params=None):
+        start = time.time()
+        try:
+            return super(QueryCountingCursor, self).execute(sql, params)
+        finally:
+            self._count(start)
+
+    def executemany(self, sql, param_list):
+        start = time.time()
+        try:
+            return super(QueryCountingCursor, self).executemany(sql, param_list)
+        finally:
+            self._count(start)
+
+
+def count_queries(conn):
+    """
+    Makes the cursors of a database connection (each thread has its own)
+    count their queries with QueryCountingCursor, whether or not the
+    connection is logging them.
+    """
+    if getattr(conn, '_rango_counting_queries', False):
+        return
+    for name in ('make_cursor', 'make_debug_cursor'):
+        make = getattr(conn, name)
+        setattr(conn, name, lambda cursor, make=make: QueryCountingCursor(
+            make(cursor), conn))
+    conn._rango_counting_queries = True
+
+
+def record_webhose_call(seconds, outcome):
+    WEBHOSE_CALLS.observe(seconds, outcome)
+    stats = current_stats()
+    if stats is not None:
+        stats.webhose_seconds = (stats.webhose_seconds or 0) + seconds
+
+
+def track_webhose_circuit_breaker(breaker):
+    for state in (breaker.CLOSED, breaker.HALF_OPEN, breaker.OPEN):
+        WEBHOSE_CIRCUIT_STATE.track(
+            lambda state=state: int(breaker.state == state), state)
+    WEBHOSE_CIRCUIT_TRIPS.track(lambda: breaker.trips)
+    WEBHOSE_CIRCUIT_REJECTED.track(lambda: breaker.rejected)
+
+
+class MetricsMiddleware(object):
+    """
+    Records the wall time, database queries, template rendering time, cache
+    lookups and Webhose latency of each request under the name of the URL
+    it resolved to (e.g. 'rango:show_category'), for the /metrics endpoint.
+
+    Database queries are counted by QueryCountingCursor, which only adds a
+    counter and a clock reading to each query (the query log would keep
+    the SQL of every one). Template time is measured by
+    InstrumentedDjangoTemplates, so that has to be the template backend.
+
+    Metrics are kept in memory in each process; with several worker
+    processes, scrape each one or aggregate them in Prometheus.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        count_queries(connection)
+        stats = _local.stats = RequestStats()
+        start = time.time()
+        try:
+            response = self.get_response(request)
+        finally:
+            elapsed = time.time() - start
+            _local.stats = None
+
+        match = getattr(request, 'resolver_match', None)
+        view = match.view_name if match else 'unresolved'
+
+        REQUESTS.inc(view, request.method, str(response.status_code))
+        REQUEST_SECONDS.observe(elapsed, view, request.method)
+        DB_QUERIES.observe(stats.queries, view)
+        DB_SECONDS.observe(stats.query_seconds, view)
+        TEMPLATE_SECONDS.observe(stats.template_seconds, view)
+        if stats.webhose_seconds is not None:
+            WEBHOSE_SECONDS.observe(stats.webhose_seconds, view)
+        for cache_name, result in stats.cache_lookups:
+            CACHE_LOOKUPS.inc(view, cache_name, result)
+        return response
+
+
+class InstrumentedTemplate(Template):
+    """
+    Times how long each top-level template takes to render. Templates
+    rendered while another is rendering (e.g. by an inclusion tag) count
+    towards the outer one.
+    """
+
+    def render(self, context=None, request=None):
+        stats = current_stats()
+        if stats is None:
+            return super(InstrumentedTemplate, self).render(context, request)
+
+        stats.template_depth += 1
+        start = time.time()
+        try:
+            return super(InstrumentedTemplate, self).render(context, request)
+        finally:
+            stats.template_depth -= 1
+            if not stats.template_depth:
+                stats.template_seconds += time.time() - start
+
+
+class InstrumentedDjangoTemplates(DjangoTemplates):
+    """
+    The Django template backend, with render times recorded for
+    MetricsMiddleware.
+    """
+
+    def from_string(self, template_code):
+        return InstrumentedTemplate(self.engine.from_string(template_code), self)
+
+    def get_template(self, template_name):
+        template = super(InstrumentedDjangoTemplates, self).get_template(template_name)
+        return InstrumentedTemplate(template.template, self)
@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import OperationalError, migrations, transaction
+
+
+def create_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+
+    if vendor == 'sqlite':
+        # Only SQLiteSearchBackend uses the table, so builds of SQLite
+        # without FTS5 go without it, and that backend refuses to run.
+        try:
+            with transaction.atomic(using=schema_editor.connection.alias):
+                schema_editor.execute(
+                    'CREATE VIRTUAL TABLE rango_search_index USING fts5(title, url)'
+                )
+        except OperationalError:
+            pass
+    elif vendor == 'postgresql':
+        schema_editor.execute(
+            "CREATE INDEX rango_page_search_idx ON rango_page "
+            "USING GIN (to_tsvector('english', title || ' ' || url))"
+        )
+        schema_editor.execute(
+            "CREATE INDEX rango_category_search_idx ON rango_category "
+            "USING GIN (to_tsvector('english', name))"
+        )
+
+
+def drop_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+
+    if vendor == 'sqlite':
+        schema_editor.execute('DROP TABLE IF EXISTS rango_search_index')
+    elif vendor == 'postgresql':
+        schema_editor.execute('DROP INDEX rango_page_search_idx')
+        schema_editor.execute('DROP INDEX rango_category_search_idx')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rango', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.5 on 2026-10-18 19:01
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rango', '0002_search_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CategoryLikeShard',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('shard', models.PositiveSmallIntegerField()),
+                ('count', models.IntegerField(default=0)),
+                ('category', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='like_shards', to='rango.Category')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='categorylikeshard',
+            unique_together=set([('category', 'shard')]),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.5 on 2026-10-18 19:22
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rango', '0004_request_profile'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyVisits',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(unique=True)),
+                ('visits', models.IntegerField(default=0)),
+            ],
+            options={
+                'verbose_name_plural': 'Daily visits',
+                'ordering': ('-date',),
+            },
+        ),
+    ]
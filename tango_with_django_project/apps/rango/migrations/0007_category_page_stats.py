@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.5 on 2026-10-18 19:29
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+from django.db.models import Count, Sum
+
+
+def count_pages(apps, schema_editor):
+    Category = apps.get_model('rango', 'Category')
+    Page = apps.get_model('rango', 'Page')
+
+    totals = (Page.objects.order_by().values('category_id')
+              .annotate(pages=Count('id'), views=Sum('views')))
+    for row in totals:
+        Category.objects.filter(pk=row['category_id']).update(
+            page_count=row['pages'], total_page_views=row['views'] or 0)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rango', '0006_updated_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='category',
+            name='page_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='category',
+            name='total_page_views',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AlterField(
+            model_name='category',
+            name='likes',
+            field=models.IntegerField(db_index=True, default=0),
+        ),
+        migrations.AlterField(
+            model_name='page',
+            name='views',
+            field=models.IntegerField(db_index=True, default=0),
+        ),
+        migrations.AlterIndexTogether(
+            name='page',
+            index_together=set([('category', 'views')]),
+        ),
+        migrations.RunPython(count_pages, migrations.RunPython.noop),
+    ]
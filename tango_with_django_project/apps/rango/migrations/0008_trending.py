@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.5 on 2026-10-18 19:31
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rango', '0007_category_page_stats'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AggregationCursor',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, unique=True)),
+                ('position', models.BigIntegerField(default=0)),
+                ('updated', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='CategoryTrend',
+            fields=[
+                ('category', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, serialize=False, to='rango.Category')),
+                ('score', models.FloatField(db_index=True, default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='HourlyClicks',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('hour', models.DateTimeField(db_index=True)),
+                ('clicks', models.IntegerField(default=0)),
+                ('category', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='rango.Category')),
+            ],
+            options={
+                'verbose_name_plural': 'Hourly clicks',
+            },
+        ),
+        migrations.CreateModel(
+            name='PageClick',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('clicks', models.IntegerField()),
+                ('created', models.DateTimeField(db_index=True)),
+                ('category', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='rango.Category')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='PageTrend',
+            fields=[
+                ('page', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, serialize=False, to='rango.Page')),
+                ('score', models.FloatField(db_index=True, default=0)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='pageclick',
+            name='page',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='rango.Page'),
+        ),
+        migrations.AddField(
+            model_name='hourlyclicks',
+            name='page',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='rango.Page'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='hourlyclicks',
+            unique_together=set([('page', 'hour')]),
+        ),
+    ]
@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.5 on 2026-10-18 19:32
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rango', '0008_trending'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CategoryDailyStats',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(db_index=True)),
+                ('clicks', models.IntegerField(default=0)),
+                ('likes', models.IntegerField(default=0)),
+                ('category', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='rango.Category')),
+            ],
+            options={
+                'verbose_name_plural': 'Category daily stats',
+            },
+        ),
+        migrations.CreateModel(
+            name='PageDailyStats',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(db_index=True)),
+                ('clicks', models.IntegerField(default=0)),
+                ('category', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='rango.Category')),
+                ('page', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='rango.Page')),
+            ],
+            options={
+                'verbose_name_plural': 'Page daily stats',
+            },
+        ),
+        migrations.AlterUniqueTogether(
+            name='pagedailystats',
+            unique_together=set([('page', 'date')]),
+        ),
+        migrations.AlterUniqueTogether(
+            name='categorydailystats',
+            unique_together=set([('category', 'date')]),
+        ),
+    ]
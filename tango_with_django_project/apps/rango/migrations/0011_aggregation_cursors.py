@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.5 on 2026-10-18 19:58
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+# The jobs that read the PageClick log (apps.rango.trending and
+# apps.rango.rollups). Log rows are only deleted once every cursor has
+# passed them, so each job's cursor has to exist before the log is pruned,
+# not just from the job's first run.
+CURSOR_NAMES = ('trending', 'daily_stats')
+
+
+def create_cursors(apps, schema_editor):
+    AggregationCursor = apps.get_model('rango', 'AggregationCursor')
+    for name in CURSOR_NAMES:
+        AggregationCursor.objects.get_or_create(name=name)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rango', '0010_queued_task'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_cursors, migrations.RunPython.noop),
+    ]
@@ -20,8 +20,13 @@ class UserProfile(models.Model):
 class Category(models.Model):
     name = models.CharField(max_length=128, unique=True)
     views = models.IntegerField(default=0)
-    likes = models.IntegerField(default=0)
+    likes = models.IntegerField(default=0, db_index=True)
     slug = models.SlugField(unique=True)
+    # Also moved on when the category's pages change; see apps.rango.signals.
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+    # Kept up to date as pages are written; see apps.rango.category_stats.
+    page_count = models.IntegerField(default=0)
+    total_page_views = models.IntegerField(default=0)
 
     def save(self, *args, **kwargs):
         self.slug = slugify(self.name)
@@ -38,7 +43,214 @@ class Page(models.Model):
     category = models.ForeignKey(Category)
     title = models.CharField(max_length=128)
     url = models.URLField()
-    views = models.IntegerField(default=0)
+    views = models.IntegerField(default=0, db_index=True)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+
+    class Meta:
+        # For a category's pages by views. Django can't declare the index
+        # descending, but it is read backwards just as well.
+        index_together = [('category', 'views')]
 
     def __str__(self):
         return self.title
+
+
+class CategoryLikeShard(models.Model):
+    """
+    Likes are counted across several shard rows per category, so concurrent
+    likes for a popular category update different rows instead of queueing
+    on one. Each shard holds the likes not yet rolled up into Category.likes;
+    see apps.rango.likes.
+    """
+    category = models.ForeignKey(Category, related_name='like_shards',
+                                 on_delete=models.CASCADE)
+    shard = models.PositiveSmallIntegerField()
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = ('category', 'shard')
+
+    def __str__(self):
+        return '{0} #{1}'.format(self.category, self.shard)
+
+
+class RequestProfile(models.Model):
+    """
+    A cProfile profile of one request, captured by ProfilingMiddleware.
+    stats holds the marshalled profile, in the same format as
+    cProfile.Profile.dump_stats() writes, so it can be downloaded and
+    loaded with pstats or snakeviz.
+    """
+    created = models.DateTimeField(auto_now_add=True, db_index=True)
+    view_name = models.CharField(max_length=200)
+    method = models.CharField(max_length=10)
+    path = models.CharField(max_length=2000)
+    duration = models.FloatField(help_text='Wall time in seconds.')
+    user = models.ForeignKey(User, null=True, blank=True,
+                             on_delete=models.SET_NULL)
+    sampled = models.BooleanField(
+        default=True,
+        help_text='Whether the request was picked at random, rather than '
+                  'asked for by a staff user.')
+    summary = models.TextField(blank=True)
+    stats = models.BinaryField()
+
+    class Meta:
+        ordering = ('-created',)
+
+    def __str__(self):
+        return '{0} {1} ({2:.0f} ms)'.format(self.method, self.view_name,
+                                            self.duration * 1000)
+
+
+class DailyVisits(models.Model):
+    """
+    Site-wide visits per day: each visitor counts once a day, as in the
+    visit count shown on the index and about pages. Written in batches by
+    the buffer in apps.rango.visits.
+    """
+    date = models.DateField(unique=True)
+    visits = models.IntegerField(default=0)
+
+    class Meta:
+        verbose_name_plural = 'Daily visits'
+        ordering = ('-date',)
+
+    def __str__(self):
+        return '{0}: {1}'.format(self.date, self.visits)
+
+
+class PageClick(models.Model):
+    """
+    An append-only log of clicks through the goto view. Clicks are written
+    when the buffered view counts are flushed, as one row per page per
+    flush, and folded into HourlyClicks and the trending scores by
+    apps.rango.trending.update_trending().
+    """
+    page = models.ForeignKey(Page, on_delete=models.CASCADE)
+    category = models.ForeignKey(Category, on_delete=models.CASCADE)
+    clicks = models.IntegerField()
+    created = models.DateTimeField(db_index=True)
+
+    def __str__(self):
+        return '{0} x{1} at {2}'.format(self.page_id, self.clicks, self.created)
+
+
+class HourlyClicks(models.Model):
+    """
+    Clicks per page per hour. Categories are counted by adding up their
+    pages' rows.
+    """
+    page = models.ForeignKey(Page, on_delete=models.CASCADE)
+    category = models.ForeignKey(Category, on_delete=models.CASCADE)
+    hour = models.DateTimeField(db_index=True)
+    clicks = models.IntegerField(default=0)
+
+    class Meta:
+        verbose_name_plural = 'Hourly clicks'
+        unique_together = ('page', 'hour')
+
+    def __str__(self):
+        return '{0} at {1}: {2}'.format(self.page_id, self.hour, self.clicks)
+
+
+class PageTrend(models.Model):
+    """
+    A page's clicks, each decayed exponentially by its age; see
+    apps.rango.trending. Pages whose score decays to almost nothing are
+    removed.
+    """
+    page = models.OneToOneField(Page, primary_key=True, on_delete=models.CASCADE)
+    score = models.FloatField(default=0, db_index=True)
+
+    def __str__(self):
+        return '{0}: {1:.2f}'.format(self.page_id, self.score)
+
+
+class CategoryTrend(models.Model):
+    category = models.OneToOneField(Category, primary_key=True,
+                                    on_delete=models.CASCADE)
+    score = models.FloatField(default=0, db_index=True)
+
+    def __str__(self):
+        return '{0}: {1:.2f}'.format(self.category_id, self.score)
+
+
+class AggregationCursor(models.Model):
+    """
+    How far a job that aggregates an append-only log (such as PageClick)
+    has got: the last primary key it has processed, and when it last ran.
+    """
+    name = models.CharField(max_length=50, unique=True)
+    position = models.BigIntegerField(default=0)
+    updated = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return '{0} at {1}'.format(self.name, self.position)
+
+
+class PageDailyStats(models.Model):
+    """
+    Clicks per page per day, filled from the PageClick log by
+    apps.rango.rollups.rollup_daily_stats().
+    """
+    page = models.ForeignKey(Page, on_delete=models.CASCADE)
+    category = models.ForeignKey(Category, on_delete=models.CASCADE)
+    date = models.DateField(db_index=True)
+    clicks = models.IntegerField(default=0)
+
+    class Meta:
+        verbose_name_plural = 'Page daily stats'
+        unique_together = ('page', 'date')
+
+    def __str__(self):
+        return '{0} on {1}'.format(self.page_id, self.date)
+
+
+class CategoryDailyStats(models.Model):
+    """
+    Clicks on a category's pages per day, and the likes rolled up onto the
+    category that day; see apps.rango.rollups.
+    """
+    category = models.ForeignKey(Category, on_delete=models.CASCADE)
+    date = models.DateField(db_index=True)
+    clicks = models.IntegerField(default=0)
+    likes = models.IntegerField(default=0)
+
+    class Meta:
+        verbose_name_plural = 'Category daily stats'
+        unique_together = ('category', 'date')
+
+    def __str__(self):
+        return '{0} on {1}'.format(self.category_id, self.date)
+
+
+class QueuedTask(models.Model):
+    """
+    A background task waiting in the database queue, run by "manage.py
+    run_worker"; see apps.rango.tasks.DatabaseBackend. Tasks are deleted
+    once they succeed, and kept as failed once they run out of retries.
+    """
+    PENDING = 'pending'
+    RUNNING = 'running'
+    FAILED = 'failed'
+    STATUSES = (
+        (PENDING, 'Pending'),
+        (RUNNING, 'Running'),
+        (FAILED, 'Failed'),
+    )
+
+    name = models.CharField(max_length=200)
+    arguments = models.TextField(help_text='The args and kwargs, as JSON.')
+    status = models.CharField(max_length=10, choices=STATUSES, default=PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    created = models.DateTimeField(auto_now_add=True)
+    run_at = models.DateTimeField()
+    started = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+
+    class Meta:
+        index_together = [('status', 'run_at')]
+
+    def __str__(self):
+        return '{0} ({1})'.format(self.name, self.status)
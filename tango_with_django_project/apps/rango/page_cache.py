@@ -0,0 +1,101 @@
+import hashlib
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse
+
+from .generations import get_generation
+from .metrics import record_cache_lookup
+from .visits import track_visit
+
+
+# Rendered into cached pages in place of the visit count, and replaced with
+# each visitor's own count when the page is served.
+VISITS_PLACEHOLDER = 'rango-visits-placeholder'
+
+
+def is_caching_page(request):
+    """
+    Whether the view is rendering a page for the anonymous page cache, and
+    so should leave out anything specific to this visitor.
+    """
+    return getattr(request, '_rango_caching_page', False)
+
+
+def _cache_key(request, generations, params):
+    # Only the parameters the view reads go into the key, so that made-up
+    # query strings share the page they would render anyway.
+    query = '&'.join('{0}={1!r}'.format(name, parse(request.GET.get(name)))
+                     for name, parse in sorted(params.items()))
+    url = '{0}?{1}'.format(request.path, query)
+    # Hashed, as paths can be longer than memcached allows in a key.
+    return 'rango:page:{0}:{1}'.format(
+        ':'.join(str(get_generation(name)) for name in generations),
+        hashlib.md5(url.encode('utf-8')).hexdigest())
+
+
+def _cacheable(request, response):
+    # A page that uses the CSRF token, or sets cookies of its own, is
+    # different for every visitor.
+    return (response.status_code == 200
+            and not response.streaming
+            and not response.cookies
+            and not request.META.get('CSRF_COOKIE_USED'))
+
+
+def _fill_visits(request, content):
+    return content.replace(VISITS_PLACEHOLDER.encode('ascii'),
+                           str(track_visit(request)).encode('ascii'))
+
+
+def cache_anonymous_page(generations, track_visits=False, params=None):
+    """
+    Caches a view's page for anonymous GET requests, keyed on the path and on
+    the generations that generations(*args, **kwargs) names, so that bumping
+    any of them (see apps.rango.signals) invalidates the page.
+
+    The rest of the query string is ignored unless named in params, a dict
+    from each parameter the view reads to a function that parses its value
+    (None if missing) the same way the view does; the parsed value is what
+    goes into the key. A view that reads other parameters mustn't be cached.
+
+    With track_visits, the visit is recorded here and the visitor's count
+    is put into the page in place of VISITS_PLACEHOLDER, which the view
+    renders instead of the count while the page is being cached.
+
+    A hit costs a few cache lookups and the session, and no queries if the
+    session backend is cached.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if (request.method not in ('GET', 'HEAD')
+                    or request.user.is_authenticated):
+                return view(request, *args, **kwargs)
+
+            key = _cache_key(request, generations(*args, **kwargs),
+                             params or {})
+            cached = cache.get(key)
+            record_cache_lookup('page', cached is not None)
+
+            if cached is None:
+                request._rango_caching_page = True
+                try:
+                    response = view(request, *args, **kwargs)
+                finally:
+                    request._rango_caching_page = False
+                if not _cacheable(request, response):
+                    if track_visits and not response.streaming:
+                        response.content = _fill_visits(request, response.content)
+                    return response
+                cached = (response.content, response['Content-Type'])
+                cache.set(key, cached,
+                          getattr(settings, 'RANGO_PAGE_CACHE_TIMEOUT', 300))
+
+            content, content_type = cached
+            if track_visits:
+                content = _fill_visits(request, content)
+            return HttpResponse(content, content_type=content_type)
+        return wrapper
+    return decorator
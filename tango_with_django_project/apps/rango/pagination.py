@@ -0,0 +1,92 @@
+import base64
+import binascii
+from collections import OrderedDict
+
+from django.db.models import Q
+from django.utils.http import urlencode
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+
+
+class KeysetPagination(BasePagination):
+    """
+    Forward-only cursor pagination over a descending (field, id) ordering.
+
+    The cursor holds the (field, id) values of the last row on the page, and
+    the next page is fetched with WHERE (field, id) < (value, pk) - so every
+    page costs the same however deep it is, and nothing but the page is held
+    in memory. Rows added or deleted ahead of the cursor don't make the next
+    page repeat or skip rows, as they would with offsets. A row whose field
+    changes while a client is paging can still move to the other side of
+    the cursor, though, and then be seen twice or not at all.
+
+    Works with both model instances and values() dictionaries.
+    """
+    field = None
+    page_size = 50
+    max_page_size = 500
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return max(1, min(size, self.max_page_size))
+
+    def decode_cursor(self, request):
+        cursor = request.query_params.get(self.cursor_query_param)
+        if not cursor:
+            return None
+        try:
+            value, pk = base64.urlsafe_b64decode(cursor.encode('ascii')).split(b'_')
+            return int(value), int(pk)
+        except (binascii.Error, UnicodeEncodeError, ValueError):
+            return None
+
+    def encode_cursor(self, row):
+        if isinstance(row, dict):
+            value, pk = row[self.field], row['id']
+        else:
+            value, pk = getattr(row, self.field), row.pk
+        raw = '{0}_{1}'.format(value, pk).encode('ascii')
+        return base64.urlsafe_b64encode(raw).decode('ascii')
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        size = self.get_page_size(request)
+
+        queryset = queryset.order_by('-' + self.field, '-id')
+        after = self.decode_cursor(request)
+        if after is not None:
+            value, pk = after
+            queryset = queryset.filter(
+                Q(**{self.field + '__lt': value}) | Q(**{self.field: value, 'id__lt': pk})
+            )
+
+        rows = list(queryset[:size + 1])
+        self.next_cursor = self.encode_cursor(rows[size - 1]) if len(rows) > size else None
+        return rows[:size]
+
+    def get_next_link(self):
+        if self.next_cursor is None:
+            return None
+        params = self.request.query_params.copy()
+        params[self.cursor_query_param] = self.next_cursor
+        return self.request.build_absolute_uri(
+            '{0}?{1}'.format(self.request.path, urlencode(params.items())))
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('results', data),
+        ]))
+
+
+class CategoryPagination(KeysetPagination):
+    field = 'likes'
+
+
+class PagePagination(KeysetPagination):
+    field = 'views'
@@ -0,0 +1,101 @@
+import cProfile
+import io
+import marshal
+import pstats
+import random
+import time
+
+from django.conf import settings
+
+from .models import RequestProfile
+
+
+DEFAULT_PROFILING = {
+    # Fraction of all requests to profile, e.g. 0.001 for one in a thousand.
+    'sample_rate': 0,
+    # Staff users can profile a request by adding this to its query string.
+    'param': 'profile',
+    # Sampled requests faster than this many seconds aren't kept, so the
+    # profiles left are of the slow ones.
+    'min_duration': 0,
+    # Only the most recent profiles are kept.
+    'max_profiles': 500,
+}
+
+
+def get_profiling_settings():
+    config = dict(DEFAULT_PROFILING)
+    config.update(getattr(settings, 'RANGO_PROFILING', {}))
+    return config
+
+
+class ProfilingMiddleware(object):
+    """
+    Profiles a random sample of requests with cProfile, along with any
+    request a staff user makes with ?profile in its query string, and
+    stores the profiles as RequestProfile rows for the admin.
+
+    Sampled requests that finish in under min_duration seconds are
+    profiled but not kept.
+
+    Requests that aren't profiled cost one query string lookup, plus one
+    random() call if sample_rate is set. Must come after
+    AuthenticationMiddleware.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        config = get_profiling_settings()
+        self.sample_rate = config['sample_rate']
+        self.param = config['param']
+        self.min_duration = config['min_duration']
+        self.max_profiles = config['max_profiles']
+
+    def __call__(self, request):
+        sampled = bool(self.sample_rate) and random.random() < self.sample_rate
+        requested = (not sampled and self.param in request.GET
+                     and request.user.is_staff)
+        if not (sampled or requested):
+            return self.get_response(request)
+
+        profiler = cProfile.Profile()
+        start = time.time()
+        profiler.enable()
+        try:
+            response = self.get_response(request)
+        finally:
+            profiler.disable()
+        duration = time.time() - start
+        if not requested and duration < self.min_duration:
+            return response
+
+        profile = self.save(request, profiler, duration, sampled)
+        if requested:
+            response['X-Rango-Profile'] = str(profile.pk)
+        return response
+
+    def save(self, request, profiler, duration, sampled):
+        summary = io.StringIO()
+        stats = pstats.Stats(profiler, stream=summary)
+        stats.sort_stats('cumulative').print_stats(40)
+
+        match = getattr(request, 'resolver_match', None)
+        user = request.user if request.user.is_authenticated else None
+        profile = RequestProfile.objects.create(
+            view_name=match.view_name if match else 'unresolved',
+            method=request.method,
+            path=request.get_full_path()[:2000],
+            duration=duration,
+            user=user,
+            sampled=sampled,
+            summary=summary.getvalue(),
+            stats=marshal.dumps(stats.stats),
+        )
+
+        # Drop the oldest profiles beyond max_profiles.
+        stale = (RequestProfile.objects.order_by('-created', '-pk')
+                 .values_list('pk', flat=True)[self.max_profiles:])
+        stale = list(stale)
+        if stale:
+            RequestProfile.objects.filter(pk__in=stale).delete()
+        return profile
@@ -0,0 +1,172 @@
+"""
+Daily click and like counts per page and per category, for the stats API.
+
+Clicks are read from the PageClick log by rollup_daily_stats() ("manage.py
+rollup_stats --interval 60"), which keeps its own cursor in the log. Likes
+are added to the day they are rolled up onto Category.likes; see
+apps.rango.likes.rollup_likes().
+"""
+import datetime
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .generations import bump_generation, get_generation
+from .models import AggregationCursor, CategoryDailyStats, PageDailyStats
+from .trending import unread_clicks
+from .visits import today
+
+
+CURSOR_NAME = 'daily_stats'
+
+# The longest range, in days, that one stats request may ask for.
+MAX_RANGE = 366
+
+
+def local_date(value):
+    if settings.USE_TZ:
+        return timezone.localtime(value).date()
+    return value.date()
+
+
+def add_daily_counts(model, key_field, field, counts, related=None):
+    """
+    Adds a {(key, date): n} dictionary to one field of a daily stats model,
+    whose rows are identified by key_field and date. related gives the
+    values of any other fields for rows that have to be created, as a
+    {key: {field: value}} dictionary.
+    """
+    if not counts:
+        return
+    related = related or {}
+    existing = dict(
+        ((key, date), pk) for pk, key, date in
+        model.objects.filter(**{key_field + '__in': set(k for k, _ in counts)})
+        .filter(date__in=set(d for _, d in counts))
+        .values_list('pk', key_field, 'date'))
+
+    new = {}
+    for (key, date), n in counts.items():
+        pk = existing.get((key, date))
+        if pk is None:
+            new[key, date] = n
+        else:
+            model.objects.filter(pk=pk).update(**{field: F(field) + n})
+
+    def make(key, date, n):
+        values = dict(related.get(key, {}), date=date)
+        values[key_field] = key
+        values[field] = n
+        return values
+
+    try:
+        with transaction.atomic():
+            model.objects.bulk_create([model(**make(key, date, n))
+                                       for (key, date), n in new.items()])
+    except IntegrityError:
+        # Another job created some of the same rows since we looked.
+        for (key, date), n in new.items():
+            row, created = model.objects.get_or_create(
+                defaults=make(key, date, n), **{key_field: key, 'date': date})
+            if not created:
+                model.objects.filter(pk=row.pk).update(**{field: F(field) + n})
+
+
+def rollup_daily_stats(now=None, batch_size=5000):
+    """
+    Adds the clicks logged since the last run to PageDailyStats and
+    CategoryDailyStats. As for the trending scores, clicks logged in the
+    last RANGO_TRENDING['lag'] seconds are left for the next run. Runs are
+    serialised on the job's cursor row. Returns the number of PageClick
+    rows processed.
+    """
+    now = now or timezone.now()
+    processed = 0
+    with transaction.atomic():
+        AggregationCursor.objects.get_or_create(name=CURSOR_NAME)
+        cursor = AggregationCursor.objects.select_for_update().get(name=CURSOR_NAME)
+
+        for rows in unread_clicks(cursor, now, batch_size):
+            pages, categories = defaultdict(int), defaultdict(int)
+            page_categories = {}
+            for pk, page_id, category_id, clicks, created in rows:
+                date = local_date(created)
+                pages[page_id, date] += clicks
+                categories[category_id, date] += clicks
+                page_categories[page_id] = {'category_id': category_id}
+
+            add_daily_counts(PageDailyStats, 'page_id', 'clicks', pages,
+                             related=page_categories)
+            add_daily_counts(CategoryDailyStats, 'category_id', 'clicks',
+                             categories)
+            processed += len(rows)
+
+        if processed:
+            cursor.save()
+
+    if processed:
+        bump_generation('stats')
+    return processed
+
+
+def add_daily_likes(totals, date=None):
+    """
+    Adds a {category pk: likes} dictionary to the given day's (by default
+    today's) CategoryDailyStats.
+    """
+    date = date or today()
+    add_daily_counts(CategoryDailyStats, 'category_id', 'likes',
+                     {(pk, date): n for pk, n in totals.items()})
+
+
+def _stats_key(kind, start, end, key):
+    return 'rango:stats:{0}:{1}:{2}:{3}:{4}'.format(
+        get_generation('stats'), kind, start.isoformat(), end.isoformat(),
+        key if key is not None else '')
+
+
+def get_daily_stats(kind, start, end, key=None):
+    """
+    Returns the daily 'categories' or 'pages' stats from start to end
+    inclusive, by date and then by category or page, as a list of
+    dictionaries. key narrows them down to one category (by slug) or page
+    (by primary key). Results are cached until the rollups change.
+    """
+    cache_key = _stats_key(kind, start, end, key)
+    stats = cache.get(cache_key)
+    if stats is not None:
+        return stats
+
+    if kind == 'pages':
+        rows = PageDailyStats.objects.filter(date__range=(start, end))
+        if key is not None:
+            rows = rows.filter(page_id=key)
+        fields = ('date', 'page_id', 'category__slug', 'clicks')
+        names = ('date', 'page', 'category', 'clicks')
+        rows = rows.order_by('date', 'page_id')
+    else:
+        rows = CategoryDailyStats.objects.filter(date__range=(start, end))
+        if key is not None:
+            rows = rows.filter(category__slug=key)
+        fields = ('date', 'category__slug', 'clicks', 'likes')
+        names = ('date', 'category', 'clicks', 'likes')
+        rows = rows.order_by('date', 'category_id')
+
+    stats = []
+    for row in rows.values_list(*fields):
+        item = dict(zip(names, row))
+        item['date'] = item['date'].isoformat()
+        stats.append(item)
+
+    cache.set(cache_key, stats,
+              getattr(settings, 'RANGO_STATS_CACHE_TIMEOUT', 60 * 60))
+    return stats
+
+
+def default_range():
+    end = today()
+    return end - datetime.timedelta(days=29), end
@@ -0,0 +1,249 @@
+import threading
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.urlresolvers import reverse
+from django.db import connection, transaction
+from django.utils.module_loading import import_string
+
+from .models import Category, Page
+from .webhose_search import run_query
+
+
+DEFAULT_SEARCH_BACKEND = {
+    'BACKEND': 'apps.rango.search_backends.WebhoseSearchBackend',
+    'OPTIONS': {},
+}
+
+
+def page_result(title, url):
+    return {'title': title, 'link': url, 'summary': url}
+
+
+def category_result(name, slug):
+    return {
+        'title': name,
+        'link': reverse('rango:show_category', args=[slug]),
+        'summary': 'Rango category',
+    }
+
+
+class BaseSearchBackend(object):
+    """
+    A search backend returns results in the same shape as run_query: a list of
+    dictionaries, each with a title, link and summary.
+
+    Backends that keep their own index set keeps_index, and are told about
+    changes to pages and categories through the index_* and remove_*
+    methods, which are called from background tasks queued by the model
+    signals in apps.rango.signals.
+    """
+    keeps_index = False
+
+    def search(self, search_terms, size=10):
+        raise NotImplementedError
+
+    def index_page(self, page):
+        pass
+
+    def remove_page(self, page):
+        pass
+
+    def index_category(self, category):
+        pass
+
+    def remove_category(self, category):
+        pass
+
+    def rebuild(self, batch_size=1000):
+        """
+        Rebuilds the whole index and returns the number of documents indexed.
+        """
+        return 0
+
+
+class WebhoseSearchBackend(BaseSearchBackend):
+    """
+    Searches the web through the Webhose API.
+    """
+
+    def search(self, search_terms, size=10):
+        return run_query(search_terms, size)
+
+
+class SQLiteSearchBackend(BaseSearchBackend):
+    """
+    Searches our own pages and categories through an SQLite FTS5 table,
+    created by migration 0002_search_index if SQLite was built with FTS5.
+    Without the table every method raises ImproperlyConfigured.
+
+    Each row's rowid encodes what it points to, so updates and deletes are
+    lookups by rowid: pages are stored at 2 * id and categories at 2 * id + 1.
+    """
+    table = 'rango_search_index'
+    keeps_index = True
+    _has_table = False
+
+    def _check_table(self):
+        if self._has_table:
+            return
+        if self.table not in connection.introspection.table_names():
+            raise ImproperlyConfigured(
+                'SQLiteSearchBackend needs the {0} table, which migration '
+                '0002_search_index only creates if SQLite has FTS5.'.format(
+                    self.table))
+        self._has_table = True
+
+    @staticmethod
+    def match_expression(search_terms):
+        """
+        Turns free text into an FTS5 query: every word must match, either as
+        a whole word or as a prefix. Words are quoted so that FTS5 operators
+        in the user's input are treated as plain text.
+        """
+        words = search_terms.split()
+        return ' '.join('"{0}"*'.format(w.replace('"', '""')) for w in words)
+
+    def search(self, search_terms, size=10):
+        match = self.match_expression(search_terms)
+        if not match:
+            return []
+        self._check_table()
+
+        sql = ('SELECT rowid, title, url FROM {table} '
+               'WHERE {table} MATCH %s ORDER BY rank LIMIT %s').format(
+            table=self.table)
+
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [match, size])
+            rows = cursor.fetchall()
+
+        results = []
+        for rowid, title, url in rows:
+            if rowid % 2:
+                results.append(category_result(title, url))
+            else:
+                results.append(page_result(title, url))
+        return results
+
+    def _upsert(self, rowid, title, url):
+        self._check_table()
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'DELETE FROM {0} WHERE rowid = %s'.format(self.table), [rowid])
+            cursor.execute(
+                'INSERT INTO {0} (rowid, title, url) VALUES (%s, %s, %s)'.format(
+                    self.table),
+                [rowid, title, url])
+
+    def _delete(self, rowid):
+        self._check_table()
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'DELETE FROM {0} WHERE rowid = %s'.format(self.table), [rowid])
+
+    def index_page(self, page):
+        self._upsert(page.id * 2, page.title, page.url)
+
+    def remove_page(self, page):
+        self._delete(page.id * 2)
+
+    def index_category(self, category):
+        # For categories the url column holds the slug.
+        self._upsert(category.id * 2 + 1, category.name, category.slug)
+
+    def remove_category(self, category):
+        self._delete(category.id * 2 + 1)
+
+    def rebuild(self, batch_size=1000):
+        insert = 'INSERT INTO {0} (rowid, title, url) VALUES (%s, %s, %s)'.format(
+            self.table)
+        count = 0
+        self._check_table()
+
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute('DELETE FROM {0}'.format(self.table))
+
+            rows = Category.objects.values_list('id', 'name', 'slug')
+            for batch in _batches(rows.iterator(), batch_size):
+                cursor.executemany(
+                    insert, [(pk * 2 + 1, name, slug) for pk, name, slug in batch])
+                count += len(batch)
+
+            rows = Page.objects.values_list('id', 'title', 'url')
+            for batch in _batches(rows.iterator(), batch_size):
+                cursor.executemany(
+                    insert, [(pk * 2, title, url) for pk, title, url in batch])
+                count += len(batch)
+
+            # Merge the index segments written above into one b-tree.
+            cursor.execute(
+                "INSERT INTO {0} ({0}) VALUES ('optimize')".format(self.table))
+        return count
+
+
+class PostgresSearchBackend(BaseSearchBackend):
+    """
+    Searches our own pages and categories with PostgreSQL's full-text search.
+
+    Migration 0002_search_index creates GIN indexes on the same tsvector
+    expressions used below, so Postgres keeps the index up to date on every
+    write and there is nothing to do in the index_* methods.
+    """
+    page_sql = (
+        "SELECT title, url, ts_rank(to_tsvector('english', title || ' ' || url), q) "
+        "FROM rango_page, plainto_tsquery('english', %s) q "
+        "WHERE to_tsvector('english', title || ' ' || url) @@ q "
+        "ORDER BY 3 DESC LIMIT %s"
+    )
+    category_sql = (
+        "SELECT name, slug, ts_rank(to_tsvector('english', name), q) "
+        "FROM rango_category, plainto_tsquery('english', %s) q "
+        "WHERE to_tsvector('english', name) @@ q "
+        "ORDER BY 3 DESC LIMIT %s"
+    )
+
+    def search(self, search_terms, size=10):
+        with connection.cursor() as cursor:
+            cursor.execute(self.category_sql, [search_terms, size])
+            categories = cursor.fetchall()
+            cursor.execute(self.page_sql, [search_terms, size])
+            pages = cursor.fetchall()
+
+        ranked = [(rank, category_result(name, slug))
+                  for name, slug, rank in categories]
+        ranked += [(rank, page_result(title, url)) for title, url, rank in pages]
+        ranked.sort(key=lambda r: r[0], reverse=True)
+        return [result for rank, result in ranked[:size]]
+
+
+def _batches(iterable, size):
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_search_backend():
+    """
+    Returns the search backend configured by settings.RANGO_SEARCH_BACKEND,
+    creating it on first use.
+    """
+    global _backend
+
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                config = getattr(settings, 'RANGO_SEARCH_BACKEND',
+                                 DEFAULT_SEARCH_BACKEND)
+                backend = import_string(config['BACKEND'])
+                _backend = backend(**config.get('OPTIONS', {}))
+    return _backend
@@ -0,0 +1,175 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.module_loading import import_string
+
+
+DEFAULT_SEARCH_CACHE = {
+    'BACKEND': 'apps.rango.search_cache.LocMemResultCache',
+    'OPTIONS': {},
+}
+
+
+def normalize_query(search_terms):
+    """
+    Lower-cases the search terms and collapses runs of whitespace, so that
+    'Python ', 'python' and 'PYTHON' all share a single cache entry.
+    """
+    return ' '.join(search_terms.lower().split())
+
+
+def make_cache_key(search_terms, size):
+    """
+    Builds a cache key from the normalised query and the result size.
+    The query is hashed so the key is always safe for memcached.
+    """
+    query = normalize_query(search_terms)
+    digest = hashlib.md5(query.encode('utf-8')).hexdigest()
+    return 'rango:search:{size}:{digest}'.format(size=size, digest=digest)
+
+
+class BaseResultCache(object):
+    """
+    Common behaviour for the search result caches.
+    Subclasses implement _get(key) and _set(key, value, timeout).
+
+    get() returns None on a miss, otherwise the cached list of results.
+    An empty list is a valid (negative) cached result, and is kept for
+    negative_timeout seconds rather than the full timeout.
+    """
+
+    def __init__(self, timeout=300, negative_timeout=30, max_entries=1000):
+        self.timeout = timeout
+        self.negative_timeout = negative_timeout
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._stats_lock = threading.Lock()
+
+    def get(self, search_terms, size):
+        value = self._get(make_cache_key(search_terms, size))
+
+        with self._stats_lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+
+        if value is None:
+            return None
+        # Hand out a copy so that callers can't mutate the cached entry.
+        return list(value)
+
+    def peek(self, search_terms, size):
+        """
+        Like get(), but doesn't count towards the hit/miss statistics.
+        """
+        value = self._get(make_cache_key(search_terms, size))
+        return None if value is None else list(value)
+
+    def set(self, search_terms, size, results):
+        timeout = self.timeout if results else self.negative_timeout
+        self._set(make_cache_key(search_terms, size), list(results), timeout)
+
+    def stats(self):
+        with self._stats_lock:
+            return {'hits': self.hits, 'misses': self.misses}
+
+    def clear(self):
+        with self._stats_lock:
+            self.hits = 0
+            self.misses = 0
+
+    def _get(self, key):
+        raise NotImplementedError
+
+    def _set(self, key, value, timeout):
+        raise NotImplementedError
+
+
+class LocMemResultCache(BaseResultCache):
+    """
+    In-process cache: an OrderedDict used as an LRU, with an expiry time
+    stored alongside each entry. Each worker process has its own copy.
+    """
+
+    def __init__(self, **kwargs):
+        super(LocMemResultCache, self).__init__(**kwargs)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+
+            expires_at, value = entry
+            if expires_at <= time.time():
+                del self._entries[key]
+                return None
+
+            # Mark the entry as most recently used.
+            self._entries.move_to_end(key)
+            return value
+
+    def _set(self, key, value, timeout):
+        with self._lock:
+            self._entries[key] = (time.time() + timeout, value)
+            self._entries.move_to_end(key)
+            # Evict the least recently used entries once we are over the bound.
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+        super(LocMemResultCache, self).clear()
+
+
+class DjangoResultCache(BaseResultCache):
+    """
+    Stores results in one of the caches configured in settings.CACHES, so that
+    they are shared between worker processes (e.g. with memcached or redis).
+    Expiry is handled by the cache backend, as is eviction - max_entries is
+    left to the backend's own MAX_ENTRIES / LRU policy.
+    """
+
+    def __init__(self, cache_alias='default', **kwargs):
+        super(DjangoResultCache, self).__init__(**kwargs)
+        self.cache_alias = cache_alias
+
+    @property
+    def cache(self):
+        return caches[self.cache_alias]
+
+    def _get(self, key):
+        return self.cache.get(key)
+
+    def _set(self, key, value, timeout):
+        self.cache.set(key, value, timeout)
+
+
+_result_cache = None
+_result_cache_lock = threading.Lock()
+
+
+def get_result_cache():
+    """
+    Returns the result cache configured by settings.WEBHOSE_SEARCH_CACHE,
+    creating it on first use.
+    """
+    global _result_cache
+
+    if _result_cache is None:
+        with _result_cache_lock:
+            if _result_cache is None:
+                config = getattr(settings, 'WEBHOSE_SEARCH_CACHE',
+                                 DEFAULT_SEARCH_CACHE)
+                backend = import_string(config['BACKEND'])
+                _result_cache = backend(**config.get('OPTIONS', {}))
+    return _result_cache
@@ -1,5 +1,8 @@
+from collections import OrderedDict
+
 from .models import Category, Page
 from rest_framework import serializers
+from rest_framework.reverse import reverse
 
 
 class CategorySerializer(serializers.HyperlinkedModelSerializer):
@@ -12,3 +15,93 @@ class PageSerializer(serializers.HyperlinkedModelSerializer):
     class Meta:
         model = Page
         fields = ('category', 'title', 'url',)
+        extra_kwargs = {
+            'category': {'view_name': 'rango:category-detail'},
+        }
+
+
+class BulkCategorySerializer(serializers.ModelSerializer):
+    """
+    Validates one category of a bulk upload. Uniqueness of the name is left
+    to the bulk writer, which checks a whole batch in one query.
+    """
+    class Meta:
+        model = Category
+        fields = ('name', 'views', 'likes')
+        extra_kwargs = {
+            'name': {'validators': []},
+        }
+
+
+class BulkPageSerializer(serializers.ModelSerializer):
+    """
+    Validates one page of a bulk upload. The category may be given as a
+    primary key or as an API hyperlink; it is looked up for a whole batch at
+    once by the view.
+    """
+    category = serializers.CharField()
+
+    class Meta:
+        model = Page
+        fields = ('category', 'title', 'url', 'views')
+
+
+def hyperlink_template(view_name, request):
+    """
+    Reverses a detail view once, returning a format string for its URL, so
+    that links for many rows can be built without reversing each of them.
+    """
+    url = reverse(view_name, kwargs={'pk': '__pk__'}, request=request)
+    return url.replace('{', '{{').replace('}', '}}').replace('__pk__', '{0}')
+
+
+def serialize_category_rows(rows, request):
+    """
+    Renders values() rows the same way as CategorySerializer.
+    """
+    return [OrderedDict([('name', row['name'])]) for row in rows]
+
+
+def serialize_page_rows(rows, request):
+    """
+    Renders values() rows the same way as PageSerializer.
+    """
+    category_url = hyperlink_template('rango:category-detail', request)
+    return [
+        OrderedDict([
+            ('category', category_url.format(row['category_id'])),
+            ('title', row['title']),
+            ('url', row['url']),
+        ])
+        for row in rows
+    ]
+
+
+def serialize_trending_pages(pages, request):
+    """
+    Renders the dictionaries from apps.rango.trending.get_trending('pages').
+    """
+    page_url = hyperlink_template('rango:page-detail', request)
+    category_url = hyperlink_template('rango:category-detail', request)
+    return [
+        OrderedDict([
+            ('page', page_url.format(page['id'])),
+            ('category', category_url.format(page['category_id'])),
+            ('title', page['title']),
+            ('url', page['url']),
+            ('score', round(page['score'], 3)),
+        ])
+        for page in pages
+    ]
+
+
+def serialize_trending_categories(categories, request):
+    category_url = hyperlink_template('rango:category-detail', request)
+    return [
+        OrderedDict([
+            ('category', category_url.format(category['id'])),
+            ('name', category['name']),
+            ('score', round(category['score'], 3)),
+        ])
+        for category in categories
+    ]
@@ -0,0 +1,149 @@
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .bulk import batches, bulk_saved
+from .category_cache import (
+    invalidate_category_page, invalidate_category_pages_for,
+    invalidate_reordered_category_pages
+)
+from .category_stats import (
+    add_page_stats, page_categories, page_change_deltas, recount_page_stats,
+    view_deltas
+)
+from .counters import counters_flushed
+from .generations import bump_generation
+from .likes import create_shards
+from .models import Category, Page, UserProfile
+from .search_backends import get_search_backend
+from .suggestions import get_suggestion_index
+from .tasks import task
+from .thumbnails import generate_thumbnails, thumbnails_missing
+from .trending import log_clicks
+
+
+@task()
+def update_search_index(kind, *pks):
+    """
+    Indexes the given pages or categories, removing from the index any that
+    have been deleted since.
+    """
+    backend = get_search_backend()
+    model = Page if kind == 'page' else Category
+    found = model.objects.in_bulk(pks)
+    for pk in pks:
+        if pk in found:
+            getattr(backend, 'index_' + kind)(found[pk])
+        else:
+            getattr(backend, 'remove_' + kind)(model(pk=pk))
+
+
+def queue_index_update(kind, *pks):
+    if get_search_backend().keeps_index:
+        update_search_index.delay(kind, *pks)
+
+
+@receiver(post_save, sender=Page)
+@receiver(post_delete, sender=Page)
+def index_page(sender, instance, **kwargs):
+    queue_index_update('page', instance.pk)
+
+
+@receiver(pre_save, sender=Page)
+def remember_page_stats(sender, instance, raw=False, update_fields=None,
+                        **kwargs):
+    # The category and views the page had, for update_page_stats(). They
+    # are read from the database, as views is also moved on by the counter
+    # flushes; saves that don't write either field are left alone.
+    instance._previous_stats = None
+    if update_fields is not None and not {'category', 'views'} & set(update_fields):
+        instance._previous_stats = (instance.category_id, instance.views)
+    elif instance.pk is not None and not raw:
+        instance._previous_stats = (Page.objects.filter(pk=instance.pk)
+                                    .values_list('category_id', 'views').first())
+
+
+# Page changes also move on updated_at for the categories the page is (or
+# was) in, since it is the Last-Modified time for their category pages.
+
+@receiver(post_save, sender=Page)
+def update_page_stats(sender, instance, raw=False, **kwargs):
+    deltas = {}
+    if not raw:
+        deltas = page_change_deltas(getattr(instance, '_previous_stats', None),
+                                    (instance.category_id, instance.views))
+    deltas.setdefault(instance.category_id, (0, 0))
+    add_page_stats(deltas, touched=timezone.now())
+
+
+@receiver(post_delete, sender=Page)
+def remove_page_stats(sender, instance, **kwargs):
+    add_page_stats(page_change_deltas((instance.category_id, instance.views), None),
+                   touched=timezone.now())
+
+
+@receiver(post_save, sender=Page)
+@receiver(post_delete, sender=Page)
+def invalidate_page_category(sender, instance, **kwargs):
+    invalidate_category_page(instance.category.slug)
+    bump_generation('pages')
+
+
+@receiver(counters_flushed, sender=Page)
+def page_views_flushed(sender, increments, **kwargs):
+    categories = page_categories(increments)
+    log_clicks(increments, categories)
+    add_page_stats(view_deltas(increments, categories), touched=timezone.now())
+    invalidate_reordered_category_pages(increments)
+    bump_generation('pages')
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def index_category(sender, instance, **kwargs):
+    queue_index_update('category', instance.pk)
+
+
+@receiver(post_save, sender=Category)
+def create_like_shards(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        create_shards(instance.id)
+
+
+@receiver(post_save, sender=Category)
+def category_saved(sender, instance, **kwargs):
+    generation = bump_generation('categories')
+    get_suggestion_index().update(instance, generation)
+
+
+@receiver(post_delete, sender=Category)
+def category_deleted(sender, instance, **kwargs):
+    generation = bump_generation('categories')
+    get_suggestion_index().remove(instance, generation)
+
+
+@receiver(bulk_saved, sender=Page)
+def pages_bulk_saved(sender, pks, **kwargs):
+    for batch in batches(pks, 500):
+        queue_index_update('page', *batch)
+        # Upserts change view counts by amounts we don't know, so the
+        # categories written to are counted again.
+        recount_page_stats(Page.objects.filter(pk__in=batch)
+                           .values_list('category_id', flat=True).distinct(),
+                           touched=timezone.now())
+        invalidate_category_pages_for(batch)
+    bump_generation('pages')
+
+
+@receiver(bulk_saved, sender=Category)
+def categories_bulk_saved(sender, pks, **kwargs):
+    for batch in batches(pks, 500):
+        queue_index_update('category', *batch)
+    bump_generation('categories')
+
+
+@receiver(post_save, sender=UserProfile)
+def queue_thumbnails(sender, instance, raw=False, **kwargs):
+    picture = instance.picture
+    if picture and not raw and thumbnails_missing(picture.name):
+        generate_thumbnails.delay(picture.name)
@@ -0,0 +1,206 @@
+import bisect
+import heapq
+import logging
+import sys
+import threading
+import time
+from collections import namedtuple
+
+from django.conf import settings
+from django.db import connection
+
+from .generations import get_generation
+from .models import Category
+
+
+logger = logging.getLogger(__name__)
+
+Suggestion = namedtuple('Suggestion', ['id', 'name', 'slug', 'likes', 'views'])
+
+
+class SuggestionIndex(object):
+    """
+    An in-memory index of category names for the type-ahead suggestions.
+
+    Names are kept lower-cased in a sorted list, so all the categories that
+    start with a prefix are found with two binary searches: for the prefix,
+    and for the first string after all those that start with it. The best of
+    those are then picked by rank_by ('likes' or 'views'). Results for a
+    prefix are memoised until the index next changes.
+
+    Category saves and deletes in this process update the index in place
+    (see apps.rango.signals). Changes made by other processes bump the
+    'categories' generation, which makes the index reload itself. To pick up
+    new like and view counts it is also reloaded every max_age seconds, on a
+    thread of its own while requests go on using the old counts.
+    """
+
+    max_memo = 10000
+
+    def __init__(self, rank_by='likes', max_age=300):
+        self.rank_by = rank_by
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._keys = []
+        self._entries = []
+        self._key_by_id = {}
+        self._memo = {}
+        self._generation = None
+        self._loaded_at = 0
+        self._refresher = None
+
+    def _score(self, entry):
+        return getattr(entry, self.rank_by)
+
+    def load(self, generation=None):
+        if generation is None:
+            generation = get_generation('categories')
+
+        rows = Category.objects.values_list('id', 'name', 'slug', 'likes', 'views')
+        pairs = sorted((row[1].lower(), Suggestion(*row)) for row in rows)
+
+        with self._lock:
+            self._keys = [key for key, entry in pairs]
+            self._entries = [entry for key, entry in pairs]
+            self._key_by_id = {entry.id: key for key, entry in pairs}
+            self._memo = {}
+            self._generation = generation
+            self._loaded_at = time.time()
+
+    def _ensure_fresh(self):
+        generation = get_generation('categories')
+        if generation != self._generation:
+            # Categories have been added, renamed or deleted elsewhere.
+            self.load(generation)
+        elif time.time() - self._loaded_at > self.max_age:
+            self._refresh_in_background()
+
+    def _refresh_in_background(self):
+        with self._lock:
+            if self._refresher is not None:
+                return
+            self._refresher = threading.Thread(
+                target=self._refresh, name='rango-suggestion-refresh')
+            self._refresher.daemon = True
+        self._refresher.start()
+
+    def _refresh(self):
+        try:
+            self.load()
+        except Exception:
+            logger.exception('Could not reload the category suggestions')
+            # Go on with the old counts until max_age has passed again.
+            self._loaded_at = time.time()
+        finally:
+            self._refresher = None
+            connection.close()
+
+    def suggest(self, starts_with, max_results=8):
+        prefix = starts_with.strip().lower()
+        if not prefix:
+            return []
+
+        self._ensure_fresh()
+
+        memo_key = (prefix, max_results)
+        results = self._memo.get(memo_key)
+        if results is not None:
+            return results
+
+        with self._lock:
+            lo = bisect.bisect_left(self._keys, prefix)
+            after = next_prefix(prefix)
+            hi = (bisect.bisect_left(self._keys, after, lo)
+                  if after is not None else len(self._keys))
+            matches = self._entries[lo:hi]
+
+        if max_results > 0 and len(matches) > max_results:
+            results = heapq.nlargest(max_results, matches, key=self._score)
+        else:
+            results = sorted(matches, key=self._score, reverse=True)
+
+        if len(self._memo) >= self.max_memo:
+            self._memo = {}
+        self._memo[memo_key] = results
+        return results
+
+    def _remove_locked(self, category_id):
+        key = self._key_by_id.pop(category_id, None)
+        if key is None:
+            return
+
+        i = bisect.bisect_left(self._keys, key)
+        while i < len(self._keys) and self._keys[i] == key:
+            if self._entries[i].id == category_id:
+                del self._keys[i]
+                del self._entries[i]
+                return
+            i += 1
+
+    def update(self, category, generation):
+        """
+        Adds or replaces a category in the index, in place. generation is
+        the 'categories' generation bumped for the change.
+        """
+        entry = Suggestion(category.id, category.name, category.slug,
+                           category.likes, category.views)
+        key = entry.name.lower()
+
+        with self._lock:
+            if self._generation is None:
+                # Not loaded yet; the first suggest() will load everything.
+                return
+            self._remove_locked(entry.id)
+            i = bisect.bisect_left(self._keys, key)
+            self._keys.insert(i, key)
+            self._entries.insert(i, entry)
+            self._key_by_id[entry.id] = key
+            self._memo = {}
+            self._adopt_locked(generation)
+
+    def remove(self, category, generation):
+        with self._lock:
+            if self._generation is None:
+                return
+            self._remove_locked(category.id)
+            self._memo = {}
+            self._adopt_locked(generation)
+
+    def _adopt_locked(self, generation):
+        # Only our own bump can be taken as loaded. If another process
+        # bumped the generation as well, keep the old one so the next
+        # suggest() reloads and picks up its change too.
+        if generation == self._generation + 1:
+            self._generation = generation
+
+
+def next_prefix(prefix):
+    """
+    Returns the first string that sorts after every string starting with
+    prefix, or None if there is no such string.
+    """
+    while prefix:
+        last = ord(prefix[-1])
+        if last < sys.maxunicode:
+            return prefix[:-1] + chr(last + 1)
+        prefix = prefix[:-1]
+    return None
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_suggestion_index():
+    """
+    Returns this process's SuggestionIndex, configured by
+    settings.RANGO_SUGGESTIONS.
+    """
+    global _index
+
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                _index = SuggestionIndex(
+                    **getattr(settings, 'RANGO_SUGGESTIONS', {}))
+    return _index
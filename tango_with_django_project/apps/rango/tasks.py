@@ -0,0 +1,338 @@
+"""
+Background tasks, for work that a request doesn't have to wait for.
+
+A function decorated with @task is queued with func.delay(*args, **kwargs),
+once the current transaction (if any) commits, on the backend configured by
+settings.RANGO_TASKS:
+
+- ThreadPoolBackend runs tasks on a pool of threads in this process, from a
+  bounded queue. Tasks are lost if the process exits before they run.
+- DatabaseBackend stores tasks in the QueuedTask table, to be run by
+  "manage.py run_worker" in another process. Arguments must be JSON.
+- ImmediateBackend runs tasks straight away, on the calling thread.
+
+Failed tasks are retried up to max_retries times, waiting retry_delay
+seconds before the first retry and twice as long before each one after.
+"""
+import datetime
+import json
+import logging
+import queue
+import threading
+import time
+import traceback
+from functools import update_wrapper
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .metrics import TASK_QUEUE_DEPTH, TASK_SECONDS, TASK_WAIT_SECONDS, TASKS
+from .models import QueuedTask
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TASKS = {
+    'BACKEND': 'apps.rango.tasks.ThreadPoolBackend',
+    'OPTIONS': {},
+}
+
+_tasks = {}
+
+
+class Task(object):
+
+    def __init__(self, func, max_retries=3, retry_delay=1):
+        self.func = func
+        self.name = '{0}.{1}'.format(func.__module__, func.__name__)
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        update_wrapper(self, func)
+
+    def __call__(self, *args, **kwargs):
+        return self.func(*args, **kwargs)
+
+    def delay(self, *args, **kwargs):
+        """
+        Queues the task to run in the background with the given arguments,
+        once the current transaction commits.
+        """
+        transaction.on_commit(
+            lambda: get_task_backend().enqueue(self.name, args, kwargs))
+
+    def retry_after(self, attempt):
+        """
+        Returns how many seconds to wait before retrying after the given
+        (1-based) attempt failed, or None if it shouldn't be retried.
+        """
+        if attempt > self.max_retries:
+            return None
+        return self.retry_delay * 2 ** (attempt - 1)
+
+
+def task(max_retries=3, retry_delay=1):
+    """
+    Makes a function into a Task, which can still be called directly.
+    """
+    def decorator(func):
+        t = Task(func, max_retries, retry_delay)
+        _tasks[t.name] = t
+        return t
+    return decorator
+
+
+def get_task(name):
+    """
+    Returns the task with the given name, importing the module it is
+    defined in if need be. Raises LookupError for an unknown task.
+    """
+    if name not in _tasks:
+        try:
+            import_string(name)
+        except ImportError:
+            pass
+    try:
+        return _tasks[name]
+    except KeyError:
+        raise LookupError('No task named {0!r}.'.format(name))
+
+
+def retry_after(name, attempt):
+    """
+    Returns how many seconds to wait before retrying a task after the given
+    attempt failed, or None if it shouldn't be retried.
+    """
+    try:
+        return get_task(name).retry_after(attempt)
+    except LookupError:
+        return None
+
+
+def execute(name, args, kwargs, enqueued):
+    """
+    Runs one attempt at a task, recording how long it waited and ran.
+    Exceptions are logged and raised again.
+    """
+    TASK_WAIT_SECONDS.observe(max(time.time() - enqueued, 0), name)
+    start = time.time()
+    try:
+        get_task(name)(*args, **kwargs)
+    except Exception:
+        logger.exception('Task %s failed', name)
+        raise
+    finally:
+        TASK_SECONDS.observe(time.time() - start, name)
+
+
+class BaseTaskBackend(object):
+
+    name = None
+
+    def __init__(self):
+        TASK_QUEUE_DEPTH.track(self.depth, self.name)
+
+    def enqueue(self, name, args, kwargs):
+        raise NotImplementedError
+
+    def depth(self):
+        """
+        Returns the number of tasks waiting to run.
+        """
+        return 0
+
+
+class ImmediateBackend(BaseTaskBackend):
+    """
+    Runs tasks as soon as they are queued, retrying them straight away.
+    For tests and management commands.
+    """
+
+    name = 'immediate'
+
+    def enqueue(self, name, args, kwargs):
+        attempt = 1
+        while True:
+            try:
+                execute(name, args, kwargs, time.time())
+            except Exception:
+                if retry_after(name, attempt) is None:
+                    TASKS.inc(name, 'failure')
+                    return
+                TASKS.inc(name, 'retry')
+                attempt += 1
+            else:
+                TASKS.inc(name, 'success')
+                return
+
+
+class ThreadPoolBackend(BaseTaskBackend):
+    """
+    Runs tasks on worker threads, started on first use, from a queue of at
+    most max_queue tasks. When the queue stays full for enqueue_timeout
+    seconds, the task is run on the calling thread instead, which holds the
+    callers back until the workers catch up.
+    """
+
+    name = 'threads'
+
+    def __init__(self, workers=4, max_queue=1000, enqueue_timeout=1):
+        super(ThreadPoolBackend, self).__init__()
+        self.workers = workers
+        self.enqueue_timeout = enqueue_timeout
+        self._queue = queue.Queue(max_queue)
+        self._threads = []
+        self._lock = threading.Lock()
+
+    def enqueue(self, name, args, kwargs, attempt=1):
+        self._ensure_workers()
+        item = (name, args, kwargs, attempt, time.time())
+        try:
+            self._queue.put(item, timeout=self.enqueue_timeout)
+        except queue.Full:
+            TASKS.inc(name, 'overflow')
+            self._run(item)
+
+    def depth(self):
+        return self._queue.qsize()
+
+    def join(self):
+        """
+        Waits until every queued task has been run (not counting retries
+        that are still waiting for their delay).
+        """
+        self._queue.join()
+
+    def _ensure_workers(self):
+        if len(self._threads) >= self.workers:
+            return
+        with self._lock:
+            while len(self._threads) < self.workers:
+                thread = threading.Thread(target=self._work,
+                                          name='rango-task-worker')
+                thread.daemon = True
+                thread.start()
+                self._threads.append(thread)
+
+    def _work(self):
+        while True:
+            item = self._queue.get()
+            try:
+                self._run(item)
+            finally:
+                self._queue.task_done()
+                close_old_connections()
+
+    def _run(self, item):
+        name, args, kwargs, attempt, enqueued = item
+        try:
+            execute(name, args, kwargs, enqueued)
+        except Exception:
+            delay = retry_after(name, attempt)
+            if delay is None:
+                TASKS.inc(name, 'failure')
+                return
+            TASKS.inc(name, 'retry')
+            timer = threading.Timer(delay, self.enqueue,
+                                    (name, args, kwargs, attempt + 1))
+            timer.daemon = True
+            timer.start()
+        else:
+            TASKS.inc(name, 'success')
+
+
+class DatabaseBackend(BaseTaskBackend):
+    """
+    Queues tasks in the QueuedTask table for "manage.py run_worker". Any
+    number of workers can run; each task is claimed by exactly one of them.
+    Tasks left running for longer than visibility_timeout seconds (because
+    their worker died) are put back in the queue.
+    """
+
+    name = 'database'
+
+    def __init__(self, visibility_timeout=5 * 60):
+        super(DatabaseBackend, self).__init__()
+        self.visibility_timeout = visibility_timeout
+
+    def enqueue(self, name, args, kwargs):
+        QueuedTask.objects.create(
+            name=name, arguments=json.dumps([list(args), kwargs]),
+            run_at=timezone.now())
+
+    def depth(self):
+        return QueuedTask.objects.filter(status=QueuedTask.PENDING).count()
+
+    def claim(self):
+        """
+        Marks the next task that is due as running and returns it, or
+        returns None if there is none.
+        """
+        now = timezone.now()
+        due = (QueuedTask.objects.filter(status=QueuedTask.PENDING, run_at__lte=now)
+               .order_by('run_at', 'pk').values_list('pk', flat=True)[:10])
+        for pk in due:
+            # Only one worker's UPDATE can move the task out of pending.
+            claimed = (QueuedTask.objects.filter(pk=pk, status=QueuedTask.PENDING)
+                       .update(status=QueuedTask.RUNNING, started=now))
+            if claimed:
+                return QueuedTask.objects.get(pk=pk)
+        return None
+
+    def run_next(self):
+        """
+        Runs the next task that is due. Returns False if there was none.
+        """
+        queued = self.claim()
+        if queued is None:
+            return False
+
+        queued.attempts += 1
+        try:
+            args, kwargs = json.loads(queued.arguments)
+            execute(queued.name, args, kwargs, queued.created.timestamp())
+        except Exception:
+            delay = retry_after(queued.name, queued.attempts)
+            queued.last_error = traceback.format_exc()
+            if delay is None:
+                TASKS.inc(queued.name, 'failure')
+                queued.status = QueuedTask.FAILED
+            else:
+                TASKS.inc(queued.name, 'retry')
+                queued.status = QueuedTask.PENDING
+                queued.run_at = timezone.now() + datetime.timedelta(seconds=delay)
+            queued.save()
+        else:
+            TASKS.inc(queued.name, 'success')
+            queued.delete()
+        return True
+
+    def requeue_stale(self):
+        """
+        Puts tasks whose worker seems to have died back in the queue, and
+        returns how many there were.
+        """
+        cutoff = timezone.now() - datetime.timedelta(seconds=self.visibility_timeout)
+        return (QueuedTask.objects.filter(status=QueuedTask.RUNNING, started__lt=cutoff)
+                .update(status=QueuedTask.PENDING))
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_task_backend():
+    """
+    Returns the task backend configured by settings.RANGO_TASKS, creating it
+    on first use.
+    """
+    global _backend
+
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                config = getattr(settings, 'RANGO_TASKS', DEFAULT_TASKS)
+                backend = import_string(config['BACKEND'])
+                _backend = backend(**config.get('OPTIONS', {}))
+    return _backend
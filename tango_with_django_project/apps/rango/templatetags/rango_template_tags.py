@@ -1,12 +1,52 @@
 from django import template
+from django.conf import settings
+from django.core.cache import cache
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
+
+from apps.rango.generations import get_generation
+from apps.rango.metrics import record_cache_lookup
 from apps.rango.models import Category
+from apps.rango.thumbnails import thumbnail_url as get_thumbnail_url
 
 register = template.Library()
 
 
-@register.inclusion_tag('rango/cats.html')
+@register.simple_tag
 def get_category_list(category=None):
-    return {
-        'categories': Category.objects.all(),
-        'act_cat': category
-    }
+    """
+    Renders rango/cats.html with every category, highlighting the active one.
+
+    The active category may be a Category or, as the category pages pass it
+    around, a dictionary with its id. The rendered list is cached per active
+    category, under the 'categories' generation, which is bumped whenever a
+    category is saved or deleted.
+    """
+    if isinstance(category, dict):
+        act_cat_id = category.get('id') or 0
+    else:
+        act_cat_id = getattr(category, 'id', None) or 0
+    key = 'rango:sidebar:{0}:{1}'.format(get_generation('categories'),
+                                          act_cat_id)
+
+    html = cache.get(key)
+    record_cache_lookup('sidebar', html is not None)
+    if html is None:
+        html = render_to_string('rango/cats.html', {
+            'categories': Category.objects.only('id', 'name', 'slug'),
+            'act_cat_id': act_cat_id,
+        })
+        cache.set(key, html, getattr(settings, 'RANGO_SIDEBAR_CACHE_TIMEOUT', 3600))
+    return mark_safe(html)
+
+
+@register.simple_tag
+def thumbnail_url(picture, size='small'):
+    """
+    The URL of a profile picture's thumbnail in the named size (see
+    settings.RANGO_THUMBNAILS), or of the picture itself until the
+    thumbnail has been made. None if there is no picture, so use it as
+    {% thumbnail_url picture 'small' as url %} and leave out the <img>
+    when url is empty.
+    """
+    return get_thumbnail_url(picture, size)
@@ -1,3 +1,1657 @@
-from django.test import TestCase
+import datetime
+import io
+import json
+import marshal
+import os
+import re
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from unittest import mock
+from urllib.parse import parse_qs, urlparse
 
-# Create your tests here.
+import requests
+from PIL import Image
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import IntegrityError, OperationalError, connection
+from django.template import Context, Template
+from django.test import (
+    SimpleTestCase, TestCase, TransactionTestCase, override_settings
+)
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from apps.rango import counters, profiling, visits
+from apps.rango.benchmark import (
+    SCENARIOS, compare_runs, load_runs, previous_run, run_benchmark,
+    save_run, seed_dataset
+)
+from apps.rango.bulk import PageWriter
+from apps.rango.category_cache import get_category_page, parse_cursor
+from apps.rango.circuit_breaker import CircuitBreaker
+from apps.rango.counters import CacheCounterBuffer, LocMemCounterBuffer
+from apps.rango.export import scan_export
+from apps.rango.generations import bump_generation, get_generation
+from apps.rango.likes import add_like, get_like_total, rollup_likes
+from apps.rango.metrics import (
+    DB_QUERIES, REQUESTS, Histogram, Registry, registry
+)
+from apps.rango.models import (
+    Category, CategoryLikeShard, DailyVisits, HourlyClicks, Page, PageClick,
+    PageTrend, QueuedTask, RequestProfile, UserProfile
+)
+from apps.rango.pagination import PagePagination
+from apps.rango.rollups import rollup_daily_stats
+from apps.rango.search_backends import SQLiteSearchBackend, get_search_backend
+from apps.rango.search_cache import LocMemResultCache
+from apps.rango.signals import update_search_index
+from apps.rango.suggestions import SuggestionIndex
+from apps.rango.tasks import (
+    DatabaseBackend, ImmediateBackend, ThreadPoolBackend, task
+)
+from apps.rango.thumbnails import (
+    generate_thumbnails, get_process_pool, thumbnail_path, thumbnail_url
+)
+from apps.rango.trending import get_trending, update_trending
+from apps.rango.webhose_search import (
+    SingleFlight, WebhoseClient, get_circuit_breaker
+)
+
+
+class StubServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # Clients that time out hang up before they get the reply.
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super(StubServer, self).handle_error(request, client_address)
+
+
+class StubWebhoseHandler(BaseHTTPRequestHandler):
+    """
+    Answers like the Webhose search API, echoing the query and token back in
+    the post title. The server's fail_next counter makes it return a 503,
+    and its delay holds up every reply.
+    """
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self.server.requests.append(self.path)
+        self.server.client_ports.add(self.client_address[1])
+        time.sleep(self.server.delay)
+
+        if self.server.fail_next > 0:
+            self.server.fail_next -= 1
+            self._reply(503, b'')
+            return
+
+        params = parse_qs(urlparse(self.path).query)
+        body = json.dumps({'posts': [{
+            'title': '{0}:{1}'.format(params['token'][0], params['q'][0]),
+            'url': 'http://example.com/',
+            'text': 'x' * 500,
+        }]}).encode('utf-8')
+        self._reply(200, body)
+
+    def _reply(self, status, body):
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class WebhoseClientTests(SimpleTestCase):
+
+    def setUp(self):
+        self.server = StubServer(('127.0.0.1', 0), StubWebhoseHandler)
+        self.server.requests = []
+        self.server.client_ports = set()
+        self.server.fail_next = 0
+        self.server.delay = 0
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+        fd, self.key_path = tempfile.mkstemp()
+        with os.fdopen(fd, 'w') as f:
+            f.write('first-key\n')
+
+        self.client = WebhoseClient(
+            root_url='http://127.0.0.1:{0}/search'.format(self.server.server_port),
+            key_path=self.key_path,
+            timeout=(1, 1),
+            max_retries=2,
+            backoff_factor=0,
+        )
+
+    def tearDown(self):
+        self.client.close()
+        self.server.shutdown()
+        self.server.server_close()
+        os.remove(self.key_path)
+
+    def test_search_returns_title_link_and_summary(self):
+        results = self.client.search('django rocks', size=5)
+        self.assertEqual(results, [{
+            'title': 'first-key:django rocks',
+            'link': 'http://example.com/',
+            'summary': 'x' * 200,
+        }])
+
+    def test_connections_are_reused(self):
+        for i in range(5):
+            self.client.search('python')
+        self.assertEqual(len(self.server.requests), 5)
+        self.assertEqual(len(self.server.client_ports), 1)
+
+    def test_key_is_reloaded_when_file_changes(self):
+        self.client.search('python')
+        with open(self.key_path, 'w') as f:
+            f.write('second-key\n')
+        stat = os.stat(self.key_path)
+        os.utime(self.key_path, (stat.st_atime, stat.st_mtime + 10))
+
+        results = self.client.search('python')
+        self.assertEqual(results[0]['title'], 'second-key:python')
+
+    def test_server_errors_are_retried(self):
+        self.server.fail_next = 2
+        results = self.client.search('python')
+        self.assertEqual(len(results), 1)
+        self.assertEqual(len(self.server.requests), 3)
+
+    def test_gives_up_after_max_retries(self):
+        self.server.fail_next = 3
+        with self.assertRaises(requests.RequestException):
+            self.client.search('python')
+        self.assertEqual(len(self.server.requests), 3)
+
+    def test_retries_stop_at_the_deadline(self):
+        self.server.fail_next = 3
+        self.server.delay = 0.3
+        start = time.time()
+        with self.assertRaises(requests.Timeout):
+            self.client.search('python', deadline=start + 0.5)
+        self.assertLess(time.time() - start, 0.8)
+        self.assertEqual(len(self.server.requests), 2)
+
+    def test_nothing_is_sent_after_the_deadline(self):
+        with self.assertRaises(requests.Timeout):
+            self.client.search('python', deadline=time.time() - 1)
+        self.assertEqual(self.server.requests, [])
+
+
+class CircuitBreakerTests(SimpleTestCase):
+
+    def setUp(self):
+        self.breaker = CircuitBreaker('test', failure_threshold=2,
+                                      slow_call_threshold=1, reset_timeout=30)
+        self.now = 1000.0
+        patcher = mock.patch('apps.rango.circuit_breaker.time.time',
+                             lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def trip(self):
+        self.breaker.record(0.1, success=False)
+        self.breaker.record(5)
+        self.assertEqual(self.breaker.state, CircuitBreaker.OPEN)
+
+    def test_opens_after_consecutive_failures(self):
+        self.breaker.record(0.1, success=False)
+        self.breaker.record(0.1)
+        self.breaker.record(0.1, success=False)
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+
+        with self.assertLogs('apps.rango.circuit_breaker'):
+            # Slow calls count as failures.
+            self.breaker.record(5)
+        self.assertEqual(self.breaker.state, CircuitBreaker.OPEN)
+        self.assertFalse(self.breaker.allow_request())
+        self.now += 29
+        self.assertFalse(self.breaker.allow_request())
+        self.assertEqual(self.breaker.stats(), {
+            'state': CircuitBreaker.OPEN, 'failures': 2, 'trips': 1,
+            'rejected': 2,
+        })
+
+    def test_one_probe_closes_it_again(self):
+        with self.assertLogs('apps.rango.circuit_breaker'):
+            self.trip()
+            self.now += 30
+            self.assertEqual(self.breaker.state, CircuitBreaker.HALF_OPEN)
+            self.assertTrue(self.breaker.allow_request())
+            self.assertFalse(self.breaker.allow_request())
+            self.breaker.record(0.1)
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+        self.assertTrue(self.breaker.allow_request())
+        self.assertTrue(self.breaker.allow_request())
+
+    def test_failed_probe_opens_it_again(self):
+        with self.assertLogs('apps.rango.circuit_breaker'):
+            self.trip()
+            self.now += 30
+            self.assertTrue(self.breaker.allow_request())
+            self.breaker.record(0.1, success=False)
+        self.assertEqual(self.breaker.state, CircuitBreaker.OPEN)
+        self.assertFalse(self.breaker.allow_request())
+        self.now += 30
+        self.assertTrue(self.breaker.allow_request())
+        self.assertEqual(self.breaker.trips, 2)
+
+    def test_late_failures_dont_hold_it_open(self):
+        with self.assertLogs('apps.rango.circuit_breaker'):
+            self.trip()
+        self.now += 20
+        # A call let through before the circuit opened fails afterwards.
+        self.breaker.record(0.1, success=False)
+        self.now += 10
+        self.assertEqual(self.breaker.state, CircuitBreaker.HALF_OPEN)
+        self.assertEqual(self.breaker.trips, 1)
+
+
+class SearchCacheTests(SimpleTestCase):
+
+    def setUp(self):
+        self.cache = LocMemResultCache(timeout=300, negative_timeout=30,
+                                       max_entries=2)
+        self.now = 1000.0
+        patcher = mock.patch('apps.rango.search_cache.time.time',
+                             lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_results_expire_after_timeout(self):
+        self.cache.set('Python ', 10, [{'title': 'a'}])
+        self.now += 299
+        self.assertEqual(self.cache.get('python', 10), [{'title': 'a'}])
+        self.assertIsNone(self.cache.get('python', 5))
+        self.now += 1
+        self.assertIsNone(self.cache.get('python', 10))
+
+    def test_empty_results_expire_after_negative_timeout(self):
+        self.cache.set('nothing', 10, [])
+        self.now += 29
+        self.assertEqual(self.cache.get('nothing', 10), [])
+        self.now += 1
+        self.assertIsNone(self.cache.get('nothing', 10))
+
+    def test_hits_and_misses_are_counted(self):
+        self.cache.get('python', 10)
+        self.cache.set('python', 10, [{'title': 'a'}])
+        self.cache.get('python', 10)
+        self.cache.peek('python', 10)
+        self.cache.set('django', 10, [])
+        self.cache.set('flask', 10, [])
+        self.assertEqual(self.cache.stats(), {'hits': 1, 'misses': 1})
+        # The least recently used entry was evicted.
+        self.assertIsNone(self.cache.peek('python', 10))
+
+        self.cache.clear()
+        self.assertEqual(self.cache.stats(), {'hits': 0, 'misses': 0})
+        self.assertIsNone(self.cache.peek('flask', 10))
+
+
+class SingleFlightTests(SimpleTestCase):
+
+    def setUp(self):
+        self.calls = 0
+        self.release = threading.Event()
+
+    def fetch(self, result='result'):
+        self.calls += 1
+        self.release.wait(5)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    def run_callers(self, flight, fn, count=5, peek=None):
+        outcomes = []
+
+        def call():
+            try:
+                outcomes.append(flight.do('key', fn, peek))
+            except Exception as e:
+                outcomes.append(e)
+
+        threads = [threading.Thread(target=call) for i in range(count)]
+        for thread in threads:
+            thread.start()
+        time.sleep(0.2)
+        self.release.set()
+        for thread in threads:
+            thread.join()
+        return outcomes
+
+    def test_concurrent_calls_are_coalesced(self):
+        outcomes = self.run_callers(SingleFlight(), self.fetch)
+        self.assertEqual(outcomes, ['result'] * 5)
+        self.assertEqual(self.calls, 1)
+
+    def test_errors_are_raised_in_every_caller(self):
+        error = ValueError('boom')
+        outcomes = self.run_callers(SingleFlight(),
+                                    lambda: self.fetch(error))
+        self.assertEqual(outcomes, [error] * 5)
+        self.assertEqual(self.calls, 1)
+
+    def test_waiting_callers_give_up_after_wait_timeout(self):
+        flight = SingleFlight(wait_timeout=0.05)
+        outcomes = self.run_callers(flight, self.fetch, count=2)
+        self.assertEqual(outcomes, ['result'] * 2)
+        self.assertEqual(self.calls, 2)
+
+    def test_leader_uses_a_result_that_is_already_there(self):
+        self.release.set()
+        result = SingleFlight().do('key', self.fetch, peek=lambda: 'cached')
+        self.assertEqual(result, 'cached')
+        self.assertEqual(self.calls, 0)
+
+    def test_processes_wait_for_the_one_holding_the_lock(self):
+        flight = SingleFlight(cache_alias='default', wait_timeout=5,
+                              poll_interval=0.01)
+        self.release.set()
+        # Another process holds the lock and publishes its result later.
+        cache.add('key:lock', 1, 10)
+        self.addCleanup(cache.delete, 'key:lock')
+        published = []
+        timer = threading.Timer(0.1, published.append, ['theirs'])
+        timer.start()
+
+        result = flight.do('key', self.fetch,
+                           peek=lambda: published[0] if published else None)
+        self.assertEqual(result, 'theirs')
+        self.assertEqual(self.calls, 0)
+
+        cache.delete('key:lock')
+        published[:] = []
+        self.assertEqual(flight.do('key', self.fetch, peek=lambda: None),
+                         'result')
+        self.assertEqual(self.calls, 1)
+        self.assertIsNone(cache.get('key:lock'))
+
+
+class SearchIndexTests(TestCase):
+
+    def setUp(self):
+        for patcher in (
+                mock.patch('apps.rango.search_backends._backend',
+                           SQLiteSearchBackend()),
+                # Index updates are queued on commit, which tests never do.
+                mock.patch.object(update_search_index, 'delay',
+                                  update_search_index)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        self.category = Category.objects.create(name='Python')
+        self.page = Page.objects.create(
+            category=self.category, title='Official Python Tutorial',
+            url='http://docs.python.org/3/tutorial/')
+
+    def search(self, terms):
+        return [r['title'] for r in get_search_backend().search(terms)]
+
+    def test_saved_pages_and_categories_are_found_by_prefix(self):
+        self.assertEqual(sorted(self.search('pyth')),
+                         ['Official Python Tutorial', 'Python'])
+        self.assertEqual(self.search('tutorial python'),
+                         ['Official Python Tutorial'])
+        self.assertEqual(get_search_backend().search('python')[0]['link'],
+                         '/rango/category/python/')
+        # FTS5 syntax in the query is searched for as text.
+        self.assertEqual(self.search('tutorial OR "NEAR('), [])
+
+    def test_changes_and_deletes_are_indexed(self):
+        self.page.title = 'Learn Python'
+        self.page.save()
+        self.assertEqual(self.search('official'), [])
+        self.assertEqual(self.search('learn'), ['Learn Python'])
+
+        self.category.delete()
+        self.assertEqual(self.search('python'), [])
+
+    def test_bulk_writes_are_indexed_in_batches(self):
+        with mock.patch.object(update_search_index, 'delay') as delay:
+            PageWriter().write([
+                Page(category=self.category, title='PEP {0}'.format(i),
+                     url='https://www.python.org/dev/peps/pep-{0:04}/'.format(i))
+                for i in range(3)])
+        kind, *pks = delay.call_args[0]
+        self.assertEqual((delay.call_count, kind, len(pks)), (1, 'page', 3))
+
+        update_search_index(kind, *pks)
+        self.assertEqual(len(self.search('pep')), 3)
+
+    def test_bulk_writes_are_not_queued_without_an_index(self):
+        with mock.patch('apps.rango.search_backends._backend',
+                        mock.Mock(keeps_index=False)), \
+                mock.patch.object(update_search_index, 'delay') as delay:
+            PageWriter().write([
+                Page(category=self.category, title='PEP 8',
+                     url='https://www.python.org/dev/peps/pep-0008/')])
+        delay.assert_not_called()
+
+    def test_index_is_rebuilt_by_command(self):
+        with connection.cursor() as cursor:
+            cursor.execute('DELETE FROM rango_search_index')
+        self.assertEqual(self.search('python'), [])
+
+        out = io.StringIO()
+        call_command('rebuild_search_index', batch_size=1, stdout=out)
+        self.assertIn('Indexed 2 documents', out.getvalue())
+        self.assertEqual(len(self.search('python')), 2)
+
+    def test_missing_table_is_reported(self):
+        with mock.patch('apps.rango.search_backends._backend',
+                        SQLiteSearchBackend()), \
+                mock.patch.object(connection.introspection, 'table_names',
+                                  return_value=[]):
+            with self.assertRaises(ImproperlyConfigured):
+                self.search('python')
+            with self.assertRaisesMessage(CommandError, 'FTS5'):
+                call_command('rebuild_search_index')
+
+
+class CounterBufferTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        category = Category.objects.create(name='Python')
+        self.first = Page.objects.create(category=category, title='First',
+                                         url='http://first.com/')
+        self.second = Page.objects.create(category=category, title='Second',
+                                          url='http://second.com/')
+        self.flushed = []
+        counters.counters_flushed.connect(self.record_flush, sender=Page)
+        self.addCleanup(counters.counters_flushed.disconnect,
+                        self.record_flush, sender=Page)
+
+    def record_flush(self, sender, field, increments, **kwargs):
+        self.flushed.append(increments)
+
+    def views(self):
+        return list(Page.objects.order_by('pk').values_list('views', flat=True))
+
+    def test_increments_are_written_on_flush(self):
+        buffer = LocMemCounterBuffer(Page, 'views', flush_interval=0,
+                                     touch='updated_at')
+        for pk in (self.first.pk, self.first.pk, self.second.pk):
+            buffer.incr(pk)
+        self.assertEqual(self.views(), [0, 0])
+        self.assertEqual(buffer.pending(self.first.pk), 2)
+
+        touched = self.first.updated_at
+        self.assertEqual(buffer.flush(), 2)
+        self.assertEqual(self.views(), [2, 1])
+        self.assertGreater(Page.objects.get(pk=self.first.pk).updated_at, touched)
+        self.assertEqual(self.flushed, [{self.first.pk: 2, self.second.pk: 1}])
+        self.assertEqual(buffer.flush(), 0)
+
+    def test_failed_flush_keeps_the_increments(self):
+        buffer = LocMemCounterBuffer(Page, 'views', flush_interval=0)
+        buffer.incr(self.first.pk, 3)
+        with mock.patch.object(buffer, 'apply', side_effect=OperationalError), \
+                self.assertLogs('apps.rango.counters', 'ERROR'):
+            with self.assertRaises(OperationalError):
+                buffer.flush()
+        self.assertEqual(buffer.pending(self.first.pk), 3)
+        self.assertEqual(buffer.flush(), 1)
+        self.assertEqual(self.views(), [3, 0])
+
+    def test_failing_receiver_rolls_back_the_flush(self):
+        buffer = LocMemCounterBuffer(Page, 'views', flush_interval=0)
+        buffer.incr(self.first.pk, 3)
+        with mock.patch('apps.rango.signals.log_clicks',
+                        side_effect=OperationalError), \
+                self.assertLogs('apps.rango.counters', 'ERROR'):
+            with self.assertRaises(OperationalError):
+                buffer.flush()
+        self.assertEqual(self.views(), [0, 0])
+        self.assertEqual(buffer.pending(self.first.pk), 3)
+
+        self.assertEqual(buffer.flush(), 1)
+        self.assertEqual(self.views(), [3, 0])
+        self.assertEqual(PageClick.objects.get().clicks, 3)
+
+    def test_flusher_runs_early_at_max_pending_and_at_exit(self):
+        buffer = LocMemCounterBuffer(Page, 'views', flush_interval=60,
+                                     max_pending=3)
+        flushed = threading.Event()
+        with mock.patch.object(buffer, 'flush', side_effect=flushed.set) as flush, \
+                mock.patch('apps.rango.counters.atexit.register') as register:
+            buffer.incr(self.first.pk, 2)
+            self.assertFalse(flushed.wait(0.1))
+            buffer.incr(self.second.pk)
+            self.assertTrue(flushed.wait(5))
+        register.assert_called_once_with(flush)
+
+    def test_cache_buffer_needs_an_atomic_cache(self):
+        config = {'BACKEND': 'apps.rango.counters.CacheCounterBuffer',
+                  'OPTIONS': {'cache_alias': 'files', 'flush_interval': 0}}
+        files = {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': tempfile.mkdtemp(),
+        }
+        self.addCleanup(shutil.rmtree, files['LOCATION'])
+        with override_settings(CACHES={'default': settings.CACHES['default'],
+                                       'files': files}), \
+                self.assertLogs('apps.rango.counters', 'WARNING'):
+            buffer = counters.make_counter_buffer(
+                config, LocMemCounterBuffer, Page, 'views')
+        self.assertIs(type(buffer), LocMemCounterBuffer)
+        self.assertEqual(buffer.flush_interval, 0)
+
+        config['OPTIONS']['cache_alias'] = 'default'
+        buffer = counters.make_counter_buffer(
+            config, LocMemCounterBuffer, Page, 'views')
+        self.assertIs(type(buffer), CacheCounterBuffer)
+
+    def test_cache_buffer_flushes_the_rows_it_incremented(self):
+        buffer = CacheCounterBuffer(Page, 'views', flush_interval=0)
+        other = CacheCounterBuffer(Page, 'views', flush_interval=0)
+        buffer.incr(self.first.pk, 2)
+        self.assertEqual(other.pending(self.first.pk), 2)
+
+        # Another process doesn't know which rows this one incremented...
+        self.assertEqual(other.flush(), 0)
+        # ...until it increments one of them too.
+        other.incr(self.first.pk)
+        self.assertEqual(other.flush(), 1)
+        self.assertEqual(self.views(), [3, 0])
+        self.assertEqual(buffer.flush(), 0)
+
+
+class ShardedLikeTests(TransactionTestCase):
+
+    def setUp(self):
+        self.category = Category.objects.create(name='Python', likes=10)
+
+    def run_in_threads(self, target, threads=8):
+        def run():
+            try:
+                target()
+            finally:
+                connection.close()
+
+        workers = [threading.Thread(target=run) for i in range(threads)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+    def test_add_like_returns_total_including_shards(self):
+        self.assertEqual(add_like(self.category.id), 11)
+        self.assertEqual(add_like(self.category.id), 12)
+        self.assertEqual(Category.objects.get(id=self.category.id).likes, 10)
+
+    def test_add_like_for_missing_category(self):
+        self.assertIsNone(add_like(self.category.id + 1))
+
+    def test_shards_are_created_for_old_categories(self):
+        CategoryLikeShard.objects.all().delete()
+        self.assertEqual(add_like(self.category.id), 11)
+        self.assertTrue(CategoryLikeShard.objects.exists())
+
+    def test_likes_on_shards_added_since_are_kept(self):
+        with override_settings(RANGO_LIKE_SHARDS=16), \
+                mock.patch('apps.rango.likes.random.randrange', return_value=12):
+            self.assertEqual(add_like(self.category.id), 11)
+            self.assertEqual(add_like(self.category.id), 12)
+        self.assertEqual(CategoryLikeShard.objects.count(), 9)
+        self.assertEqual(CategoryLikeShard.objects.get(shard=12).count, 2)
+
+    def test_concurrent_likes_and_rollups_are_not_lost(self):
+        def like():
+            for i in range(25):
+                add_like(self.category.id)
+
+        def roll_up():
+            while not done.is_set():
+                try:
+                    rolled_up.append(rollup_likes())
+                except OperationalError:
+                    # SQLite refuses a writer that would deadlock; the
+                    # rollup is atomic, so it's safe to simply go again.
+                    pass
+            connection.close()
+
+        rolled_up = []
+        done = threading.Event()
+        roller = threading.Thread(target=roll_up)
+        roller.start()
+        try:
+            self.run_in_threads(like)
+        finally:
+            done.set()
+            roller.join()
+
+        self.assertEqual(get_like_total(self.category.id), 210)
+        self.assertTrue(any(rolled_up))
+
+        rollup_likes()
+        self.assertEqual(Category.objects.get(id=self.category.id).likes, 210)
+        self.assertFalse(CategoryLikeShard.objects.exclude(count=0).exists())
+
+
+def use_manual_counters(test):
+    """
+    Swaps the page view and daily visit buffers for ones that are only
+    flushed by hand, for the rest of the test. A background flush would wait
+    on the test's transaction, or outlive the test database.
+    """
+    for module, name, model, field, buffer_class, options in (
+            (counters, '_view_counter', 'rango.Page', 'views',
+             LocMemCounterBuffer, {'touch': 'updated_at'}),
+            (visits, '_visit_counter', 'rango.DailyVisits', 'visits',
+             visits.LocMemDailyVisitBuffer, {})):
+        patcher = mock.patch.object(
+            module, name, buffer_class(model, field, flush_interval=0, **options))
+        patcher.start()
+        test.addCleanup(patcher.stop)
+
+
+class SidebarTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.python = Category.objects.create(name='Python')
+
+    def render(self, category=None):
+        return Template(
+            '{% load rango_template_tags %}{% get_category_list category %}'
+        ).render(Context({'category': category}))
+
+    def test_list_is_cached_per_active_category(self):
+        html = self.render(self.python)
+        self.assertIn('class="nav-link active" href="/rango/category/python/"', html)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.render(self.python), html)
+
+        self.assertNotIn('active', self.render())
+
+    def test_category_pages_pass_the_category_as_a_dictionary(self):
+        html = self.render({'id': self.python.pk, 'slug': 'python'})
+        self.assertIn('class="nav-link active" href="/rango/category/python/"', html)
+
+    def test_category_changes_invalidate_the_list(self):
+        self.render()
+        django = Category.objects.create(name='Django')
+        self.assertIn('/rango/category/django/', self.render())
+
+        django.delete()
+        self.assertNotIn('/rango/category/django/', self.render())
+
+
+class SuggestionTests(TestCase):
+
+    def setUp(self):
+        self.index = SuggestionIndex(max_age=60)
+        patcher = mock.patch('apps.rango.suggestions._index', self.index)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        for name, likes in (('Python', 5), ('Pyramid', 9), ('Django', 20),
+                            ('Py\U0001F40D', 1)):
+            Category.objects.create(name=name, likes=likes)
+
+    def names(self, prefix, max_results=8):
+        return [s.name for s in self.index.suggest(prefix, max_results)]
+
+    def test_categories_are_suggested_by_prefix_and_likes(self):
+        self.assertEqual(self.names('PY'), ['Pyramid', 'Python', 'Py\U0001F40D'])
+        self.assertEqual(self.names('py', 1), ['Pyramid'])
+        self.assertEqual(self.names('py\U0001F40D'), ['Py\U0001F40D'])
+        self.assertEqual(self.names('pyt'), ['Python'])
+        self.assertEqual(self.names('flask'), [])
+        self.assertEqual(self.names(' '), [])
+
+        Category.objects.create(name='Pylons', likes=7)
+        Category.objects.get(name='Pyramid').delete()
+        self.assertEqual(self.names('py'), ['Pylons', 'Python', 'Py\U0001F40D'])
+
+    def test_changes_from_other_processes_are_not_skipped(self):
+        self.names('py')
+        # Another process renames a category and bumps the generation, just
+        # before this one saves another.
+        Category.objects.filter(name='Python').update(name='Flask')
+        bump_generation('categories')
+        Category.objects.create(name='Pylons', likes=7)
+        self.assertEqual(self.names('py'), ['Pyramid', 'Pylons', 'Py\U0001F40D'])
+
+    def test_json_suggestions(self):
+        response = self.client.get('/rango/suggest/json/', {'suggestion': 'pyt'})
+        self.assertEqual(json.loads(response.content.decode()), {'categories': [{
+            'name': 'Python', 'slug': 'python', 'url': '/rango/category/python/',
+            'likes': 5, 'views': 0,
+        }]})
+
+    def test_old_counts_are_reloaded_in_the_background(self):
+        self.names('py')
+        Category.objects.filter(name='Python').update(likes=100)
+        self.assertEqual(self.names('py')[0], 'Pyramid')
+
+        loaded_on = []
+        loaded = threading.Event()
+
+        def load():
+            loaded_on.append(threading.current_thread())
+            loaded.set()
+
+        later = time.time() + 61
+        with mock.patch('apps.rango.suggestions.time.time', return_value=later), \
+                mock.patch.object(self.index, 'load', side_effect=load):
+            self.assertEqual(self.names('py')[0], 'Pyramid')
+            self.assertTrue(loaded.wait(5))
+        self.assertEqual(len(loaded_on), 1)
+        self.assertIsNot(loaded_on[0], threading.current_thread())
+
+        self.index.load()
+        self.assertEqual(self.names('py')[0], 'Python')
+
+
+@override_settings(RANGO_CATEGORY_PAGE_SIZE=2)
+class CategoryCacheTests(TestCase):
+
+    def setUp(self):
+        use_manual_counters(self)
+        cache.clear()
+        category = Category.objects.create(name='Python')
+        self.pages = [
+            Page.objects.create(category=category, title=title, views=views,
+                                url='http://{0}.com/'.format(title))
+            for title, views in (('first', 30), ('second', 20), ('third', 10))
+        ]
+
+    def titles(self):
+        return [page['title'] for page in get_category_page('python')[1]]
+
+    def add_views(self, page, n):
+        counter = counters.get_view_counter()
+        counter.incr(page.pk, n)
+        counter.flush()
+
+    def test_first_page_is_cached_and_later_ones_follow_the_cursor(self):
+        category, pages, cursor = get_category_page('python')
+        self.assertEqual(self.titles(), ['first', 'second'])
+        with self.assertNumQueries(0):
+            self.assertEqual(get_category_page('python'), (category, pages, cursor))
+
+        self.assertEqual(cursor, '20_{0}'.format(self.pages[1].pk))
+        category, pages, cursor = get_category_page('python', parse_cursor(cursor))
+        self.assertEqual([page['title'] for page in pages], ['third'])
+        self.assertIsNone(cursor)
+
+        response = self.client.get('/rango/category/python/',
+                                   {'after': '20_{0}'.format(self.pages[1].pk)})
+        self.assertContains(response, 'page_id={0}"'.format(self.pages[2].pk))
+        self.assertNotContains(response, 'page_id={0}"'.format(self.pages[0].pk))
+
+    def test_view_flushes_only_invalidate_when_the_order_changes(self):
+        self.titles()
+        self.add_views(self.pages[2], 5)
+        self.add_views(self.pages[0], 5)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.titles(), ['first', 'second'])
+
+        self.add_views(self.pages[2], 10)
+        self.assertEqual(self.titles(), ['first', 'third'])
+
+        # Ties are broken by id, newest first.
+        self.add_views(self.pages[2], 10)
+        self.assertEqual(self.titles(), ['third', 'first'])
+
+
+class KeysetPaginationTests(TestCase):
+
+    def setUp(self):
+        category = Category.objects.create(name='Python')
+        self.pages = [
+            Page.objects.create(category=category, title=str(i), views=views,
+                                url='http://{0}.com/'.format(i))
+            for i, views in enumerate((5, 7, 5, 5, 1))
+        ]
+
+    def test_cursor_round_trips(self):
+        pagination = PagePagination()
+        cursor = pagination.encode_cursor({'views': 5, 'id': 12})
+        self.assertEqual(cursor, 'NV8xMg==')
+        self.assertEqual(pagination.encode_cursor(self.pages[0]),
+                         pagination.encode_cursor({'views': 5, 'id': self.pages[0].pk}))
+
+        request = mock.Mock(query_params={'cursor': cursor})
+        self.assertEqual(pagination.decode_cursor(request), (5, 12))
+        for bad in ('', 'not base64!', 'NV8=', 'eF95'):
+            request = mock.Mock(query_params={'cursor': bad})
+            self.assertIsNone(pagination.decode_cursor(request))
+
+    def test_equal_counts_are_paged_by_id(self):
+        titles = []
+        url = '/rango/api/pages/?page_size=2'
+        while url:
+            data = self.client.get(url).json()
+            titles.append([page['title'] for page in data['results']])
+            url = data['next']
+        # Views 7, then the three pages with 5 views newest first, then 1.
+        self.assertEqual(titles, [['1', '3'], ['2', '0'], ['4']])
+
+    def test_malformed_cursor_starts_from_the_top(self):
+        data = self.client.get('/rango/api/pages/',
+                               {'cursor': '!!', 'page_size': 1000}).json()
+        self.assertEqual(len(data['results']), 5)
+        self.assertIsNone(data['next'])
+
+
+class BulkWriteTests(TestCase):
+
+    def setUp(self):
+        Category.objects.create(name='Python', likes=1)
+
+    def post(self, items, mode='create'):
+        response = self.client.post(
+            '/rango/api/categories/bulk/?mode={0}&batch_size=2'.format(mode),
+            json.dumps(items), content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def likes(self):
+        return dict(Category.objects.values_list('name', 'likes'))
+
+    def test_create_rejects_existing_categories(self):
+        result = self.post([{'name': 'Django', 'likes': 3}, {'name': 'Python'},
+                            {'name': 'Flask'}, {'name': 'Flask', 'likes': 2}])
+        self.assertEqual(result['created'], 2)
+        self.assertEqual(result['errors'], [
+            {'index': 1, 'errors': {'non_field_errors': ['Already exists.']}}])
+        self.assertEqual(self.likes(), {'Python': 1, 'Django': 3, 'Flask': 2})
+        self.assertEqual(Category.objects.get(name='Flask').slug, 'flask')
+        # Bulk-created categories get their like shards too.
+        self.assertEqual(CategoryLikeShard.objects.filter(
+            category__name__in=['Django', 'Flask']).count(), 16)
+
+    def test_upsert_and_skip(self):
+        result = self.post([{'name': 'Python', 'likes': 5}, {'name': 'Django'}],
+                           mode='upsert')
+        self.assertEqual((result['created'], result['updated']), (1, 1))
+        self.assertEqual(self.likes(), {'Python': 5, 'Django': 0})
+
+        result = self.post([{'name': 'Python', 'likes': 9}, {'name': 'Flask'}],
+                           mode='skip')
+        self.assertEqual((result['created'], result['skipped']), (1, 1))
+        self.assertEqual(self.likes(), {'Python': 5, 'Django': 0, 'Flask': 0})
+
+    def test_names_with_a_taken_slug_are_rejected(self):
+        result = self.post([{'name': 'python!'}, {'name': 'Web Dev'},
+                            {'name': 'web-dev'}, {'name': 'Python', 'likes': 4}],
+                           mode='upsert')
+        self.assertEqual((result['created'], result['updated']), (1, 1))
+        self.assertEqual(result['errors'], [
+            {'index': 0, 'errors': {'name': ["The category 'Python' has the same slug."]}},
+            {'index': 2, 'errors': {'name': ["The category 'Web Dev' has the same slug."]}},
+        ])
+        self.assertEqual(self.likes(), {'Python': 4, 'Web Dev': 0})
+
+
+class ExportTests(TestCase):
+
+    def setUp(self):
+        category = Category.objects.create(name='Python')
+        self.pages = [
+            Page.objects.create(category=category, title=title,
+                                url='http://{0}.com/'.format(i))
+            for i, title in enumerate(('First', 'Two\nlines, "quoted"', 'Last'))
+        ]
+        fd, self.path = tempfile.mkstemp()
+        os.close(fd)
+        self.addCleanup(os.remove, self.path)
+
+    def export(self, fmt, *args):
+        call_command('export_rango', 'pages', '--format', fmt,
+                     '--output', self.path, *args)
+        with open(self.path, 'rb') as f:
+            return f.read()
+
+    def test_csv_rows_with_newlines_are_resumed_after(self):
+        full = self.export('csv')
+        self.assertEqual(full.count(b'id,category_id'), 1)
+        lines = full.splitlines(True)
+        self.assertEqual(len(lines), 5)
+        self.assertEqual(scan_export(lines, 'csv'),
+                         (self.pages[2].pk, len(full)))
+
+        # Cut off inside the quoted title, after its newline.
+        with open(self.path, 'wb') as f:
+            f.write(b''.join(lines[:3]))
+        self.assertEqual(scan_export(lines[:3], 'csv'),
+                         (self.pages[0].pk, len(b''.join(lines[:2]))))
+        self.assertEqual(self.export('csv', '--resume'), full)
+
+    def test_header_is_written_to_new_and_empty_files(self):
+        full = self.export('csv')
+        with open(self.path, 'wb') as f:
+            f.write(full[:5])
+        self.assertEqual(self.export('csv', '--resume'), full)
+
+        after = self.export('csv', '--after', str(self.pages[1].pk))
+        self.assertEqual(after.splitlines()[0], full.splitlines()[0])
+        self.assertEqual(len(after.splitlines()), 2)
+
+    def test_ndjson_is_resumed_after_the_last_complete_line(self):
+        full = self.export('ndjson')
+        with open(self.path, 'wb') as f:
+            f.write(full[:full.index(b'\n') + 10])
+        self.assertEqual(self.export('ndjson', '--resume'), full)
+
+    def test_resumed_download_has_no_header(self):
+        user = User.objects.create_user('admin', password='secret', is_staff=True)
+        self.client.force_login(user)
+        response = self.client.get('/rango/export/pages.csv',
+                                   {'after': self.pages[1].pk})
+        content = b''.join(response.streaming_content).decode()
+        self.assertEqual(content, '{0},{1},Last,http://2.com/,0\r\n'.format(
+            self.pages[2].pk, self.pages[2].category_id))
+
+
+class LoadRangoTests(TestCase):
+
+    def setUp(self):
+        Category.objects.create(name='Python')
+        fd, self.path = tempfile.mkstemp(suffix='.csv')
+        with os.fdopen(fd, 'w') as f:
+            f.write('category,title,url,views\n'
+                    'python,Tutorial,http://docs.python.org/,3\n'
+                    'python,Broken,http://broken.com/,0\n'
+                    'python,Bad link,not a url,0\n'
+                    'flask,Flask,http://flask.pocoo.org/,0\n'
+                    'python,PEP 8,https://www.python.org/dev/peps/pep-0008/,1\n')
+        self.addCleanup(os.remove, self.path)
+
+    def load(self):
+        out, err = io.StringIO(), io.StringIO()
+        call_command('load_rango', 'pages', self.path, stdout=out, stderr=err)
+        return out.getvalue(), err.getvalue().splitlines()
+
+    def test_bad_rows_are_reported_by_line(self):
+        out, errors = self.load()
+        self.assertIn('Created 3, updated 0, skipped 0 pages', out)
+        self.assertEqual(errors, [
+            '{0}:4: url: Enter a valid URL.'.format(self.path),
+            "{0}:5: Unknown category 'flask'.".format(self.path),
+        ])
+
+    def test_rows_the_database_refuses_are_found(self):
+        write = PageWriter.write
+
+        def refuse_broken(writer, objs):
+            if any(obj.title == 'Broken' for obj in objs):
+                raise IntegrityError('Broken page')
+            return write(writer, objs)
+
+        with mock.patch.object(PageWriter, 'write', refuse_broken):
+            out, errors = self.load()
+        self.assertIn('Created 2, updated 0, skipped 0 pages', out)
+        self.assertIn('{0}:3: Broken page'.format(self.path), errors)
+        self.assertEqual(sorted(Page.objects.values_list('title', flat=True)),
+                         ['PEP 8', 'Tutorial'])
+
+
+class BenchmarkTests(TestCase):
+
+    def setUp(self):
+        seed_dataset(categories=20, pages=500, batch_size=100)
+
+        use_manual_counters(self)
+
+    def test_seeded_popularity_is_skewed(self):
+        counts = sorted(
+            (c.page_set.count() for c in Category.objects.all()), reverse=True)
+        self.assertEqual(sum(counts), 500)
+        self.assertGreater(counts[0], 5 * counts[-1])
+
+    def test_every_scenario_runs_without_errors(self):
+        run = run_benchmark(requests=3, warmup=1)
+        self.assertEqual([r['scenario'] for r in run['results']], list(SCENARIOS))
+        for result in run['results']:
+            self.assertEqual(result['requests'], 3, result['scenario'])
+            self.assertEqual(result['errors'], 0, result['scenario'])
+
+    def test_runs_are_compared_with_other_commits(self):
+        run = run_benchmark(['index'], requests=2, warmup=0)
+        older = dict(run, commit='older', results=[
+            dict(run['results'][0], p50_ms=run['results'][0]['p50_ms'] / 2)])
+
+        fd, path = tempfile.mkstemp()
+        os.close(fd)
+        self.addCleanup(os.remove, path)
+        save_run(path, older)
+        save_run(path, dict(run, commit='current'))
+
+        previous = previous_run(load_runs(path), dict(run, commit='current'))
+        self.assertEqual(previous['commit'], 'older')
+        self.assertAlmostEqual(compare_runs(previous, run)['index'], 1.0)
+
+
+class MetricsTests(TestCase):
+
+    def setUp(self):
+        use_manual_counters(self)
+
+    def test_histogram_buckets_are_cumulative(self):
+        histogram = Histogram('latency_seconds', 'Latency.', ['view'],
+                              buckets=(0.1, 1))
+        for value in (0.05, 0.5, 0.5, 5):
+            histogram.observe(value, 'index')
+
+        registry = Registry()
+        registry.register(histogram)
+        self.assertEqual(registry.render().splitlines(), [
+            '# HELP latency_seconds Latency.',
+            '# TYPE latency_seconds histogram',
+            'latency_seconds_bucket{view="index",le="0.1"} 1',
+            'latency_seconds_bucket{view="index",le="1"} 3',
+            'latency_seconds_bucket{view="index",le="+Inf"} 4',
+            'latency_seconds_sum{view="index"} 6.05',
+            'latency_seconds_count{view="index"} 4',
+        ])
+
+    def test_requests_are_recorded_by_url_name(self):
+        before = REQUESTS.value('rango:about', 'GET', '200')
+        self.client.get('/rango/about/')
+        self.assertEqual(REQUESTS.value('rango:about', 'GET', '200'), before + 1)
+
+        with override_settings(RANGO_METRICS_IPS=['10.0.0.2']):
+            response = self.client.get('/metrics', REMOTE_ADDR='10.0.0.2')
+        self.assertIn(
+            'rango_request_duration_seconds_count{view="rango:about",method="GET"}',
+            response.content.decode())
+
+    def test_circuit_breaker_is_reported(self):
+        breaker = get_circuit_breaker()
+        lines = registry.render().splitlines()
+        self.assertIn('rango_webhose_circuit_state{{state="{0}"}} 1'.format(
+            breaker.state), lines)
+        self.assertIn('rango_webhose_circuit_trips_total {0}'.format(
+            breaker.trips), lines)
+
+    def test_queries_are_counted(self):
+        Category.objects.create(name='Python')
+        with CaptureQueriesContext(connection) as queries, \
+                mock.patch.object(DB_QUERIES, 'observe') as observe:
+            self.client.get('/rango/api/categories/')
+        self.assertGreater(len(queries), 0)
+        observe.assert_called_once_with(len(queries), 'rango:category-list')
+
+    def test_metrics_are_only_for_staff_and_listed_addresses(self):
+        for address in ('127.0.0.1', '10.0.0.1'):
+            response = self.client.get('/metrics', REMOTE_ADDR=address)
+            self.assertEqual(response.status_code, 403)
+
+        user = User.objects.create_user('admin', is_staff=True)
+        self.client.force_login(user)
+        response = self.client.get('/metrics', REMOTE_ADDR='10.0.0.1')
+        self.assertEqual(response.status_code, 200)
+
+
+class ProfilingTests(TestCase):
+
+    def setUp(self):
+        use_manual_counters(self)
+
+    def sample(self, **config):
+        config.setdefault('sample_rate', 0.5)
+        # The middleware reads its settings when a client first loads it.
+        with override_settings(RANGO_PROFILING=config), \
+                mock.patch.object(profiling.random, 'random', return_value=0.25):
+            return self.client_class().get('/rango/about/')
+
+    def test_a_sample_of_requests_is_profiled(self):
+        self.sample()
+        profile = RequestProfile.objects.get()
+        self.assertEqual(profile.view_name, 'rango:about')
+        self.assertTrue(profile.sampled)
+        self.assertIn('cumulative', profile.summary)
+
+        self.sample(sample_rate=0.1)
+        self.assertEqual(RequestProfile.objects.count(), 1)
+
+    def test_sampled_requests_under_min_duration_are_dropped(self):
+        self.sample(min_duration=60)
+        self.assertFalse(RequestProfile.objects.exists())
+        self.sample(min_duration=0)
+        self.assertEqual(RequestProfile.objects.count(), 1)
+
+    def test_only_the_newest_profiles_are_kept(self):
+        for i in range(3):
+            self.sample(max_profiles=2)
+        kept = RequestProfile.objects.order_by('pk').values_list('pk', flat=True)
+        self.assertEqual(len(kept), 2)
+        self.assertEqual(max(kept) - min(kept), 1)
+
+    def test_staff_can_profile_a_request_and_download_it(self):
+        response = self.client.get('/rango/about/?profile')
+        self.assertNotIn('X-Rango-Profile', response)
+        self.assertFalse(RequestProfile.objects.exists())
+
+        admin = User.objects.create_superuser('admin', '', 'password')
+        self.client.force_login(admin)
+        response = self.client.get('/rango/about/?profile')
+        pk = int(response['X-Rango-Profile'])
+        self.assertFalse(RequestProfile.objects.get(pk=pk).sampled)
+
+        url = '/admin/rango/requestprofile/{0}/download/'.format(pk)
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('rango-about-{0}.prof'.format(pk),
+                      response['Content-Disposition'])
+        self.assertIsInstance(marshal.loads(response.content), dict)
+
+        self.client.force_login(User.objects.create_user('staff', is_staff=True))
+        response = self.client.get(url)
+        self.assertNotEqual(response.status_code, 200)
+        self.assertNotIn('Content-Disposition', response)
+
+
+class VisitTests(TestCase):
+
+    def setUp(self):
+        use_manual_counters(self)
+        self.counter = visits.get_visit_counter()
+
+    def visit(self, day):
+        with mock.patch.object(visits, 'today', return_value=day):
+            response = self.client.get('/rango/about/')
+        match = re.search(r'visited this site for (\d+) time', response.content.decode())
+        return int(match.group(1))
+
+    def test_visits_are_counted_once_a_day(self):
+        day = datetime.date(2017, 3, 1)
+        self.assertEqual(self.visit(day), 1)
+        session_key = self.client.session.session_key
+
+        self.assertEqual(self.visit(day), 1)
+        self.assertEqual(self.visit(day + datetime.timedelta(days=1)), 2)
+        self.assertEqual(self.client.session.session_key, session_key)
+
+    def test_session_is_not_saved_again_the_same_day(self):
+        day = datetime.date(2017, 3, 1)
+        self.visit(day)
+        with mock.patch('django.contrib.sessions.backends.cached_db.SessionStore.save') as save:
+            self.visit(day)
+        self.assertFalse(save.called)
+
+    def test_daily_visits_are_written_in_batches(self):
+        day = datetime.date(2017, 3, 1)
+        self.visit(day)
+        self.client.cookies.clear()
+        self.visit(day)
+        self.assertFalse(DailyVisits.objects.exists())
+
+        self.counter.flush()
+        self.visit(day + datetime.timedelta(days=1))
+        self.counter.flush()
+        self.assertEqual(
+            list(DailyVisits.objects.order_by('date').values_list('date', 'visits')),
+            [(day, 2), (day + datetime.timedelta(days=1), 1)])
+
+
+class PageCacheTests(TestCase):
+
+    def setUp(self):
+        use_manual_counters(self)
+        cache.clear()
+        self.category = Category.objects.create(name='Python')
+        self.page = Page.objects.create(category=self.category,
+                                        title='Official Tutorial',
+                                        url='http://docs.python.org/')
+
+    def test_anonymous_hits_make_no_queries(self):
+        self.client.get('/rango/')
+        with self.assertNumQueries(0):
+            response = self.client.get('/rango/')
+        self.assertContains(response, 'Official Tutorial')
+
+    def test_visit_count_is_filled_in_per_visitor(self):
+        day = datetime.date(2017, 3, 1)
+        with mock.patch.object(visits, 'today', return_value=day):
+            self.client.get('/rango/about/')
+        with mock.patch.object(visits, 'today',
+                               return_value=day + datetime.timedelta(days=1)):
+            response = self.client.get('/rango/about/')
+        self.assertContains(response, 'visited this site for 2 time(s)')
+        self.assertNotContains(response, 'placeholder')
+
+    def test_page_changes_invalidate_cached_pages(self):
+        path = '/rango/category/python/'
+        self.client.get(path)
+        self.page.title = 'Python Tutorial'
+        self.page.save()
+        self.assertContains(self.client.get(path), 'Python Tutorial')
+        self.assertContains(self.client.get('/rango/'), 'Python Tutorial')
+
+    def test_only_parameters_the_view_reads_are_keyed(self):
+        path = '/rango/category/python/'
+        self.client.get(path)
+        for query in ('?utm_source=x', '?after=junk', '?after=&b=1'):
+            with self.assertNumQueries(0):
+                self.client.get(path + query)
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(path + '?after=0_' + str(self.page.pk))
+        self.assertGreater(len(queries), 0)
+
+
+class ConditionalGetTests(TestCase):
+
+    def setUp(self):
+        use_manual_counters(self)
+        cache.clear()
+        self.category = Category.objects.create(name='Python')
+        self.page = Page.objects.create(category=self.category,
+                                        title='Official Tutorial',
+                                        url='http://docs.python.org/')
+
+    def test_unchanged_category_page_is_not_modified(self):
+        path = '/rango/category/python/'
+        response = self.client.get(path)
+        self.assertTrue(response.has_header('Last-Modified'))
+
+        with self.assertNumQueries(0):
+            response = self.client.get(path, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_page_changes_move_etag_and_last_modified_on(self):
+        path = '/rango/category/python/'
+        first = self.client.get(path)
+        modified = Category.objects.get(pk=self.category.pk).updated_at
+
+        self.page.title = 'Python Tutorial'
+        self.page.save()
+        response = self.client.get(path, HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertContains(response, 'Python Tutorial')
+        self.assertNotEqual(response['ETag'], first['ETag'])
+
+        counters.get_view_counter().incr(self.page.pk)
+        counters.get_view_counter().flush()
+        self.assertGreater(Category.objects.get(pk=self.category.pk).updated_at,
+                           modified)
+
+    def test_api_list_is_not_modified_until_pages_change(self):
+        response = self.client.get('/rango/api/pages/')
+        etag = response['ETag']
+        with self.assertNumQueries(0):
+            response = self.client.get('/rango/api/pages/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        Page.objects.create(category=self.category, title='PEP 8',
+                            url='https://www.python.org/dev/peps/pep-0008/')
+        response = self.client.get('/rango/api/pages/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+
+class CategoryStatsTests(TestCase):
+
+    def setUp(self):
+        use_manual_counters(self)
+        self.python = Category.objects.create(name='Python')
+        self.django = Category.objects.create(name='Django')
+
+    def assertStats(self, category, page_count, total_page_views):
+        category = Category.objects.get(pk=category.pk)
+        self.assertEqual((category.page_count, category.total_page_views),
+                         (page_count, total_page_views))
+
+    def test_saving_and_deleting_pages(self):
+        page = Page.objects.create(category=self.python, title='Tutorial',
+                                   url='http://docs.python.org/', views=5)
+        Page.objects.create(category=self.python, title='PEP 8',
+                            url='https://www.python.org/dev/peps/pep-0008/')
+        self.assertStats(self.python, 2, 5)
+
+        page.category = self.django
+        page.views = 7
+        page.save()
+        self.assertStats(self.python, 1, 0)
+        self.assertStats(self.django, 1, 7)
+
+        page.delete()
+        self.assertStats(self.django, 0, 0)
+
+    def test_totals_and_updated_at_change_in_one_update(self):
+        page = Page.objects.create(category=self.python, title='Tutorial',
+                                   url='http://docs.python.org/')
+        page.views = 4
+        with CaptureQueriesContext(connection) as queries:
+            page.save()
+        updates = [q['sql'] for q in queries
+                   if q['sql'].startswith('UPDATE "rango_category"')]
+        self.assertEqual(len(updates), 1)
+        self.assertIn('"total_page_views"', updates[0])
+        self.assertIn('"updated_at"', updates[0])
+        self.assertStats(self.python, 1, 4)
+
+    def test_saves_of_other_fields_skip_the_lookup(self):
+        page = Page.objects.create(category=self.python, title='Tutorial',
+                                   url='http://docs.python.org/', views=3)
+        page.title = 'Python Tutorial'
+        with CaptureQueriesContext(connection) as queries:
+            page.save(update_fields=['title'])
+        selects = [q['sql'] for q in queries
+                   if q['sql'].startswith('SELECT "rango_page"')]
+        self.assertEqual(selects, [])
+        self.assertStats(self.python, 1, 3)
+
+    def test_recount_categories_repairs_the_totals(self):
+        Page.objects.create(category=self.python, title='Tutorial',
+                            url='http://docs.python.org/', views=5)
+        Category.objects.filter(pk=self.python.pk).update(page_count=9)
+        call_command('recount_categories', stdout=io.StringIO())
+        self.assertStats(self.python, 1, 5)
+
+    def test_view_flushes_and_bulk_writes(self):
+        page = Page.objects.create(category=self.python, title='Tutorial',
+                                   url='http://docs.python.org/')
+        counters.get_view_counter().incr(page.pk, 3)
+        counters.get_view_counter().flush()
+        self.assertStats(self.python, 1, 3)
+
+        PageWriter('upsert').write([
+            Page(category=self.python, title='Tutorial',
+                 url='http://docs.python.org/', views=10),
+            Page(category=self.django, title='Docs',
+                 url='https://docs.djangoproject.com/', views=4),
+        ])
+        self.assertStats(self.python, 1, 10)
+        self.assertStats(self.django, 1, 4)
+
+
+class TrendingTests(TestCase):
+
+    def setUp(self):
+        use_manual_counters(self)
+        cache.clear()
+        self.category = Category.objects.create(name='Python')
+        self.old = Page.objects.create(category=self.category, title='Old',
+                                       url='http://old.example.com/', views=100)
+        self.new = Page.objects.create(category=self.category, title='New',
+                                       url='http://new.example.com/')
+
+    def click(self, page, times=1):
+        for i in range(times):
+            self.client.get('/rango/goto/', {'page_id': page.pk})
+        counters.get_view_counter().flush()
+
+    def later(self):
+        return timezone.now() + datetime.timedelta(seconds=10)
+
+    def test_clicks_are_logged_and_aggregated(self):
+        self.click(self.new, 3)
+        self.assertEqual(PageClick.objects.get().clicks, 3)
+
+        self.assertEqual(update_trending(now=self.later()), 1)
+        self.assertAlmostEqual(PageTrend.objects.get(page=self.new).score, 3, 2)
+        self.assertEqual(HourlyClicks.objects.get(page=self.new).clicks, 3)
+        # Nothing new to process on the next run.
+        self.assertEqual(update_trending(now=self.later()), 0)
+
+    def test_recent_clicks_wait_for_the_next_run(self):
+        self.click(self.old)
+        PageClick.objects.update(
+            created=timezone.now() - datetime.timedelta(minutes=1))
+        self.click(self.new)
+        self.click(self.old)
+
+        # Stops at the first click less than lag seconds old.
+        self.assertEqual(update_trending(), 1)
+        self.assertEqual(update_trending(now=self.later()), 2)
+
+    def test_unchanged_top_lists_keep_the_generation(self):
+        self.click(self.new)
+        update_trending(now=self.later())
+        generation = get_generation('trending')
+
+        update_trending(now=self.later())
+        self.assertEqual(get_generation('trending'), generation)
+
+        self.click(self.old, 2)
+        update_trending(now=self.later())
+        self.assertNotEqual(get_generation('trending'), generation)
+
+    def test_scores_decay(self):
+        self.click(self.new, 4)
+        now = self.later()
+        update_trending(now=now)
+        update_trending(now=now + datetime.timedelta(hours=6))
+        self.assertAlmostEqual(PageTrend.objects.get(page=self.new).score, 2, 2)
+
+    def test_index_and_api_show_trending_pages_first(self):
+        self.click(self.new)
+        update_trending(now=self.later())
+
+        response = self.client.get('/rango/')
+        content = response.content.decode()
+        self.assertLess(content.index('New'), content.index('Old'))
+
+        response = self.client.get('/rango/api/pages/trending/')
+        self.assertEqual([page['title'] for page in response.json()], ['New'])
+
+    def test_command_runs_every_interval_until_interrupted(self):
+        out = io.StringIO()
+        periodic = 'apps.rango.management.commands._periodic.'
+        with mock.patch(periodic + 'time.sleep',
+                        side_effect=[None, KeyboardInterrupt]) as sleep, \
+                mock.patch(periodic + 'close_old_connections'):
+            call_command('update_trending', interval=5, verbosity=2, stdout=out)
+        self.assertEqual(sleep.call_count, 2)
+        self.assertEqual(out.getvalue().count('Processed 0 click rows.'), 2)
+
+    def test_top_lists_expire_from_the_cache(self):
+        with override_settings(RANGO_TRENDING={'cache_timeout': 30}), \
+                mock.patch.object(cache, 'set', wraps=cache.set) as cache_set:
+            update_trending()
+            cache.delete('rango:trending:pages')
+            get_trending('pages')
+        timeouts = set(call[0][2] for call in cache_set.call_args_list
+                       if call[0][0].startswith('rango:trending:'))
+        self.assertEqual(timeouts, {30})
+
+
+class DailyStatsTests(TestCase):
+
+    def setUp(self):
+        use_manual_counters(self)
+        cache.clear()
+        self.category = Category.objects.create(name='Python')
+        self.page = Page.objects.create(category=self.category, title='Tutorial',
+                                        url='http://docs.python.org/')
+
+    def click(self):
+        self.client.get('/rango/goto/', {'page_id': self.page.pk})
+        counters.get_view_counter().flush()
+
+    def later(self):
+        return timezone.now() + datetime.timedelta(seconds=10)
+
+    def test_clicks_and_likes_are_rolled_up_by_day(self):
+        for i in range(2):
+            self.client.get('/rango/goto/', {'page_id': self.page.pk})
+        counters.get_view_counter().flush()
+        self.assertEqual(rollup_daily_stats(now=self.later()), 1)
+        add_like(self.category.pk)
+        rollup_likes()
+
+        today = visits.today().isoformat()
+        self.client.get('/rango/api/stats/', {'start': today})
+        response = self.client.get('/rango/api/stats/')
+        self.assertEqual(response.json()['results'], [
+            {'date': today, 'category': 'python', 'clicks': 2, 'likes': 1}])
+
+        response = self.client.get('/rango/api/stats/', {
+            'kind': 'pages', 'page': self.page.pk, 'start': today, 'end': today})
+        self.assertEqual(response.json()['results'], [
+            {'date': today, 'page': self.page.pk, 'category': 'python',
+             'clicks': 2}])
+
+        # Cached until the rollups change.
+        with self.assertNumQueries(0):
+            self.client.get('/rango/api/stats/', {'start': today},
+                            HTTP_ACCEPT='application/json')
+
+    def test_bad_ranges_are_rejected(self):
+        for params in ({'start': 'yesterday'}, {'start': '2017-02-30'},
+                       {'start': '2017-03-02', 'end': '2017-03-01'},
+                       {'start': '2015-01-01', 'end': '2017-01-01'}):
+            response = self.client.get('/rango/api/stats/', params)
+            self.assertEqual(response.status_code, 400, params)
+
+    def test_clicks_are_kept_until_rolled_up(self):
+        self.client.get('/rango/goto/', {'page_id': self.page.pk})
+        counters.get_view_counter().flush()
+        later = timezone.now() + datetime.timedelta(days=30)
+        update_trending(now=later)
+        self.assertEqual(PageClick.objects.count(), 1)
+
+        rollup_daily_stats(now=later)
+        update_trending(now=later)
+        self.assertFalse(PageClick.objects.exists())
+
+    def test_recent_clicks_wait_for_the_next_run(self):
+        self.click()
+        PageClick.objects.update(
+            created=timezone.now() - datetime.timedelta(minutes=1))
+        self.click()
+        self.click()
+
+        # Stops at the first click less than lag seconds old.
+        self.assertEqual(rollup_daily_stats(), 1)
+        self.assertEqual(rollup_daily_stats(now=self.later()), 2)
+
+
+task_calls = []
+
+
+@task(max_retries=2, retry_delay=0)
+def record_call(value, fail_times=0):
+    task_calls.append(value)
+    if task_calls.count(value) <= fail_times:
+        raise ValueError('Failing on purpose.')
+
+
+@task(max_retries=0)
+def wait_for_release():
+    release.wait(5)
+
+
+release = threading.Event()
+
+
+class TaskTests(TestCase):
+
+    def setUp(self):
+        del task_calls[:]
+        release.clear()
+
+    def test_failed_tasks_are_retried(self):
+        backend = ImmediateBackend()
+        with self.assertLogs('apps.rango.tasks', 'ERROR'):
+            backend.enqueue(record_call.name, ['a'], {'fail_times': 2})
+            backend.enqueue(record_call.name, ['b'], {'fail_times': 5})
+        # One try and two retries each.
+        self.assertEqual(task_calls, ['a'] * 3 + ['b'] * 3)
+
+    def test_full_queue_runs_tasks_on_the_caller(self):
+        backend = ThreadPoolBackend(workers=1, max_queue=1, enqueue_timeout=0)
+        backend.enqueue(wait_for_release.name, [], {})
+        while backend.depth():
+            time.sleep(0.01)
+
+        # The worker is busy and the queue has room for one more.
+        backend.enqueue(record_call.name, ['queued'], {})
+        backend.enqueue(record_call.name, ['inline'], {})
+        self.assertEqual(task_calls, ['inline'])
+
+        release.set()
+        backend.join()
+        self.assertEqual(task_calls, ['inline', 'queued'])
+
+    def test_database_queue(self):
+        backend = DatabaseBackend()
+        backend.enqueue(record_call.name, ['a'], {'fail_times': 1})
+        self.assertEqual(backend.depth(), 1)
+
+        with self.assertLogs('apps.rango.tasks', 'ERROR'):
+            self.assertTrue(backend.run_next())
+        queued = QueuedTask.objects.get()
+        self.assertEqual((queued.status, queued.attempts), (QueuedTask.PENDING, 1))
+        self.assertIn('Failing on purpose', queued.last_error)
+
+        # Retried once the delay is up.
+        QueuedTask.objects.update(run_at=timezone.now())
+        self.assertTrue(backend.run_next())
+        self.assertFalse(QueuedTask.objects.exists())
+        self.assertFalse(backend.run_next())
+        self.assertEqual(task_calls, ['a', 'a'])
+
+
+class ThumbnailTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        media_root = override_settings(MEDIA_ROOT=media.name)
+        media_root.enable()
+        self.addCleanup(media_root.disable)
+
+        out = io.BytesIO()
+        Image.new('RGBA', (800, 600), (255, 0, 0, 255)).save(out, 'PNG')
+        with mock.patch.object(generate_thumbnails, 'delay') as delay:
+            self.profile = UserProfile.objects.create(
+                user=User.objects.create_user('rango'),
+                picture=SimpleUploadedFile('rango.png', out.getvalue()))
+        delay.assert_called_once_with('profile_images/rango.png')
+
+    def render(self):
+        return Template(
+            '{% load rango_template_tags %}'
+            '{% thumbnail_url profile.picture "small" %}'
+        ).render(Context({'profile': self.profile}))
+
+    def test_original_is_shown_until_thumbnail_is_made(self):
+        self.assertEqual(self.render(), '/media/profile_images/rango.png')
+
+        paths = generate_thumbnails('profile_images/rango.png')
+        self.assertEqual(self.render(),
+                         '/media/thumbnails/64x64/profile_images/rango.png.jpg')
+
+        image = Image.open(os.path.join(settings.MEDIA_ROOT, paths[0]))
+        self.assertEqual((image.format, image.size), ('JPEG', (64, 64)))
+
+    def test_profiles_without_a_picture_show_no_image(self):
+        self.profile.picture = ''
+        self.profile.save()
+        self.assertIsNone(thumbnail_url(self.profile.picture, 'small'))
+
+        self.client.force_login(self.profile.user)
+        response = self.client.get('/rango/profile/rango/')
+        self.assertNotContains(response, '<img src=""')
+        self.assertNotContains(response, '<img src="None"')
+
+    def test_pictures_with_the_same_stem_have_their_own_thumbnails(self):
+        self.assertNotEqual(thumbnail_path('profile_images/rango.png', 64),
+                            thumbnail_path('profile_images/rango.jpg', 64))
+
+    def test_process_pool_is_only_used_by_run_worker(self):
+        with override_settings(RANGO_THUMBNAILS={'processes': 2}):
+            self.assertIsNone(get_process_pool())
@@ -0,0 +1,148 @@
+"""
+Square JPEG thumbnails of profile pictures, in the sizes named by
+settings.RANGO_THUMBNAILS.
+
+When a profile is saved with a picture, generate_thumbnails() is queued as
+a background task (see apps.rango.tasks). Where tasks are run by "manage.py
+run_worker", the resizing can be spread over a pool of processes. Each
+thumbnail is stored at a path made from the picture's name and the size,
+and templates get its URL from the thumbnail_url tag, which falls back to
+the picture itself until the thumbnail is there.
+"""
+import io
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image, ImageOps
+
+from .tasks import DatabaseBackend, get_task_backend, task
+
+
+DEFAULT_THUMBNAILS = {
+    'sizes': {'small': 64, 'medium': 300},
+    'quality': 85,
+    'processes': 0,
+}
+
+
+def get_config():
+    config = dict(DEFAULT_THUMBNAILS)
+    config.update(getattr(settings, 'RANGO_THUMBNAILS', {}))
+    return config
+
+
+def thumbnail_path(name, size):
+    """
+    Returns where the thumbnail of the picture stored as name is kept, e.g.
+    'thumbnails/64x64/profile_images/rango.png.jpg'. The whole name is kept,
+    so that rango.png and rango.jpg don't share thumbnails.
+    """
+    return 'thumbnails/{0}x{0}/{1}.jpg'.format(size, name)
+
+
+def _ready_key(path):
+    return 'rango:thumbnail:{0}'.format(path)
+
+
+def is_ready(path):
+    """
+    Whether the thumbnail at path has been made. Looked up in the storage
+    at most once a minute while it hasn't, and then remembered.
+    """
+    ready = cache.get(_ready_key(path))
+    if ready is None:
+        ready = default_storage.exists(path)
+        cache.set(_ready_key(path), ready, None if ready else 60)
+    return ready
+
+
+def make_thumbnail(data, size, quality):
+    """
+    Returns the image in data cropped to a square, scaled to size pixels
+    across and encoded as a JPEG. Runs in the process pool.
+    """
+    image = Image.open(io.BytesIO(data))
+    if image.mode != 'RGB':
+        image = image.convert('RGB')
+    image = ImageOps.fit(image, (size, size), Image.LANCZOS)
+    out = io.BytesIO()
+    image.save(out, 'JPEG', quality=quality, optimize=True, progressive=True)
+    return out.getvalue()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_process_pool():
+    """
+    Returns the process pool thumbnails are made in, or None if they are
+    made in this process: when the 'processes' setting is 0, or when tasks
+    aren't run by "manage.py run_worker", as forking a process that is
+    serving requests on several threads isn't safe.
+    """
+    global _pool
+
+    processes = get_config()['processes']
+    if not processes or not isinstance(get_task_backend(), DatabaseBackend):
+        return None
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ProcessPoolExecutor(processes)
+    return _pool
+
+
+@task()
+def generate_thumbnails(name):
+    """
+    Makes every size of thumbnail for the picture stored as name, replacing
+    any that already exist. Returns the paths they were stored at.
+    """
+    config = get_config()
+    with default_storage.open(name, 'rb') as f:
+        data = f.read()
+
+    sizes = sorted(set(config['sizes'].values()))
+    pool = get_process_pool()
+    if pool is None:
+        thumbnails = [make_thumbnail(data, size, config['quality'])
+                      for size in sizes]
+    else:
+        futures = [pool.submit(make_thumbnail, data, size, config['quality'])
+                   for size in sizes]
+        thumbnails = [future.result() for future in futures]
+
+    paths = []
+    for size, content in zip(sizes, thumbnails):
+        path = thumbnail_path(name, size)
+        # Storages pick a new name rather than overwrite a file.
+        default_storage.delete(path)
+        default_storage.save(path, ContentFile(content))
+        cache.set(_ready_key(path), True, None)
+        paths.append(path)
+    return paths
+
+
+def thumbnails_missing(name):
+    return not all(is_ready(thumbnail_path(name, size))
+                   for size in get_config()['sizes'].values())
+
+
+def thumbnail_url(picture, size_name):
+    """
+    Returns the URL of the size_name thumbnail of an ImageField's picture
+    if it has been made, and otherwise the URL of the picture itself.
+    Returns None if there is no picture.
+    """
+    if not picture:
+        return None
+    size = get_config()['sizes'][size_name]
+    path = thumbnail_path(picture.name, size)
+    if is_ready(path):
+        return default_storage.url(path)
+    return picture.url
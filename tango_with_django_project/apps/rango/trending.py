@@ -0,0 +1,255 @@
+"""
+Trending pages and categories, from the clicks logged in PageClick.
+
+Each page and category has a score made of its clicks, each worth half as
+much for every half_life seconds since it was made. update_trending() is
+run every few seconds ("manage.py update_trending --interval 5"): it decays
+the stored scores by the time since its last run, adds the clicks logged
+since then, and caches the top pages and categories for the index page and
+the API to read. The cached lists expire after cache_timeout seconds and are
+then read from the trend tables again, so they can't go stale for longer
+than that even if update_trending() stops running.
+
+Clicks are read in primary key order from a cursor. A row's key is given
+out when it is inserted, but other processes only see it once its
+transaction commits, so a click committed late can turn up behind the
+cursor. update_trending() therefore stops at the first click logged less
+than lag seconds ago, which is enough as long as the transactions that log
+clicks (see apps.rango.counters) commit within lag seconds. The daily
+rollups (apps.rango.rollups) read the log the same way.
+"""
+import datetime
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F, Min
+from django.utils import timezone
+
+from .generations import bump_generation
+from .models import (
+    AggregationCursor, CategoryTrend, HourlyClicks, Page, PageClick, PageTrend
+)
+
+
+DEFAULT_TRENDING = {
+    'half_life': 6 * 60 * 60,
+    'top': 10,
+    'min_score': 0.01,
+    'cache_timeout': 60,
+    'retention': 7 * 24 * 60 * 60,
+    'lag': 5,
+}
+
+CURSOR_NAME = 'trending'
+
+
+def get_config():
+    config = dict(DEFAULT_TRENDING)
+    config.update(getattr(settings, 'RANGO_TRENDING', {}))
+    return config
+
+
+def _top_key(kind):
+    return 'rango:trending:{0}'.format(kind)
+
+
+def log_clicks(increments, categories, when=None):
+    """
+    Appends a PageClick for each page in a {page pk: clicks} dictionary.
+    categories maps the page primary keys to their category's; pages
+    missing from it have been deleted and are left out.
+    """
+    when = when or timezone.now()
+    PageClick.objects.bulk_create([
+        PageClick(page_id=pk, category_id=categories[pk], clicks=n, created=when)
+        for pk, n in increments.items() if pk in categories
+    ])
+
+
+def unread_clicks(cursor, now, batch_size):
+    """
+    Yields lists of up to batch_size (pk, page_id, category_id, clicks,
+    created) rows from the PageClick log, after an AggregationCursor's
+    position, and moves the position past each list once it has been
+    handled. Stops at the first click logged less than lag seconds before
+    now, which is left for the next run.
+    """
+    cutoff = now - datetime.timedelta(seconds=get_config()['lag'])
+    while True:
+        rows = list(PageClick.objects.filter(pk__gt=cursor.position)
+                    .order_by('pk')
+                    .values_list('pk', 'page_id', 'category_id',
+                                 'clicks', 'created')[:batch_size])
+        recent = [i for i, row in enumerate(rows) if row[4] >= cutoff]
+        done = bool(recent) or len(rows) < batch_size
+        if recent:
+            rows = rows[:recent[0]]
+        if not rows:
+            return
+
+        yield rows
+        cursor.position = rows[-1][0]
+        if done:
+            return
+
+
+def _decay(seconds, half_life):
+    return 0.5 ** (max(seconds, 0) / float(half_life))
+
+
+def _add_scores(model, scores):
+    """
+    Adds a {pk: score} dictionary to the scores of a trend model, creating
+    the rows that don't exist yet.
+    """
+    existing = set(model.objects.filter(pk__in=list(scores))
+                   .values_list('pk', flat=True))
+    for pk in existing:
+        model.objects.filter(pk=pk).update(score=F('score') + scores[pk])
+    model.objects.bulk_create([model(pk=pk, score=score)
+                               for pk, score in scores.items()
+                               if pk not in existing])
+
+
+def _add_hourly_clicks(counts):
+    """
+    Adds a {(page pk, category pk, hour): clicks} dictionary to HourlyClicks.
+    """
+    hours = set(hour for _, _, hour in counts)
+    existing = dict(
+        ((page_id, hour), pk) for pk, page_id, hour in
+        HourlyClicks.objects.filter(hour__in=hours,
+                                    page_id__in=set(p for p, _, _ in counts))
+        .values_list('pk', 'page_id', 'hour'))
+    new = []
+    for (page_id, category_id, hour), clicks in counts.items():
+        pk = existing.get((page_id, hour))
+        if pk is None:
+            new.append(HourlyClicks(page_id=page_id, category_id=category_id,
+                                    hour=hour, clicks=clicks))
+        else:
+            HourlyClicks.objects.filter(pk=pk).update(clicks=F('clicks') + clicks)
+    HourlyClicks.objects.bulk_create(new)
+
+
+def update_trending(now=None, batch_size=5000):
+    """
+    Decays the trending scores to now and adds the clicks logged since the
+    last run to them and to HourlyClicks, then refreshes the cached top
+    pages and categories. Clicks logged in the last lag seconds are left
+    for the next run. Runs are serialised on the job's cursor row.
+    Returns the number of PageClick rows processed.
+    """
+    config = get_config()
+    half_life = config['half_life']
+    now = now or timezone.now()
+    processed = 0
+
+    with transaction.atomic():
+        AggregationCursor.objects.get_or_create(name=CURSOR_NAME)
+        cursor = AggregationCursor.objects.select_for_update().get(name=CURSOR_NAME)
+
+        if cursor.updated is not None:
+            factor = _decay((now - cursor.updated).total_seconds(), half_life)
+            for model in (PageTrend, CategoryTrend):
+                model.objects.update(score=F('score') * factor)
+                model.objects.filter(score__lt=config['min_score']).delete()
+
+        for rows in unread_clicks(cursor, now, batch_size):
+            pages, categories = defaultdict(float), defaultdict(float)
+            hourly = defaultdict(int)
+            for pk, page_id, category_id, clicks, created in rows:
+                score = clicks * _decay((now - created).total_seconds(), half_life)
+                pages[page_id] += score
+                categories[category_id] += score
+                hour = created.replace(minute=0, second=0, microsecond=0)
+                hourly[page_id, category_id, hour] += clicks
+
+            _add_scores(PageTrend, pages)
+            _add_scores(CategoryTrend, categories)
+            _add_hourly_clicks(hourly)
+            processed += len(rows)
+
+        cursor.updated = now
+        cursor.save()
+
+        # The log is only kept for as long as it might be wanted again, and
+        # until every job that reads it (see apps.rango.rollups) has.
+        PageClick.objects.filter(
+            pk__lte=AggregationCursor.objects.aggregate(m=Min('position'))['m'],
+            created__lt=now - datetime.timedelta(seconds=config['retention']),
+        ).delete()
+
+    refresh_top()
+    return processed
+
+
+def _load_top(kind, top):
+    if kind == 'pages':
+        rows = (PageTrend.objects.order_by('-score')
+                .values_list('page_id', 'page__category_id', 'page__title',
+                             'page__url', 'score')[:top])
+        return [{'id': pk, 'category_id': category_id, 'title': title,
+                 'url': url, 'score': score}
+                for pk, category_id, title, url, score in rows]
+
+    rows = (CategoryTrend.objects.order_by('-score')
+            .values_list('category_id', 'category__name', 'category__slug',
+                         'score')[:top])
+    return [{'id': pk, 'name': name, 'slug': slug, 'score': score}
+            for pk, name, slug, score in rows]
+
+
+def _ranking(top):
+    return [dict((k, v) for k, v in item.items() if k != 'score')
+            for item in top]
+
+
+def refresh_top():
+    """
+    Caches the top pages and categories, and moves on the 'trending'
+    generation so that pages showing them are rebuilt if either list wasn't
+    cached or has changed. Scores on their own don't count as a change:
+    between clicks they all decay by the same factor, and bumping on every
+    run would throw away every page cached on 'trending' each few seconds.
+    """
+    config = get_config()
+    changed = False
+    for kind in ('pages', 'categories'):
+        top = _load_top(kind, config['top'])
+        cached = cache.get(_top_key(kind))
+        if cached is None or _ranking(cached) != _ranking(top):
+            changed = True
+        cache.set(_top_key(kind), top, config['cache_timeout'])
+    if changed:
+        bump_generation('trending')
+
+
+def get_trending(kind, count=None):
+    """
+    Returns the top trending 'pages' or 'categories' as dictionaries, most
+    trending first, as cached by update_trending() or by an earlier call
+    within the last cache_timeout seconds.
+    """
+    config = get_config()
+    trending = cache.get(_top_key(kind))
+    if trending is None:
+        trending = _load_top(kind, config['top'])
+        cache.set(_top_key(kind), trending, config['cache_timeout'])
+    return trending[:count or config['top']]
+
+
+def get_top_pages(count):
+    """
+    The pages for the index page: the trending pages, followed by the most
+    viewed of all time while there aren't count trending pages.
+    """
+    pages = get_trending('pages', count)
+    if len(pages) < count:
+        seen = [page['id'] for page in pages]
+        pages = pages + list(
+            Page.objects.exclude(pk__in=seen).order_by('-views')
+            .values('id', 'category_id', 'title', 'url')[:count - len(pages)])
+    return pages
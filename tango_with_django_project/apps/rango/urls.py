@@ -5,6 +5,7 @@ from apps.rango import views
 router = routers.DefaultRouter()
 router.register(r'categories', views.CategoryViewSet)
 router.register(r'pages', views.PageViewSet)
+router.register(r'stats', views.StatsViewSet, base_name='stats')
 
 # app_name = 'rango'
 urlpatterns = [
@@ -27,6 +28,12 @@ urlpatterns = [
         name='show_category'
     ),
 
+    url(
+        r'^export/(?P<kind>categories|pages)\.(?P<fmt>ndjson|csv)$',
+        views.export,
+        name='export'
+    ),
+
     url(r'^goto/', views.track_url, name='goto'),
 
     url(r'^like/$', views.like_category, name='like_category'),
@@ -39,6 +46,8 @@ urlpatterns = [
     url(r'^restricted/$', views.restricted, name='restricted'),
 
     url(r'^suggest/$', views.suggest_category, name='suggest_category'),
+    url(r'^suggest/json/$', views.suggest_category_json,
+        name='suggest_category_json'),
 
     url(r'^search/$', views.search, name='search'),
 ]
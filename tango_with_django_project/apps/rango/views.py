@@ -1,16 +1,52 @@
-from datetime import datetime
+import logging
 
 from django.shortcuts import render, redirect
+from django.conf import settings
+from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.models import User
-from django.http import HttpResponse
-
-from rest_framework import viewsets
+from django.core.exceptions import PermissionDenied
+from django.core.urlresolvers import reverse
+from django.http import (
+    Http404, HttpResponse, HttpResponseBadRequest, JsonResponse,
+    StreamingHttpResponse
+)
+from django.utils.dateparse import parse_date
+from django.views.decorators.http import condition
+
+from rest_framework import status, viewsets
+from rest_framework.decorators import list_route
+from rest_framework.response import Response
 
 from apps.rango.forms import CategoryForm, PageForm, UserProfileForm
 from apps.rango.models import Category, Page, UserProfile
-from .serializers import CategorySerializer, PageSerializer
-from .webhose_search import run_query
+from .pagination import CategoryPagination, PagePagination
+from .serializers import (
+    BulkCategorySerializer, BulkPageSerializer, CategorySerializer,
+    PageSerializer, serialize_category_rows, serialize_page_rows,
+    serialize_trending_categories, serialize_trending_pages
+)
+from .bulk import (
+    MODES, CategoryWriter, PageWriter, bulk_write, category_pk_from_ref,
+    iter_ndjson
+)
+from .category_cache import get_category_page, parse_cursor
+from .conditional import etag_api, generation_etag
+from .counters import get_view_counter
+from .export import gzip_stream, iter_export
+from .likes import add_like
+from .metrics import registry
+from .page_cache import (
+    VISITS_PLACEHOLDER, cache_anonymous_page, is_caching_page
+)
+from .rollups import MAX_RANGE, default_range, get_daily_stats
+from .search_backends import get_search_backend
+from .suggestions import get_suggestion_index
+from .trending import get_top_pages, get_trending
+from .visits import track_visit
+
+
+logger = logging.getLogger(__name__)
 
 
 class CategoryViewSet(viewsets.ModelViewSet):
@@ -19,6 +55,39 @@ class CategoryViewSet(viewsets.ModelViewSet):
     """
     queryset = Category.objects.all().order_by('-likes')
     serializer_class = CategorySerializer
+    pagination_class = CategoryPagination
+
+    @etag_api('categories')
+    def list(self, request, *args, **kwargs):
+        # Lists are built from values() rows with only the columns we need,
+        # rather than from model instances.
+        queryset = self.filter_queryset(self.get_queryset())
+        rows = self.paginate_queryset(queryset.values('id', 'name', 'likes'))
+        return self.get_paginated_response(serialize_category_rows(rows, request))
+
+    @etag_api('categories')
+    def retrieve(self, request, *args, **kwargs):
+        return super(CategoryViewSet, self).retrieve(request, *args, **kwargs)
+
+    @list_route()
+    @etag_api('trending')
+    def trending(self, request):
+        """
+        The categories with the most recent clicks, most trending first.
+        """
+        return Response(serialize_trending_categories(
+            get_trending('categories'), request))
+
+    @list_route(methods=['post'])
+    def bulk(self, request):
+        """
+        Creates or updates many categories at once, from a JSON array or an
+        NDJSON stream. See bulk_response().
+        """
+        return bulk_response(
+            request, BulkCategorySerializer, CategoryWriter,
+            lambda data: Category(**data),
+        )
 
 
 class PageViewSet(viewsets.ModelViewSet):
@@ -27,8 +96,148 @@ class PageViewSet(viewsets.ModelViewSet):
     """
     queryset = Page.objects.all().order_by('-views')
     serializer_class = PageSerializer
+    pagination_class = PagePagination
+
+    @etag_api('pages')
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        rows = self.paginate_queryset(
+            queryset.values('id', 'category_id', 'title', 'url', 'views'))
+        return self.get_paginated_response(serialize_page_rows(rows, request))
+
+    @etag_api('pages')
+    def retrieve(self, request, *args, **kwargs):
+        return super(PageViewSet, self).retrieve(request, *args, **kwargs)
+
+    @list_route()
+    @etag_api('trending')
+    def trending(self, request):
+        """
+        The pages with the most recent clicks, most trending first.
+        """
+        return Response(serialize_trending_pages(get_trending('pages'), request))
+
+    @list_route(methods=['post'])
+    def bulk(self, request):
+        """
+        Creates or updates many pages at once, from a JSON array or an NDJSON
+        stream. See bulk_response().
+        """
+        return bulk_response(
+            request, BulkPageSerializer, PageWriter,
+            lambda data: Page(**data), resolve_batch=resolve_page_categories,
+        )
+
+
+class StatsViewSet(viewsets.ViewSet):
+    """
+    Daily clicks and likes per category, or clicks per page with
+    ?kind=pages, read from the rollup tables (see apps.rango.rollups).
+
+    ?start and ?end are inclusive ISO dates, by default the last 30 days;
+    ?category (a slug) or ?page (an id) narrows the stats down to one.
+    """
+
+    @etag_api('stats')
+    def list(self, request):
+        kind = request.query_params.get('kind', 'categories')
+        if kind not in ('categories', 'pages'):
+            return Response({'detail': 'kind must be categories or pages.'},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        start, end = default_range()
+        try:
+            if 'start' in request.query_params:
+                start = parse_date(request.query_params['start'])
+            if 'end' in request.query_params:
+                end = parse_date(request.query_params['end'])
+            if start is None or end is None:
+                raise ValueError
+        except ValueError:
+            return Response({'detail': 'start and end must be YYYY-MM-DD dates.'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        if not 0 <= (end - start).days < MAX_RANGE:
+            return Response(
+                {'detail': 'end must be after start, and at most {0} days '
+                           'later.'.format(MAX_RANGE - 1)},
+                status=status.HTTP_400_BAD_REQUEST)
+
+        key = request.query_params.get('category' if kind == 'categories' else 'page')
+        if kind == 'pages' and key is not None:
+            try:
+                key = int(key)
+            except ValueError:
+                return Response({'detail': 'page must be a page id.'},
+                                status=status.HTTP_400_BAD_REQUEST)
+
+        return Response({
+            'kind': kind,
+            'start': start.isoformat(),
+            'end': end.isoformat(),
+            'results': get_daily_stats(kind, start, end, key),
+        })
+
+
+def resolve_page_categories(batch):
+    """
+    Replaces the category references in a batch of validated pages with
+    category ids, checking that the categories exist with a single query.
+    """
+    refs = {}
+    for data in batch:
+        if data['category'] not in refs:
+            refs[data['category']] = category_pk_from_ref(data['category'])
+    pks = [refs[data['category']] for data in batch]
+    known = set(Category.objects.filter(pk__in=[pk for pk in pks if pk])
+                .values_list('pk', flat=True))
+
+    rejected = {}
+    for position, (data, pk) in enumerate(zip(batch, pks)):
+        if pk in known:
+            del data['category']
+            data['category_id'] = pk
+        else:
+            rejected[position] = {'category': ['Unknown category.']}
+    return rejected
+
+
+def bulk_response(request, serializer_class, writer_class, to_instance,
+                  resolve_batch=None):
+    """
+    Handles a bulk upload. The body is either a JSON array of items or, with
+    a Content-Type of application/x-ndjson, one JSON item per line, which is
+    read as a stream. ?mode= is 'create' (the default), 'upsert' to update
+    existing rows or 'skip' to leave them alone, and ?batch_size= sets how
+    many items are validated and written at a time.
+
+    Valid items are written in one transaction; the response counts what was
+    created, updated and skipped, and lists the errors for the other items.
+    """
+    mode = request.query_params.get('mode', 'create')
+    if mode not in MODES:
+        return Response({'detail': 'mode must be one of {0}.'.format(', '.join(MODES))},
+                        status=status.HTTP_400_BAD_REQUEST)
+    try:
+        batch_size = max(1, int(request.query_params.get('batch_size', 500)))
+    except ValueError:
+        return Response({'detail': 'batch_size must be a number.'},
+                        status=status.HTTP_400_BAD_REQUEST)
+
+    if request.content_type.startswith('application/x-ndjson'):
+        items = iter_ndjson(request.stream or [])
+    else:
+        items = request.data
+        if not isinstance(items, list):
+            return Response({'detail': 'Expected a list of items.'},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+    result = bulk_write(items, serializer_class, writer_class(mode), to_instance,
+                        batch_size=batch_size, resolve_batch=resolve_batch)
+    return Response(result._asdict())
 
 
+@cache_anonymous_page(lambda: ['categories', 'pages', 'trending'],
+                      track_visits=True)
 def index(request):
     # Query the database for a list of ALL categories currently stored.
     # Order the categories by number of lies in descending order
@@ -37,15 +246,15 @@ def index(request):
     # that will be passed to the template engine.
 
     category_list = Category.objects.order_by('-likes')[:5]
-    page_list = Page.objects.order_by('-views')[:5]
+    # Pages are ranked by their recent clicks; see apps.rango.trending.
+    page_list = get_top_pages(5)
 
     context_dict = {
         'categories': category_list,
         'pages': page_list,
     }
 
-    visitor_cookie_handler(request)
-    context_dict['visits'] = request.session['visits']
+    context_dict['visits'] = visitor_cookie_handler(request)
 
     # Obtain our Response object early so we can add cookie information.
     response = render(request, 'rango/index.html', context_dict)
@@ -54,51 +263,57 @@ def index(request):
     return response
 
 
+@cache_anonymous_page(lambda: [], track_visits=True)
 def about(request):
-    visitor_cookie_handler(request)
-    context_dict = {'visits': request.session['visits']}
+    context_dict = {'visits': visitor_cookie_handler(request)}
     return render(request, 'rango/about.html', context_dict)
 
 
+def category_generations(category_name_slug):
+    return ['categories', 'category:' + category_name_slug]
+
+
+def category_last_modified(request, category_name_slug):
+    """
+    The category's updated_at, which moves on whenever the category or any
+    of its pages change (see apps.rango.signals). Pages for logged-in users
+    show their name too, so they are left to the ETag, which includes it.
+    """
+    if request.method not in ('GET', 'HEAD') or request.user.is_authenticated:
+        return None
+    category = get_category_page(category_name_slug)[0]
+    return category['updated_at'] if category else None
+
+
+@condition(etag_func=generation_etag(category_generations),
+           last_modified_func=category_last_modified)
+@cache_anonymous_page(category_generations, params={'after': parse_cursor})
 def show_category(request, category_name_slug):
     # Create a context dictionary which we can pass
     # to the template rendering engine
     context_dict = {}
 
-    try:
-        # Can we find a category name slug with the given name?
-        # If we can't, the .get() method raises a DoesNotExist exception.
-        # So the .get() method returns one model instance or raises an
-        # exception.
-        category = Category.objects.get(slug=category_name_slug)
+    # Fetch the category together with its most viewed pages. The first
+    # page of results is cached; later ones are reached with the 'after'
+    # cursor, which continues from the last page shown.
+    # If there's no such category we get None back, and
+    # the template will display the "no category" message for us.
+    after = parse_cursor(request.GET.get('after'))
+    category, pages, next_cursor = get_category_page(category_name_slug, after)
 
-        # Retrieve all of the associated pages.
-        # Note that filter() will return a list of page objects or an empty
-        # list.
-        pages = Page.objects.filter(category=category)
-
-        # Adds our results list to the template context under name pages.
-        context_dict['pages'] = pages
-        # We also add the category object from
-        # the database to the context dictionary.
-        # We'll use this in the template to verify that the category exists.
-        context_dict['category'] = category
-    except Category.DoesNotExist:
-        # We get here if we did'nt find the specified category.
-        # Don't do anything -
-        # the template will display the "no category" message for us.
-        context_dict['category'] = None
-        context_dict['pages'] = None
+    context_dict['category'] = category
+    context_dict['pages'] = pages
+    context_dict['next_cursor'] = next_cursor
 
     # create a default query based on the category name
     # to be shown in the search box
-    context_dict['query'] = category.name if category else None
+    context_dict['query'] = category['name'] if category else None
 
     result_list = list()
     if request.method == 'POST':
         query = request.POST['query'].strip()
         if query:
-            result_list = run_query(query)
+            result_list = get_search_backend().search(query)
             context_dict['result_list'] = result_list
             context_dict['query'] = query
 
@@ -125,8 +340,8 @@ def add_category(request):
             return index(request)
         else:
             # The supplied form contained errors -
-            # just print them to the terminal.
-            print(form.errors)
+            # just log them.
+            logger.debug('Invalid category: %s', form.errors.as_json())
 
     # Will handle the bad form, new form, or no form supplied cases.
     # Render the form with error messages (if any).
@@ -151,10 +366,9 @@ def add_page(request, category_name_slug):
                 page.category = category
                 page.views = 0
                 page.save()
-                print("FORM SAVED")
                 return show_category(request, category_name_slug)
         else:
-            print(form.errors)
+            logger.debug('Invalid page: %s', form.errors.as_json())
 
     context_dict = {'form': form, 'category': category}
     return render(request, 'rango/add_page.html', context_dict)
@@ -166,41 +380,27 @@ def restricted(request):
 
 
 def visitor_cookie_handler(request):
-    visits = int(_get_server_side_cookie(request, 'visits', '1'))
-
-    last_visit_cookie = _get_server_side_cookie(request,
-                                                'last_visit', str(datetime.now()))
-    last_visit_time = datetime.strptime(last_visit_cookie[:-7],
-                                        '%Y-%m-%d %H:%M:%S')
-
-    # If it's been more than a day since the last visit...
-    if (datetime.now() - last_visit_time).days > 0:
-        visits += 1
-        # Update the last visit cookie now that we have updated the count
-        request.session['last_visit'] = str(datetime.now())
-    else:
-        visits = 1
-        # Set the last visit cookie
-        request.session['last_visit'] = last_visit_cookie
-
-    # Update/set the visits cookie
-    request.session['visits'] = visits
-
+    """
+    Records the visit and returns the number of days this visitor has been
+    to the site. See apps.rango.visits.
 
-def _get_server_side_cookie(request, cookie, default_val=None):
-    val = request.session.get(cookie)
-    if not val:
-        val = default_val
-    return val
+    Pages rendered for the anonymous page cache get a placeholder instead,
+    which is replaced with each visitor's own count as the page is served.
+    """
+    visits = track_visit(request)
+    if is_caching_page(request):
+        return VISITS_PLACEHOLDER
+    return visits
 
 
 def search(request):
     context_dict = dict()
+    result_list = list()
 
     if request.method == 'POST':
         query = request.POST['query'].strip()
         if query:
-            result_list = run_query(query)
+            result_list = get_search_backend().search(query)
 
         context_dict = {
             'result_list': result_list,
@@ -217,10 +417,10 @@ def track_url(request):
             page_id = request.GET['page_id']
 
             try:
-                page = Page.objects.get(id=page_id)
-                page.views += 1
-                page.save()
-                url = page.url
+                # Only fetch the url - the view count is buffered and
+                # written back in batches, so we don't wait on an UPDATE.
+                url = Page.objects.values_list('url', flat=True).get(id=page_id)
+                get_view_counter().incr(page_id)
             except Page.DoesNotExist:
                 pass
 
@@ -240,7 +440,7 @@ def register_profile(request):
 
             return redirect('index')
         else:
-            print(form.errors)
+            logger.debug('Invalid profile: %s', form.errors.as_json())
 
     context_dict = {'form': form}
 
@@ -265,7 +465,7 @@ def profile(request, username):
             form.save(commit=True)
             return redirect('rango:profile', user.username)
         else:
-            print(form.errors)
+            logger.debug('Invalid profile: %s', form.errors.as_json())
 
     return render(
         request,
@@ -290,27 +490,20 @@ def like_category(request):
     if request.method == 'GET':
         cat_id = request.GET['category_id']
         likes = 0
-        print('Cat ID:', cat_id)
         if cat_id:
-            cat = Category.objects.get(id=int(cat_id))
-            if cat:
-                likes = cat.likes + 1
-                cat.likes = likes
-                cat.save()
+            # The like goes to one of the category's shards; the response
+            # includes the likes that haven't been rolled up yet.
+            likes = add_like(int(cat_id))
+            if likes is None:
+                raise Http404('No such category.')
         return HttpResponse(likes)
 
 
 def get_category_list(max_results=0, starts_with=''):
-    cat_list = []
-    if starts_with:
-        cat_list = Category.objects.filter(name__istartswith=starts_with)
-
-    if max_results > 0:
-        if len(cat_list) > max_results:
-            cat_list = cat_list[:max_results]
-    return cat_list
+    return get_suggestion_index().suggest(starts_with, max_results)
 
 
+@condition(etag_func=generation_etag(lambda: ['categories']))
 def suggest_category(request):
     cat_list = []
     starts_with = ''
@@ -318,5 +511,66 @@ def suggest_category(request):
     if request.method == 'GET':
         starts_with = request.GET['suggestion']
     cat_list = get_category_list(8, starts_with)
-    print('cat list', cat_list)
     return render(request, 'rango/cats.html', {'categories': cat_list})
+
+
+def suggest_category_json(request):
+    starts_with = request.GET.get('suggestion', '')
+    cat_list = get_category_list(8, starts_with)
+    return JsonResponse({
+        'categories': [
+            {
+                'name': c.name,
+                'slug': c.slug,
+                'url': reverse('rango:show_category', args=[c.slug]),
+                'likes': c.likes,
+                'views': c.views,
+            }
+            for c in cat_list
+        ]
+    })
+
+
+EXPORT_CONTENT_TYPES = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+
+
+@staff_member_required
+def export(request, kind, fmt):
+    """
+    Streams every category or page as NDJSON or CSV, in primary key order.
+    ?after=<id> resumes an interrupted export after the last id received,
+    and ?gzip=1 compresses the stream. A resumed CSV export has no header
+    row, as it is appended to the part that was received.
+    """
+    try:
+        after = int(request.GET.get('after', 0))
+    except ValueError:
+        return HttpResponseBadRequest('after must be a number.')
+
+    filename = '{0}.{1}'.format(kind, fmt)
+    content = iter_export(kind, fmt, after, header=not after)
+    if request.GET.get('gzip'):
+        content = gzip_stream(content)
+        content_type = 'application/gzip'
+        filename += '.gz'
+    else:
+        content_type = EXPORT_CONTENT_TYPES[fmt] + '; charset=utf-8'
+
+    response = StreamingHttpResponse(content, content_type=content_type)
+    response['Content-Disposition'] = 'attachment; filename="{0}"'.format(filename)
+    return response
+
+
+def metrics(request):
+    """
+    Serves the request metrics in the Prometheus text format, to staff and
+    to clients in settings.RANGO_METRICS_IPS.
+    """
+    if (request.META.get('REMOTE_ADDR') not in getattr(settings, 'RANGO_METRICS_IPS', [])
+            and not request.user.is_staff):
+        raise PermissionDenied
+    return HttpResponse(registry.render(),
+                        content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,105 @@
+import datetime
+import threading
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .counters import (
+    CacheCounterBuffer, LocMemCounterBuffer, make_counter_buffer
+)
+
+
+# Session keys. Both hold plain integers, so they serialise compactly with
+# any session backend, including signed cookies.
+VISITS_KEY = 'visits'
+LAST_VISIT_KEY = 'last_visit_day'
+
+
+def today():
+    if settings.USE_TZ:
+        return timezone.localtime(timezone.now()).date()
+    return datetime.date.today()
+
+
+def track_visit(request):
+    """
+    Counts the days on which this visitor has come to the site and returns
+    the count. The session is only changed - and so only saved - on the
+    first visit of each day.
+    """
+    session = request.session
+    day = today().toordinal()
+    visits = session.get(VISITS_KEY)
+    if not isinstance(visits, int):
+        visits = 0
+
+    if session.get(LAST_VISIT_KEY) == day and visits:
+        return visits
+
+    visits += 1
+    session[VISITS_KEY] = visits
+    session[LAST_VISIT_KEY] = day
+
+    counter = get_visit_counter()
+    if counter is not None:
+        counter.incr(day)
+    return visits
+
+
+class DailyCounterMixin(object):
+    """
+    For counter buffers keyed on days (as date ordinals) rather than primary
+    keys: apply() adds each day's increments to the row for that date,
+    creating the row if it doesn't exist yet.
+    """
+
+    def apply(self, model, increments):
+        by_date = {datetime.date.fromordinal(day): n
+                   for day, n in increments.items()}
+        existing = set(model.objects.filter(date__in=list(by_date))
+                       .values_list('date', flat=True))
+
+        for date, n in by_date.items():
+            if date not in existing:
+                try:
+                    with transaction.atomic():
+                        model.objects.create(date=date, **{self.field: n})
+                    continue
+                except IntegrityError:
+                    # Another process created the row first.
+                    pass
+            model.objects.filter(date=date).update(
+                **{self.field: F(self.field) + n})
+
+
+class LocMemDailyVisitBuffer(DailyCounterMixin, LocMemCounterBuffer):
+    pass
+
+
+class CacheDailyVisitBuffer(DailyCounterMixin, CacheCounterBuffer):
+    pass
+
+
+_visit_counter = None
+_visit_counter_lock = threading.Lock()
+
+
+def get_visit_counter():
+    """
+    Returns the buffer for DailyVisits configured by
+    settings.RANGO_VISIT_COUNTER, or None if daily visits aren't counted.
+    """
+    global _visit_counter
+
+    config = getattr(settings, 'RANGO_VISIT_COUNTER', None)
+    if not config:
+        return None
+
+    if _visit_counter is None:
+        with _visit_counter_lock:
+            if _visit_counter is None:
+                _visit_counter = make_counter_buffer(
+                    config, LocMemDailyVisitBuffer, 'rango.DailyVisits', 'visits')
+    return _visit_counter
@@ -1,13 +1,29 @@
-import urllib.parse
+import logging
+import os
+import threading
+import time
+
 from django.conf import settings
+from django.core.cache import caches
 
 import requests
+from requests.adapters import HTTPAdapter
+
+from .circuit_breaker import CircuitBreaker
+from .metrics import (
+    record_cache_lookup, record_webhose_call, track_webhose_circuit_breaker
+)
+from .search_cache import get_result_cache, make_cache_key
 
+logger = logging.getLogger(__name__)
 
 SEARCH_KEY_PATH = settings.BASE_DIR + '/search.key'
 
+# Responses that are worth asking for again.
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
 
-def read_webhose_key():
+def read_webhose_key(path=SEARCH_KEY_PATH):
     """
     Reads the Webhose API key from a file called 'search.key'.
     Returns either None (no key found), or a string representing they key.
@@ -20,7 +36,7 @@ def read_webhose_key():
     webhose_api_key = None
 
     try:
-        with open(SEARCH_KEY_PATH, 'r') as f:
+        with open(path, 'r') as f:
             webhose_api_key = f.readline().strip()
     except:
         raise IOError('search.key file not found')
@@ -28,45 +44,87 @@ def read_webhose_key():
     return webhose_api_key
 
 
-def run_query(search_terms, size=10):
+class WebhoseClient(object):
     """
-    Given a string containing search terms (query), and a number of results to
-    return (default of 10), returns a list of results from the Webhose API,
-    with each result consisting of a title, link and summary.
+    A long-lived client for the Webhose API.
+
+    Requests go through a pooled requests.Session, so connections (and their
+    TLS handshakes) are kept alive and reused between searches. Every request
+    is bounded by a (connect, read) timeout, and connection errors or 5xx/429
+    responses are retried a bounded number of times with exponential backoff.
+    A search can also be given a deadline, which bounds all of its attempts
+    together.
+
+    The API key is read from key_path once, and only read again when the
+    file's modification time changes.
     """
-    webhose_api_key = read_webhose_key()
-
-    if not webhose_api_key:
-        raise KeyError('Webhose key not found')
-
-    # What's the base URL for the Webhose API?
-    root_url = 'https://webhose.io/search'
-
-    # Format the query string - escape special characters.
-    query_string = urllib.parse.quote(search_terms)
-
-    url_params = [
-        '{root_url}?',
-        'token={key}&',
-        'format=json&',
-        'q={query}&',
-        'sort=relevancy&',
-        'size={size}'
-    ]
-    search_url = ''.join(url_params).format(
-        root_url=root_url,
-        key=webhose_api_key,
-        query=query_string,
-        size=size
-    )
-    results = list()
 
-    try:
-        response = requests.get(search_url)
+    def __init__(self, root_url='https://webhose.io/search',
+                 key_path=SEARCH_KEY_PATH, timeout=(3.05, 5), max_retries=2,
+                 backoff_factor=0.3, pool_maxsize=10):
+        self.root_url = root_url
+        self.key_path = key_path
+        self.timeout = tuple(timeout)
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_maxsize)
+
+        self.session = requests.Session()
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+        self._key = None
+        self._key_mtime = None
+        self._key_lock = threading.Lock()
+
+    def api_key(self):
+        """
+        Returns the API key, reloading it if search.key has changed on disk.
+        """
+        try:
+            mtime = os.stat(self.key_path).st_mtime
+        except OSError:
+            raise IOError('search.key file not found')
+
+        if mtime != self._key_mtime:
+            with self._key_lock:
+                if mtime != self._key_mtime:
+                    self._key = read_webhose_key(self.key_path)
+                    self._key_mtime = mtime
+        return self._key
+
+    def search(self, search_terms, size=10, timeout=None, deadline=None):
+        """
+        Runs a query against the Webhose API and returns a list of results,
+        each a dictionary with a title, link and summary.
+        timeout overrides the client's (connect, read) timeout for this call.
+        deadline, a time.time() value, is when the call has to be over by,
+        retries included: each attempt's timeouts are cut down to the time
+        left, and no attempt is started once it has passed.
+        Raises a requests.RequestException if the request fails, or a
+        ValueError if the response is not valid JSON.
+        """
+        webhose_api_key = self.api_key()
+
+        if not webhose_api_key:
+            raise KeyError('Webhose key not found')
+
+        params = {
+            'token': webhose_api_key,
+            'format': 'json',
+            'q': search_terms,
+            'sort': 'relevancy',
+            'size': size,
+        }
+        response = self._get(params, timeout or self.timeout, deadline)
+        response.raise_for_status()
+
         # Loop through the posts, appending each to the results list as
         # a dictionary. We restrict the summary to the first 200 characters,
         # as summary responses from Webhose can be long!
-        for post in response.json()['posts']:
+        results = list()
+        for post in response.json().get('posts', []):
             results.append(
                 {
                     'title': post['title'],
@@ -74,8 +132,272 @@ def run_query(search_terms, size=10):
                     'summary': post['text'][:200]
                 }
             )
-    except:
-        print('Error when querying the Webhose API')
+        return results
+
+    def _get(self, params, timeout, deadline):
+        attempt = 1
+        while True:
+            if deadline is not None:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    raise requests.Timeout('Webhose search deadline passed')
+                timeout = tuple(min(t, remaining) for t in timeout)
+
+            try:
+                response = self.session.get(self.root_url, params=params,
+                                            timeout=timeout)
+            except (requests.ConnectionError, requests.Timeout):
+                if not self._may_retry(attempt, deadline):
+                    raise
+            else:
+                if (response.status_code not in RETRY_STATUSES
+                        or not self._may_retry(attempt, deadline)):
+                    return response
+                response.close()
+
+            time.sleep(self._backoff(attempt))
+            attempt += 1
+
+    def _backoff(self, attempt):
+        return self.backoff_factor * 2 ** (attempt - 1)
+
+    def _may_retry(self, attempt, deadline):
+        if attempt > self.max_retries:
+            return False
+        return (deadline is None
+                or time.time() + self._backoff(attempt) < deadline)
+
+    def close(self):
+        self.session.close()
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    """
+    Returns the module-level WebhoseClient configured by
+    settings.WEBHOSE_CLIENT, creating it on first use.
+    """
+    global _client
+
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = WebhoseClient(**getattr(settings, 'WEBHOSE_CLIENT', {}))
+    return _client
+
+
+_circuit_breaker = None
+_circuit_breaker_lock = threading.Lock()
+
+
+def get_circuit_breaker():
+    """
+    Returns the circuit breaker guarding the Webhose API, configured by
+    settings.WEBHOSE_CIRCUIT_BREAKER. Its state, trips and rejected calls
+    are reported on /metrics.
+    """
+    global _circuit_breaker
+
+    if _circuit_breaker is None:
+        with _circuit_breaker_lock:
+            if _circuit_breaker is None:
+                _circuit_breaker = CircuitBreaker(
+                    'webhose', **getattr(settings, 'WEBHOSE_CIRCUIT_BREAKER', {}))
+                track_webhose_circuit_breaker(_circuit_breaker)
+    return _circuit_breaker
+
+
+class _Call(object):
+    """
+    An in-flight call that other threads can wait on.
+    """
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight(object):
+    """
+    Coalesces concurrent calls for the same key: the first caller (the leader)
+    runs the function, and any caller that arrives while it is still running
+    waits for it and shares its result (or its exception).
+
+    This works between the threads of one process. To also coalesce between
+    processes, pass the alias of a shared cache from settings.CACHES; the
+    leader then takes a lock in that cache with cache.add(), and the leaders
+    of other processes wait for the result to show up in the result cache
+    instead of querying Webhose themselves. That requires the result cache to
+    be shared too (i.e. DjangoResultCache).
+    """
+
+    def __init__(self, cache_alias=None, lock_timeout=10, wait_timeout=5,
+                 poll_interval=0.05):
+        self.cache_alias = cache_alias
+        self.lock_timeout = lock_timeout
+        self.wait_timeout = wait_timeout
+        self.poll_interval = poll_interval
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn, peek=None):
+        """
+        Runs fn() once for all concurrent callers using the same key.
+        peek, if given, returns a result that is already there (e.g. in the
+        result cache, put there by a call that finished after this caller
+        last looked, or by another process), or None if there isn't one yet.
+
+        Callers wait for the leader for at most wait_timeout seconds, and
+        then look for the result or run fn() themselves.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self._calls[key] = call
+
+        if not leader:
+            if not call.done.wait(self.wait_timeout):
+                return self._peek_or_run(fn, peek)
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = self._run_locked(key, fn, peek)
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result
+
+    def _peek_or_run(self, fn, peek):
+        result = peek() if peek is not None else None
+        return result if result is not None else fn()
+
+    def _run_locked(self, key, fn, peek):
+        if self.cache_alias is None:
+            return self._peek_or_run(fn, peek)
+
+        cache = caches[self.cache_alias]
+        lock_key = key + ':lock'
+
+        if cache.add(lock_key, 1, self.lock_timeout):
+            try:
+                return self._peek_or_run(fn, peek)
+            finally:
+                cache.delete(lock_key)
+
+        # Another process is already fetching this key - wait for it to
+        # publish the result, for at most wait_timeout seconds.
+        deadline = time.time() + self.wait_timeout
+        while time.time() < deadline:
+            time.sleep(self.poll_interval)
+            if peek is not None:
+                result = peek()
+                if result is not None:
+                    return result
+            if cache.get(lock_key) is None:
+                break
+
+        # Either the other process finished without publishing a result or it
+        # is taking too long, so fetch it ourselves.
+        return self._peek_or_run(fn, peek)
+
+
+_single_flight = None
+_single_flight_lock = threading.Lock()
+
+
+def get_single_flight():
+    """
+    Returns the module-level SingleFlight configured by
+    settings.WEBHOSE_SINGLE_FLIGHT, creating it on first use.
+    """
+    global _single_flight
+
+    if _single_flight is None:
+        with _single_flight_lock:
+            if _single_flight is None:
+                _single_flight = SingleFlight(
+                    **getattr(settings, 'WEBHOSE_SINGLE_FLIGHT', {}))
+    return _single_flight
+
+
+def run_query(search_terms, size=10):
+    """
+    Given a string containing search terms (query), and a number of results to
+    return (default of 10), returns a list of results from the Webhose API,
+    with each result consisting of a title, link and summary.
+    Results are served from the search result cache when possible, so
+    repeated queries don't cost a round trip to Webhose, and concurrent
+    identical queries are coalesced into a single upstream request.
+    """
+    result_cache = get_result_cache()
+
+    results = result_cache.get(search_terms, size)
+    record_cache_lookup('webhose_results', results is not None)
+    if results is not None:
+        return results
+
+    def fetch():
+        results = query_webhose(search_terms, size)
+        if results is None:
+            # Webhose is failing or the circuit is open. Serve an empty list,
+            # but don't cache it, so we search again once it has recovered.
+            return []
+        result_cache.set(search_terms, size, results)
+        return results
+
+    def peek():
+        return result_cache.peek(search_terms, size)
+
+    results = get_single_flight().do(make_cache_key(search_terms, size),
+                                     fetch, peek)
+    # Every waiter gets its own copy of the shared result.
+    return list(results)
+
+
+def query_webhose(search_terms, size=10):
+    """
+    Queries the Webhose API directly, bypassing the result cache.
+    Returns None if Webhose could not be queried - either the request failed,
+    or the circuit breaker is open after too many failed or slow requests.
+
+    The whole search, retries included, is bounded by
+    settings.WEBHOSE_LATENCY_BUDGET (in seconds), so a slow upstream can't
+    hold a worker for longer than that.
+    """
+    breaker = get_circuit_breaker()
+    if not breaker.allow_request():
+        logger.warning('Webhose circuit is open, not searching for %r',
+                       search_terms)
+        return None
+
+    client = get_client()
+    latency_budget = getattr(settings, 'WEBHOSE_LATENCY_BUDGET', None)
+    start = time.time()
+    deadline = start + latency_budget if latency_budget else None
+    try:
+        results = client.search(search_terms, size, deadline=deadline)
+    except Exception as e:
+        elapsed = time.time() - start
+        breaker.record(elapsed, success=False)
+        record_webhose_call(elapsed, 'error')
+        if not isinstance(e, (requests.RequestException, ValueError)):
+            raise
+        logger.exception('Error when querying the Webhose API')
+        return None
 
-    # Return the list of results to the calling function.
+    elapsed = time.time() - start
+    breaker.record(elapsed)
+    record_webhose_call(elapsed, 'ok')
     return results
@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/1.10/ref/settings/
 """
 
 import os
+import tempfile
 
 import environ
 
@@ -61,11 +62,15 @@ LOCAL_APPS = [
 INSTALLED_APPS = DJANGO_APPS + THIRD_PARTY_APPS + LOCAL_APPS
 
 MIDDLEWARE = [
+    # First, so that it times everything below it.
+    'apps.rango.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    # Needs request.user, so after AuthenticationMiddleware.
+    'apps.rango.profiling.ProfilingMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -74,7 +79,8 @@ ROOT_URLCONF = 'config.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        # DjangoTemplates, timing renders for MetricsMiddleware.
+        'BACKEND': 'apps.rango.metrics.InstrumentedDjangoTemplates',
         'DIRS': [TEMPLATE_DIR, ],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -98,6 +104,11 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+        'TEST': {
+            # Use a file rather than an in-memory database, so that tests
+            # running several threads can share it.
+            'NAME': os.path.join(BASE_DIR, 'test_db.sqlite3'),
+        },
     }
 }
 
@@ -149,6 +160,18 @@ STATICFILES_DIRS = [STATIC_DIR, ]
 MEDIA_URL = '/media/'
 MEDIA_ROOT = MEDIA_DIR
 
+# Profile pictures are shown as square JPEG thumbnails in these sizes (in
+# pixels), made by a background task after each upload. With the database
+# task backend, "manage.py run_worker" can make them in a pool of processes;
+# set processes to its size. Until a thumbnail is ready the original picture
+# is shown. Run "manage.py make_thumbnails" to make them for pictures
+# uploaded before.
+RANGO_THUMBNAILS = {
+    'sizes': {'small': 64, 'medium': 300},
+    'quality': 85,
+    'processes': 0,
+}
+
 
 # Registration
 
@@ -167,3 +190,212 @@ LOGIN_REDIRECT_URL = '/rango/'
 # The page users are directed to if they are not logged in,
 # and are trying to access pages requiring authentication
 LOGIN_URL = '/accounts/login/'
+
+
+# Counters
+
+# Page views recorded by the goto view are buffered and written back in
+# batches every flush_interval seconds, or as soon as max_pending views are
+# waiting. Use apps.rango.counters.CacheCounterBuffer (with a 'cache_alias'
+# option) to keep the pending views in a shared cache instead of in-process.
+# That cache must have an atomic incr(), as memcached and Redis do; the
+# default file cache doesn't, and LocMemCounterBuffer is used instead.
+RANGO_VIEW_COUNTER = {
+    'BACKEND': 'apps.rango.counters.LocMemCounterBuffer',
+    'OPTIONS': {
+        'flush_interval': 5,
+        'max_pending': 500,
+    },
+}
+
+# Each visitor's first visit of the day is also added to that day's
+# DailyVisits row, in batches like the page views above. Set to None to stop
+# counting daily visits.
+RANGO_VISIT_COUNTER = {
+    'BACKEND': 'apps.rango.visits.LocMemDailyVisitBuffer',
+    'OPTIONS': {
+        'flush_interval': 30,
+        'max_pending': 500,
+    },
+}
+
+# Likes are spread over this many shard rows per category, and moved onto
+# Category.likes by "manage.py rollup_likes".
+RANGO_LIKE_SHARDS = 8
+
+# Flushed page views are also logged as clicks, which "manage.py
+# update_trending --interval 5" folds into hourly click counts and trending
+# scores. A click counts half as much for every half_life seconds since it
+# was made; the top pages and categories are cached for the index page and
+# /rango/api/pages/trending/, for at most cache_timeout seconds between runs.
+# Logged clicks are deleted after retention seconds. Clicks are only folded
+# in, here and by the daily rollups, once they are lag seconds old, so that
+# ones whose transaction commits late aren't skipped.
+RANGO_TRENDING = {
+    'half_life': 6 * 60 * 60,
+    'top': 10,
+    'cache_timeout': 60,
+    'retention': 7 * 24 * 60 * 60,
+    'lag': 5,
+}
+
+
+# Background tasks
+
+# Deferred work, such as updating the local search index, runs on a pool of
+# worker threads in each process, from a queue of at most max_queue tasks.
+# Use apps.rango.tasks.DatabaseBackend to queue tasks in the database
+# instead, and run them with "manage.py run_worker".
+RANGO_TASKS = {
+    'BACKEND': 'apps.rango.tasks.ThreadPoolBackend',
+    'OPTIONS': {
+        'workers': 4,
+        'max_queue': 1000,
+    },
+}
+
+
+# Caching
+
+# The default cache holds the generation numbers that invalidate cached pages,
+# categories, suggestions and stats (see apps.rango.generations), so it must
+# be shared by every process that serves requests or runs management
+# commands: with a per-process cache such as LocMemCache, a change made in
+# one process leaves the others serving what they cached before it. The
+# default file cache is shared by the processes on one host; set
+# DJANGO_CACHE_URL (e.g. to memcache://10.0.0.1:11211) when there are more.
+CACHES = {
+    'default': env.cache(
+        'DJANGO_CACHE_URL',
+        default='filecache://{0}?max_entries=10000'.format(
+            os.path.join(tempfile.gettempdir(), 'tango_with_django_cache'))),
+}
+
+# The rendered category sidebar is cached for this many seconds. It is
+# invalidated whenever a category is added, changed or deleted.
+RANGO_SIDEBAR_CACHE_TIMEOUT = 60 * 60
+
+# Category pages show this many pages at a time, most viewed first. The first
+# page of each category is cached for up to RANGO_CATEGORY_CACHE_TIMEOUT
+# seconds, and invalidated when its pages change, or when new view counts
+# change which pages it shows or their order. The view counts it shows may
+# be that many seconds old.
+RANGO_CATEGORY_PAGE_SIZE = 20
+RANGO_CATEGORY_CACHE_TIMEOUT = 5 * 60
+
+# Anonymous visitors get index, about and category pages from a full-page
+# cache, for up to RANGO_PAGE_CACHE_TIMEOUT seconds. Pages are invalidated
+# when categories or pages change, and when page views are flushed: always
+# for the index, and for category pages as described above.
+RANGO_PAGE_CACHE_TIMEOUT = 5 * 60
+
+# Responses from /rango/api/stats/ are cached for this many seconds, and
+# invalidated whenever "manage.py rollup_stats" or "manage.py rollup_likes"
+# add to the daily stats. The commands run in processes of their own, so
+# this relies on the shared default cache (see CACHES above).
+RANGO_STATS_CACHE_TIMEOUT = 60 * 60
+
+# Sessions are read from the cache, falling back to the database, so that
+# serving a cached page to a returning visitor doesn't need a query.
+SESSION_ENGINE = 'django.contrib.sessions.backends.cached_db'
+
+# Category suggestions are served from an in-memory index, ranked by 'likes'
+# or 'views'. The index is reloaded when another process changes a category,
+# and in the background every max_age seconds to pick up new like and view
+# counts.
+RANGO_SUGGESTIONS = {
+    'rank_by': 'likes',
+    'max_age': 300,
+}
+
+
+# Search
+
+# The backend used by the search views. WebhoseSearchBackend searches the web;
+# SQLiteSearchBackend and PostgresSearchBackend search our own categories and
+# pages through the database's full-text index. After switching to a local
+# backend, run "manage.py rebuild_search_index" to fill the index.
+RANGO_SEARCH_BACKEND = {
+    'BACKEND': 'apps.rango.search_backends.WebhoseSearchBackend',
+    'OPTIONS': {},
+}
+
+# Webhose search
+
+# Results from the Webhose API are cached, keyed on the normalised query and
+# the number of results. Empty results are cached for negative_timeout seconds.
+# Use apps.rango.search_cache.DjangoResultCache (with a 'cache_alias' option)
+# to share the cache between processes through the CACHES setting.
+WEBHOSE_SEARCH_CACHE = {
+    'BACKEND': 'apps.rango.search_cache.LocMemResultCache',
+    'OPTIONS': {
+        'timeout': 300,
+        'negative_timeout': 30,
+        'max_entries': 1000,
+    },
+}
+
+# Connection settings for the Webhose API client. Connections are pooled and
+# kept alive; timeout is a (connect, read) pair in seconds.
+WEBHOSE_CLIENT = {
+    'root_url': 'https://webhose.io/search',
+    'timeout': (3.05, 5),
+    'max_retries': 2,
+    'backoff_factor': 0.3,
+    'pool_maxsize': 10,
+}
+
+# Concurrent identical searches share one upstream request. Set cache_alias to
+# a cache in CACHES that all processes share (along with DjangoResultCache
+# above) to coalesce searches between processes as well as threads.
+WEBHOSE_SINGLE_FLIGHT = {
+    'cache_alias': None,
+    'lock_timeout': 10,
+    'wait_timeout': 5,
+}
+
+# A search on Webhose may take at most this many seconds, retries included.
+WEBHOSE_LATENCY_BUDGET = 2.0
+
+# After failure_threshold failed searches (or searches slower than
+# slow_call_threshold seconds) in a row, stop calling Webhose for
+# reset_timeout seconds, then let a single probe request through.
+WEBHOSE_CIRCUIT_BREAKER = {
+    'failure_threshold': 5,
+    'slow_call_threshold': 1.5,
+    'reset_timeout': 30,
+}
+
+
+# Export
+
+# Exports ("manage.py export_rango" and /rango/export/) fetch this many rows
+# per query, so memory use stays the same however large the tables grow.
+RANGO_EXPORT_CHUNK_SIZE = 2000
+
+
+# Benchmarks
+
+# "manage.py benchmark_rango" appends its results here, one JSON object per
+# run, and compares each run with the last one from a different commit.
+RANGO_BENCHMARK_RESULTS = os.path.join(BASE_DIR, 'benchmark_results.jsonl')
+
+
+# Metrics and profiling
+
+# Per-view request metrics are served in the Prometheus text format at
+# /metrics, to staff and to these addresses (e.g. the Prometheus server).
+# Behind a proxy every request comes from the proxy's address, so only list
+# addresses that reach this server directly.
+RANGO_METRICS_IPS = []
+
+# A sample_rate fraction of requests is profiled with cProfile, as is any
+# request a staff user makes with ?profile in the query string. Sampled
+# requests faster than min_duration seconds are dropped. Profiles can be
+# listed and downloaded in the admin; only the last max_profiles are kept.
+RANGO_PROFILING = {
+    'sample_rate': 0,
+    'param': 'profile',
+    'min_duration': 0,
+    'max_profiles': 500,
+}
@@ -3,6 +3,13 @@ from .base import *
 # Toggle DEBUG
 DEBUG = True
 
+# runserver and the tests run in one process, so they can use a cache of
+# their own. Commands run alongside runserver then don't invalidate what it
+# has cached; set DJANGO_CACHE_URL to share a cache with them.
+CACHES = {
+    'default': env.cache('DJANGO_CACHE_URL', default='locmemcache://'),
+}
+
 
 INSTALLED_APPS += [
     'django_extensions'
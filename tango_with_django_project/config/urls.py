@@ -34,6 +34,7 @@ class MyRegistrationView(RegistrationView):
 urlpatterns = [
     url(r'^$', views.index, name='index'),
     url(r'^rango/', include('apps.rango.urls', namespace='rango')),
+    url(r'^metrics$', views.metrics, name='metrics'),
     url(r'^accounts/register/$',
         MyRegistrationView.as_view(),
         name='registration_register'),